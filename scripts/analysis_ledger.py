@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Append-only checkpoint ledger for transit analysis runs
+
+Every finished target is appended to analysis_ledger*.jsonl in the output
+directory as one JSON line and fsync'd immediately, so a job that hits its
+walltime or is preempted keeps everything it finished. On restart the
+analyzer loads all ledgers in the output directory and skips inputs whose
+filename, size and modification time match a ledger record analyzed with
+the same search parameters (each record carries their digest, see
+params_digest); records of other parameters are analyzed again.
+"""
+
+import os
+import json
+import hashlib
+from glob import glob
+
+from lightcurve_archive import split_member, member_key
+
+def ledger_filename(shard_index=0, num_shards=1):
+    """
+    Ledger file written by one run (or one shard of a run)
+
+    Each shard appends to its own file so array tasks never share a file
+    handle over NFS; every ledger in the directory is read on restart.
+    """
+    if num_shards == 1:
+        return 'analysis_ledger.jsonl'
+    return f'analysis_ledger.shard-{shard_index:04d}-of-{num_shards:04d}.jsonl'
+
+def file_key(path):
+    """
+    Identity of an input file: (basename, size in bytes, whole-second mtime)
+
+    Whole seconds keep keys stable across NFS clients with coarser
+    timestamp resolution. Entries of a packed archive use their entry
+    name, packed size and the time they were added. A tuple of paths (the
+    sectors of one star, --multi-sector) is keyed by all of its files, so
+    a new sector makes it a new input.
+    """
+    if isinstance(path, tuple):
+        keys = [file_key(p) for p in path]
+        return '+'.join(k[0] for k in keys), sum(k[1] for k in keys), max(k[2] for k in keys)
+    if split_member(path):
+        return member_key(path)
+    st = os.stat(path)
+    return os.path.basename(path), st.st_size, int(st.st_mtime)
+
+def params_digest(params):
+    """
+    Short digest of a dict of (JSON-serializable) parameters
+
+    Equal for the parameters of a run and the same parameters read back
+    from its run_params table (load_run_params).
+    """
+    encoded = json.dumps(params, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+def load_ledgers(output_dir):
+    """
+    Read every ledger in output_dir
+
+    Returns:
+        dict mapping file_key -> record (later records win)
+    """
+    records = {}
+
+    for ledger_file in sorted(glob(os.path.join(output_dir, 'analysis_ledger*.jsonl'))):
+        with open(ledger_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    key = (record['file'], record['size'], record['mtime'])
+                except (ValueError, KeyError):
+                    # A kill mid-write can leave a truncated last line
+                    continue
+                records[key] = record
+
+    return records
+
+def open_ledger(ledger_path):
+    """
+    Open a ledger for appending and return the raw file descriptor
+    """
+    os.makedirs(os.path.dirname(ledger_path) or '.', exist_ok=True)
+    return os.open(ledger_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+def append_record(fd, key, status, result=None, error=None, object_key=None, params=None):
+    """
+    Append one target's outcome to the ledger and force it to disk
+
+    Parameters:
+    -----------
+    fd : int
+        File descriptor from open_ledger
+    key : tuple
+        file_key of the input file
+    status : str
+        'ok' or 'error'
+    result : dict
+        Result returned by analyze_lightcurve (status 'ok')
+    error : str
+        Error message (status 'error')
+    object_key : str
+        Key of the light-curve store object the input is a view of, which
+        lets other runs reuse the result (see lc_store.py)
+    params : str
+        params_digest of the search parameters the result was produced with
+    """
+    name, size, mtime = key
+    record = {'file': name, 'size': size, 'mtime': mtime, 'status': status}
+    if result is not None:
+        record['result'] = result
+    if error is not None:
+        record['error'] = error
+    if object_key is not None:
+        record['object'] = object_key
+    if params is not None:
+        record['params'] = params
+
+    # One write() per record: a signal can't land between partial writes
+    os.write(fd, (json.dumps(record) + '\n').encode())
+    os.fsync(fd)
+    return record
+
+def count_records(output_dir):
+    """
+    Number of targets recorded in the ledgers of output_dir (finished or
+    failed), without parsing the records
+    """
+    count = 0
+    for ledger_file in glob(os.path.join(output_dir, 'analysis_ledger*.jsonl')):
+        with open(ledger_file, 'rb') as f:
+            count += sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+    return count
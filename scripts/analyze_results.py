@@ -2,162 +2,177 @@
 """
 Analyze TESS transit detection results and identify strongest candidates.
 
-Reads analysis_summary.txt files from Phase 3 results and compiles:
+Ingests the outputs of the survey phases into the results catalog
+(results_catalog.sqlite, see results_catalog.py) and compiles:
 - Top candidates ranked by transit power
 - Statistics across all detections
-- CSV file ready for publication/Zenodo
+- CSV file (and optionally Parquet) ready for publication/Zenodo
+
+Only results files that are new or changed since the last run are read.
+Stars analyzed in more than one phase are counted once, with their
+strongest detection; the CSV lists every phase they were seen in.
 
 Usage:
     python analyze_results.py
+    python analyze_results.py --phase ../results/phase2b_toi_full=Phase2B_TOI
 """
 
 import os
-import re
-import pandas as pd
-import numpy as np
-from pathlib import Path
-
-def parse_analysis_summary(summary_file):
+import argparse
+import importlib.util
+
+from results_catalog import (CATALOG_DB, open_results_catalog, ingest, create_star_view,
+                             export_csv, export_parquet)
+
+# Output directory (under the results directory) -> phase label of the
+# random-star phases compiled by default
+RANDOM_PHASES = {
+    'phase3_random': 'Phase3_529',
+    'phase3_mega_analysis': 'Phase3_MEGA_4673',
+    'phase3_ultra_analysis': 'Phase3_ULTRA',
+}
+
+# The validation and TOI phases, added with --all-phases
+OTHER_PHASES = {
+    'phase1_confirmed': 'Phase1_Confirmed',
+    'phase2_toi': 'Phase2_TOI',
+    'phase2b_toi_full': 'Phase2B_TOI',
+}
+
+def _median(conn, view, column):
     """
-    Parse analysis_summary.txt file and extract transit parameters.
-
-    Returns:
-        DataFrame with columns: TIC_ID, data_points, period_days, transit_power
+    Median of a column of the star view (mean of the middle two for even counts)
     """
-    results = []
-
-    with open(summary_file, 'r') as f:
-        lines = f.readlines()
-
-    current_target = None
-    current_data = {}
-
-    for line in lines:
-        line = line.strip()
-
-        # Look for target line
-        if line.startswith('Target: TIC_'):
-            if current_target and current_data:
-                results.append(current_data)
-
-            current_target = line.split('Target: ')[1]
-            current_data = {'TIC_ID': current_target}
-
-        # Extract data points
-        elif 'Data points:' in line:
-            match = re.search(r'Data points:\s*(\d+)', line)
-            if match:
-                current_data['data_points'] = int(match.group(1))
-
-        # Extract period
-        elif 'Best period:' in line:
-            match = re.search(r'Best period:\s*([\d.]+)', line)
-            if match:
-                current_data['period_days'] = float(match.group(1))
-
-        # Extract transit power
-        elif 'Transit power:' in line:
-            match = re.search(r'Transit power:\s*([\d.]+)', line)
-            if match:
-                current_data['transit_power'] = float(match.group(1))
-
-    # Add last target
-    if current_target and current_data:
-        results.append(current_data)
-
-    df = pd.DataFrame(results)
-    return df
-
-
-def analyze_phase3_results(base_dir='/homes/tylerdoe/beocat-astronomy/results'):
+    n = conn.execute(f'SELECT COUNT({column}) FROM {view}').fetchone()[0]
+    rows = conn.execute(f'SELECT {column} FROM {view} WHERE {column} IS NOT NULL '
+                        f'ORDER BY {column} LIMIT ? OFFSET ?',
+                        (2 - n % 2, (n - 1) // 2)).fetchall()
+    return sum(r[0] for r in rows) / len(rows)
+
+def _print_candidates(rows, rank=False):
+    if rank:
+        print(f"{'Rank':<5} {'TIC ID':<20} {'Period':<12} {'Power':<15} {'Phase':<20}")
+    else:
+        print(f"{'TIC ID':<20} {'Period':<12} {'Power':<15} {'Phase':<20}")
+    print("-" * 70)
+    for idx, (target, period, power, phase, phases) in enumerate(rows, 1):
+        prefix = f"{idx:<5} " if rank else ""
+        # Phase of the strongest detection, and how many others saw the star
+        others = len(set(phases.split(','))) - 1
+        if others:
+            phase += f" (+{others})"
+        print(f"{prefix}{target:<20} {period:>8.4f} d  {power:>12,.1f}  {phase:<20}")
+
+def analyze_phase3_results(base_dir='../results', phase_dirs=None, catalog=None,
+                           output_file=None, parquet_file=None):
     """
-    Analyze all Phase 3 results and compile statistics.
+    Ingest the phase outputs and compile statistics across all of them.
+
+    Parameters:
+    -----------
+    base_dir : str
+        Results directory holding the phase output directories
+    phase_dirs : dict
+        Output directory -> phase label to compile (default: the random-star
+        phases in RANDOM_PHASES under base_dir)
+    catalog : str
+        Results catalog database (default: base_dir/results_catalog.sqlite)
+    output_file : str
+        Compiled CSV (default: base_dir/phase3_all_random_stars_compiled.csv)
+    parquet_file : str
+        Also write the compiled table as Parquet (needs pyarrow)
+
+    Returns:
+        Number of stars compiled, or None if there are no results
     """
+    if phase_dirs is None:
+        phase_dirs = {os.path.join(base_dir, d): label for d, label in RANDOM_PHASES.items()}
+    conn = open_results_catalog(catalog or os.path.join(base_dir, CATALOG_DB))
 
     print("=" * 70)
-    print("TESS Random Star Analysis - Results Summary")
+    print("TESS Transit Survey - Results Summary")
     print("=" * 70)
     print()
 
-    # Phase 3 original (529 stars)
-    phase3_file = os.path.join(base_dir, 'phase3_random', 'analysis_summary.txt')
-    phase3_mega_file = os.path.join(base_dir, 'phase3_mega_analysis', 'analysis_summary.txt')
-
-    all_results = []
-
-    # Parse Phase 3 (529 stars)
-    if os.path.exists(phase3_file):
-        print("Loading Phase 3 results (529 random stars)...")
-        df_phase3 = parse_analysis_summary(phase3_file)
-        df_phase3['phase'] = 'Phase3_529'
-        all_results.append(df_phase3)
-        print(f"  ✓ Loaded {len(df_phase3)} targets")
-        print(f"  Transit power range: {df_phase3['transit_power'].min():.1f} to {df_phase3['transit_power'].max():.1f}")
+    try:
+        return _report(conn, base_dir, phase_dirs, output_file, parquet_file)
+    finally:
+        conn.close()
+
+def _report(conn, base_dir, phase_dirs, output_file, parquet_file):
+    phases = []
+    for results_dir, phase in phase_dirs.items():
+        if not os.path.isdir(results_dir):
+            continue
+        n_sources, n_rows = ingest(conn, results_dir, phase)
+        phases.append(phase)
+        print(f"Loading {phase} results from {results_dir}...")
+        if n_sources:
+            print(f"  ✓ Ingested {n_rows} targets from {n_sources} new or changed file(s)")
+        else:
+            print("  ✓ Unchanged since the last run, using the catalog")
+        n, low, high = conn.execute('SELECT COUNT(*), MIN(power), MAX(power) FROM detections '
+                                    'WHERE phase = ?', (phase,)).fetchone()
+        if n:
+            print(f"  {n} targets, transit power range: {low:.1f} to {high:.1f}")
         print()
 
-    # Parse Phase 3 MEGA (4,673 stars)
-    if os.path.exists(phase3_mega_file):
-        print("Loading Phase 3 MEGA results (4,673 random stars)...")
-        df_mega = parse_analysis_summary(phase3_mega_file)
-        df_mega['phase'] = 'Phase3_MEGA_4673'
-        all_results.append(df_mega)
-        print(f"  ✓ Loaded {len(df_mega)} targets")
-        print(f"  Transit power range: {df_mega['transit_power'].min():.1f} to {df_mega['transit_power'].max():.1f}")
-        print()
-
-    # Combine all results
-    if not all_results:
+    view = create_star_view(conn, phases)
+    total, n_detections = conn.execute(f'SELECT COUNT(*), SUM(n_detections) FROM {view}').fetchone()
+    if not total:
         print("ERROR: No results found!")
         return None
 
-    df_all = pd.concat(all_results, ignore_index=True)
-
     print("=" * 70)
-    print(f"COMBINED RESULTS: {len(df_all)} total random stars analyzed")
+    print(f"COMBINED RESULTS: {total} unique stars analyzed")
+    if n_detections > total:
+        print(f"  ({n_detections} detections; stars in several phases keep their strongest)")
     print("=" * 70)
     print()
 
+    mean_power, max_power, min_period, max_period = conn.execute(
+        f'SELECT AVG(power), MAX(power), MIN(period), MAX(period) FROM {view}').fetchone()
+
     # Overall statistics
     print("OVERALL STATISTICS:")
-    print(f"  Total targets: {len(df_all)}")
-    print(f"  Mean transit power: {df_all['transit_power'].mean():.2f}")
-    print(f"  Median transit power: {df_all['transit_power'].median():.2f}")
-    print(f"  Max transit power: {df_all['transit_power'].max():.2f}")
+    print(f"  Total targets: {total}")
+    print(f"  Mean transit power: {mean_power:.2f}")
+    print(f"  Median transit power: {_median(conn, view, 'power'):.2f}")
+    print(f"  Max transit power: {max_power:.2f}")
     print()
 
     # Period statistics
     print("PERIOD DISTRIBUTION:")
-    print(f"  Min period: {df_all['period_days'].min():.3f} days")
-    print(f"  Max period: {df_all['period_days'].max():.3f} days")
-    print(f"  Median period: {df_all['period_days'].median():.3f} days")
+    print(f"  Min period: {min_period:.3f} days")
+    print(f"  Max period: {max_period:.3f} days")
+    print(f"  Median period: {_median(conn, view, 'period'):.3f} days")
     print()
 
     # Categorize by transit power
-    strong = df_all[df_all['transit_power'] > 1000]
-    moderate = df_all[(df_all['transit_power'] > 100) & (df_all['transit_power'] <= 1000)]
-    weak = df_all[df_all['transit_power'] <= 100]
+    strong, moderate, weak = conn.execute(
+        f'SELECT SUM(power > 1000), SUM(power > 100 AND power <= 1000), SUM(power <= 100) '
+        f'FROM {view}').fetchone()
 
     print("DETECTIONS BY STRENGTH:")
-    print(f"  Strong (power > 1,000): {len(strong)} candidates ({len(strong)/len(df_all)*100:.1f}%)")
-    print(f"  Moderate (100-1,000): {len(moderate)} candidates ({len(moderate)/len(df_all)*100:.1f}%)")
-    print(f"  Weak (< 100): {len(weak)} candidates ({len(weak)/len(df_all)*100:.1f}%)")
+    print(f"  Strong (power > 1,000): {strong} candidates ({strong/total*100:.1f}%)")
+    print(f"  Moderate (100-1,000): {moderate} candidates ({moderate/total*100:.1f}%)")
+    print(f"  Weak (< 100): {weak} candidates ({weak/total*100:.1f}%)")
     print()
 
-    # Top 20 candidates
-    top20 = df_all.nlargest(20, 'transit_power')
+    candidates = f'SELECT target, period, power, phase, phases FROM {view} '
 
+    # Top 20 candidates
     print("=" * 70)
     print("TOP 20 STRONGEST CANDIDATES")
     print("=" * 70)
     print()
-    print(f"{'Rank':<5} {'TIC ID':<20} {'Period':<12} {'Power':<15} {'Phase':<20}")
-    print("-" * 70)
-    for idx, (i, row) in enumerate(top20.iterrows(), 1):
-        print(f"{idx:<5} {row['TIC_ID']:<20} {row['period_days']:>8.4f} d  {row['transit_power']:>12,.1f}  {row['phase']:<20}")
+    _print_candidates(conn.execute(candidates + 'ORDER BY power DESC, target LIMIT 20'),
+                      rank=True)
     print()
 
     # Candidates for ExoFOP submission (power > 10,000)
-    exofop_candidates = df_all[df_all['transit_power'] > 10000]
+    exofop_candidates = conn.execute(candidates + 'WHERE power > 10000 '
+                                     'ORDER BY power DESC, target').fetchall()
 
     print("=" * 70)
     print(f"CANDIDATES FOR ExoFOP SUBMISSION (power > 10,000): {len(exofop_candidates)}")
@@ -165,10 +180,7 @@ def analyze_phase3_results(base_dir='/homes/tylerdoe/beocat-astronomy/results'):
     print()
 
     if len(exofop_candidates) > 0:
-        print(f"{'TIC ID':<20} {'Period':<12} {'Power':<15} {'Phase':<20}")
-        print("-" * 70)
-        for i, row in exofop_candidates.iterrows():
-            print(f"{row['TIC_ID']:<20} {row['period_days']:>8.4f} d  {row['transit_power']:>12,.1f}  {row['phase']:<20}")
+        _print_candidates(exofop_candidates)
         print()
         print("** These candidates should be visually inspected before ExoFOP submission **")
         print("** Check plots to confirm transit shape and rule out false positives **")
@@ -177,33 +189,72 @@ def analyze_phase3_results(base_dir='/homes/tylerdoe/beocat-astronomy/results'):
         print("Consider lowering threshold or visually inspecting top 20 candidates.")
     print()
 
-    # Save compiled CSV
-    output_file = os.path.join(base_dir, 'phase3_all_random_stars_compiled.csv')
-    df_all_sorted = df_all.sort_values('transit_power', ascending=False)
-    df_all_sorted.to_csv(output_file, index=False)
+    # Save compiled CSV (streamed from the catalog, strongest first)
+    output_file = output_file or os.path.join(base_dir, 'phase3_all_random_stars_compiled.csv')
+    n_written = export_csv(conn, output_file, phases)
 
     print("=" * 70)
     print(f"RESULTS SAVED")
     print("=" * 70)
     print(f"  CSV file: {output_file}")
-    print(f"  Total entries: {len(df_all_sorted)}")
+    if parquet_file:
+        export_parquet(conn, parquet_file, phases)
+        print(f"  Parquet file: {parquet_file}")
+    print(f"  Total entries: {n_written}")
     print()
 
     print("NEXT STEPS:")
-    print("  1. Visually inspect top 20 candidates (check plots)")
-    print("  2. Cross-check TIC IDs with TOI catalog (avoid duplicates)")
+    print("  1. Visually inspect top 20 candidates (render_plots.py --top 20)")
+    print("  2. Label known planets and their aliases "
+          "(crossmatch_catalogs.py --toi-catalog ../data/toi_catalog.csv)")
     print("  3. Select 5-10 strongest for ExoFOP submission")
     print("  4. Upload CSV + top plots to Zenodo")
     print()
 
-    return df_all_sorted
+    return n_written
 
+def parse_phase(spec):
+    """
+    argparse type for --phase DIR=LABEL (LABEL defaults to the directory name)
+    """
+    results_dir, _, label = spec.partition('=')
+    return results_dir, label or os.path.basename(os.path.normpath(results_dir))
 
-if __name__ == '__main__':
-    df = analyze_phase3_results()
 
-    if df is not None:
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile TESS transit results across phases')
+    parser.add_argument('-r', '--results-dir', type=str, default='../results',
+                        help='Directory holding the phase output directories (default: ../results)')
+    parser.add_argument('--phase', type=parse_phase, action='append', default=None,
+                        metavar='DIR=LABEL',
+                        help='Compile this output directory under this phase label (repeatable; '
+                             'default: the Phase 3 random-star directories under --results-dir)')
+    parser.add_argument('--all-phases', action='store_true',
+                        help='Compile the Phase 1/2/2B directories too (CSV default: '
+                             '<results-dir>/all_phases_compiled.csv)')
+    parser.add_argument('--catalog', type=str, default=None,
+                        help=f'Results catalog database (default: <results-dir>/{CATALOG_DB})')
+    parser.add_argument('--csv', type=str, default=None,
+                        help='Compiled CSV (default: <results-dir>/phase3_all_random_stars_compiled.csv)')
+    parser.add_argument('--parquet', type=str, default=None,
+                        help='Also write the compiled table as Parquet (needs pyarrow)')
+
+    args = parser.parse_args()
+    if args.parquet and importlib.util.find_spec('pyarrow') is None:
+        parser.error('--parquet needs pyarrow (pip install pyarrow)')
+
+    phase_dirs = dict(args.phase) if args.phase else None
+    if args.all_phases:
+        known = {**RANDOM_PHASES, **OTHER_PHASES}
+        phase_dirs = {os.path.join(args.results_dir, d): label for d, label in known.items()}
+        phase_dirs.update(args.phase or [])
+        if args.csv is None:
+            args.csv = os.path.join(args.results_dir, 'all_phases_compiled.csv')
+    n = analyze_phase3_results(args.results_dir, phase_dirs, args.catalog, args.csv,
+                               args.parquet)
+
+    if n is not None:
         print("Analysis complete! ✓")
         print()
         print("To view results:")
-        print("  cat ~/beocat-astronomy/results/phase3_all_random_stars_compiled.csv | head -30")
+        print(f"  head -30 {args.csv or os.path.join(args.results_dir, 'phase3_all_random_stars_compiled.csv')}")
@@ -10,41 +10,105 @@ matplotlib.use('Agg')  # Non-interactive backend for HPC
 import matplotlib.pyplot as plt
 import lightkurve as lk
 import os
+import sys
+import time
+import shutil
+import signal
 import argparse
+import threading
+import multiprocessing
 from glob import glob
 
-def analyze_lightcurve(fits_file, output_dir='../results'):
-    """
-    Analyze a single TESS light curve for transits
+from analysis_ledger import (ledger_filename, file_key, load_ledgers, open_ledger, append_record,
+                             params_digest)
+from results_store import (results_db_filename, write_results, tic_from_name, load_run_params,
+                           RESULTS_DB)
+from bls_engine import (sector_statistics, combine_statistics, search_statistics,
+                        DEFAULT_DURATIONS, STATISTICS_EPOCH)
+from period_grid import plan_period_grid, GRID_METHODS
+from fits_loader import read_lightcurve, DEFAULT_QUALITY_BITMASK
+from preprocess import clean_arrays
+from preprocess_cache import (cache_key, open_cache, load_entry, store_entry, compact,
+                              DEFAULT_MAX_GB)
+from lightcurve_archive import (is_archive, split_member, member_path, list_entries, read_member,
+                                sector_stem, ARCHIVE_SUFFIX)
+from sector_stats import (grid_digest, stats_key, open_stats_cache, load_stats, store_stats,
+                          compact as compact_stats, DEFAULT_MAX_GB as STATS_MAX_GB)
+from download_manifest import completion_marker
+from lc_store import open_view_store
+import fast_plots
 
-    Parameters:
-    -----------
-    fits_file : str
-        Path to FITS file containing light curve
-    output_dir : str
-        Directory to save results
-    """
+# Light curve cleaning and BLS search parameters (recorded with every run)
+OUTLIER_SIGMA = 5
+FLATTEN_WINDOW = 401
+PERIOD_MIN = 0.5
+PERIOD_MAX = 20
+PERIOD_STEP = 0.001
 
-    # Load light curve using lightkurve's TESS-specific reader
-    lc = lk.read(fits_file)
+# FITS readers selectable with --loader
+LOADERS = ['fast', 'lightkurve']
 
-    # Get target name from filename
-    target_name = os.path.basename(fits_file).replace('.fits', '')
+# Search strategies selectable with --search
+SEARCH_MODES = ['full', 'coarse-to-fine']
 
-    print(f"\nAnalyzing {target_name}...")
-    print(f"  Data points: {len(lc)}")
-    print(f"  Time range: {lc.time.min().value:.2f} to {lc.time.max().value:.2f} days")
+# Plot renderers selectable with --plot-backend (fast: see fast_plots.py)
+PLOT_BACKENDS = ['pyplot', 'fast']
 
-    # Create output directory
-    os.makedirs(output_dir, exist_ok=True)
+# Coarse-to-fine defaults: bin width of the coarse pass (minutes), number
+# of coarse peaks refined at full resolution, and the half-width of each
+# refinement window in coarse grid steps
+COARSE_BIN_MINUTES = 20
+COARSE_TOP_PEAKS = 5
+REFINE_HALF_WIDTH = 3
+
+# --multi-sector: sectors share a trial grid planned for their combined
+# baseline rounded up to SECTOR_DAYS * 2^k, so a new sector changes the
+# grid (and invalidates cached sector statistics) only when the baseline
+# doubles. Grids are planned for at most MAX_GRID_BASELINE days: longer
+# baselines (sectors years apart) would need grids too large to keep per
+# sector, and are searched with the phase resolution of this one.
+SECTOR_DAYS = 27.4
+MAX_GRID_BASELINE = 8 * SECTOR_DAYS
 
+# --follow: seconds between scans of the data directory for new light
+# curves, and how long to wait for one before giving up on the downloader
+FOLLOW_POLL_SECONDS = 30
+FOLLOW_IDLE_TIMEOUT = 6 * 3600
+
+# Environment variables that control BLAS/OpenMP thread pools. Each pool
+# worker is pinned to one thread so N workers use exactly N cores.
+BLAS_THREAD_VARS = [
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+]
+
+# Signals SLURM sends before killing a job (SIGUSR1 via --signal=USR1@<secs>)
+STOP_SIGNALS = [signal.SIGTERM, signal.SIGUSR1]
+
+class AnalysisInterrupted(BaseException):
+    """
+    Raised in the main process when SLURM asks the job to stop
+
+    A BaseException (like KeyboardInterrupt) so the per-target
+    `except Exception` isolation does not swallow it.
+    """
+
+def clean_lightcurve(lc):
+    """
+    Normalize, clip and flatten a light curve for the transit search
+
+    Returns:
+        (cleaned light curve, flattened light curve)
+    """
     # Normalize and clean the light curve
     # Remove NaNs first
     lc = lc.remove_nans()
 
     # Manual normalization to avoid unit issues
     # Get median flux value and normalize
-    import numpy as np
     median_flux = np.nanmedian(lc.flux.value)
     lc.flux = lc.flux.value / median_flux  # Strip units and normalize
 
@@ -52,38 +116,275 @@ def analyze_lightcurve(fits_file, output_dir='../results'):
     if lc.flux_err is not None:
         lc.flux_err = lc.flux_err.value / median_flux
 
-    lc = lc.remove_outliers(sigma=5)
+    lc = lc.remove_outliers(sigma=OUTLIER_SIGMA)
 
     # Flatten to remove stellar variability
-    flat_lc = lc.flatten(window_length=401)
+    flat_lc = lc.flatten(window_length=FLATTEN_WINDOW)
 
-    # Run BLS (Box Least Squares) periodogram to find transits
-    print("  Running transit search...")
-    periodogram = flat_lc.to_periodogram(method='bls', period=np.arange(0.5, 20, 0.001))
+    return lc, flat_lc
 
-    # Get best period
-    best_period = periodogram.period_at_max_power
-    best_power = periodogram.max_power
+def _values(column):
+    """
+    Plain ndarray of a LightCurve column (drops units and any mask)
+    """
+    return np.asarray(getattr(column.value, 'unmasked', column.value))
 
-    print(f"  Best period found: {best_period:.4f} days")
-    print(f"  Transit power: {best_power:.4f}")
+def preprocess_parameters():
+    """
+    Parameters that determine the output of prepare_lightcurve (cache key)
+    """
+    return {
+        'flux_column': 'PDCSAP_FLUX',
+        'quality_bitmask': DEFAULT_QUALITY_BITMASK,
+        'outlier_sigma': OUTLIER_SIGMA,
+        'flatten_window': FLATTEN_WINDOW,
+    }
+
+def prepare_lightcurve(fits_file, loader='fast', preprocess_cache=None,
+                       cache_max_gb=DEFAULT_MAX_GB):
+    """
+    Load a light curve and clean it for the transit search
+
+    Parameters:
+    -----------
+    fits_file : str
+        Path to FITS file containing light curve, or to an entry of a
+        packed archive (archive.lcpack/TIC_123.fits)
+    loader : str
+        'fast' (fits_loader + preprocess on plain arrays) or 'lightkurve'
+        (lk.read + clean_lightcurve). Both give identical arrays for SPOC
+        files; 'fast' falls back to lightkurve for files it cannot parse.
+        Archive entries are always read as arrays.
+    preprocess_cache : str
+        SQLite file caching the cleaned arrays (see preprocess_cache.py);
+        None disables the cache
+    cache_max_gb : float
+        Size limit of the cache file
+
+    Returns:
+        dict with the cleaned arrays ('time', 'flux', 'flux_err',
+        'flat_flux', 'flat_err'), 'tic_id', 'sector' and the raw size and
+        time range ('n_raw', 'time_min', 'time_max')
+    """
+    if preprocess_cache:
+        key = cache_key(fits_file, preprocess_parameters())
+        conn = open_cache(preprocess_cache)
+        try:
+            prepared = load_entry(conn, key)
+            if prepared is None:
+                prepared, row = compact(prepare_lightcurve(fits_file, loader))
+                store_entry(conn, key, row, cache_max_gb * 1024 ** 3)
+        finally:
+            conn.close()
+        return prepared
+
+    raw = None
+    if split_member(fits_file):
+        # Packed entries hold the fast loader's arrays; there is no file for lk.read
+        raw = read_member(fits_file, DEFAULT_QUALITY_BITMASK)
+    elif loader == 'fast':
+        try:
+            raw = read_lightcurve(fits_file)
+        except (ValueError, KeyError) as e:
+            print(f"  Fast loader failed ({e}), using lightkurve")
+            loader = 'lightkurve'
+
+    if raw is not None:
+        prepared = clean_arrays(raw['time'], raw['flux'], raw['flux_err'],
+                                OUTLIER_SIGMA, FLATTEN_WINDOW)
+        raw_time = raw['time']
+        tic_id, sector = raw['tic_id'], raw['sector']
+    elif loader == 'lightkurve':
+        # Load light curve using lightkurve's TESS-specific reader
+        raw_lc = lk.read(fits_file)
+        raw_time = raw_lc.time.value
+        tic_id, sector = raw_lc.meta.get('TICID'), raw_lc.meta.get('SECTOR')
+
+        lc, flat_lc = clean_lightcurve(raw_lc)
+        prepared = {
+            'time': lc.time.value,
+            'flux': _values(lc.flux),
+            'flux_err': _values(lc.flux_err) if lc.flux_err is not None else None,
+            'flat_flux': _values(flat_lc.flux),
+            'flat_err': _values(flat_lc.flux_err) if flat_lc.flux_err is not None else None,
+        }
+    else:
+        raise ValueError(f"Unknown loader '{loader}'")
+
+    prepared['tic_id'] = int(tic_id) if tic_id is not None else None
+    prepared['sector'] = int(sector) if sector is not None else None
+    prepared['n_raw'] = len(raw_time)
+    prepared['time_min'] = float(np.min(raw_time))
+    prepared['time_max'] = float(np.max(raw_time))
+    return prepared
+
+def transit_search(time, flux, flux_err, periods, oversample=10):
+    """
+    Run a BLS search on a flattened light curve
+
+    Parameters:
+    -----------
+    time, flux, flux_err : array
+        Normalized, flattened light curve (flux_err may be None)
+    periods : array
+        Trial periods (days)
+    oversample : int
+        Phase bins per shortest trial duration
+
+    Returns:
+        dict with 'period' and 'power' arrays plus period_at_max_power,
+        max_power and depth/duration/transit_time at max power (floats)
+    """
+    flat_lc = lk.LightCurve(time=time, flux=flux, flux_err=flux_err)
+    periodogram = flat_lc.to_periodogram(method='bls', period=periods, oversample=oversample)
+    return {
+        'period': np.asarray(periodogram.period.value),
+        'power': np.asarray(periodogram.power.value),
+        'period_at_max_power': float(periodogram.period_at_max_power.value),
+        'max_power': float(periodogram.max_power.value),
+        'depth_at_max_power': float(periodogram.depth_at_max_power.value),
+        'duration_at_max_power': float(periodogram.duration_at_max_power.value),
+        'transit_time_at_max_power': float(periodogram.transit_time_at_max_power.value),
+    }
+
+def bin_lightcurve(time, flux, flux_err, bin_size):
+    """
+    Average a light curve into time bins of bin_size days
+
+    Empty bins are dropped and flux errors are propagated (sqrt(sum err^2) / n),
+    so the binned curve carries the same total weight into the BLS search.
+
+    Returns:
+        (binned time, binned flux, binned flux_err or None)
+    """
+    bin_index = np.floor((time - time.min()) / bin_size).astype(np.int64)
+    _, inverse, counts = np.unique(bin_index, return_inverse=True, return_counts=True)
+
+    binned_time = np.bincount(inverse, weights=time) / counts
+    binned_flux = np.bincount(inverse, weights=flux) / counts
+    binned_err = None
+    if flux_err is not None:
+        binned_err = np.sqrt(np.bincount(inverse, weights=np.square(flux_err, dtype=np.float64)))
+        binned_err /= counts
+
+    return binned_time, binned_flux, binned_err
+
+def select_peaks(periods, power, top_k, half_width):
+    """
+    Indices of the top_k strongest periodogram peaks
+
+    After each pick the half_width trials on either side are excluded, so
+    one broad peak is not returned several times.
+    """
+    power = np.where(np.isfinite(power), power, -np.inf)
+    peaks = []
+    for index in np.argsort(power)[::-1]:
+        if len(peaks) == top_k or power[index] == -np.inf:
+            break
+        if all(abs(index - p) > half_width for p in peaks):
+            peaks.append(int(index))
+    return peaks
+
+def coarse_to_fine_search(time, flux, flux_err, periods, coarse_grid='ofir',
+                          coarse_bin=COARSE_BIN_MINUTES, top_peaks=COARSE_TOP_PEAKS,
+                          min_transits=2):
+    """
+    Two-stage BLS search: binned data on a sparse grid, then full
+    resolution only around the strongest coarse peaks
+
+    Parameters:
+    -----------
+    time, flux, flux_err : array
+        Normalized, flattened light curve (flux_err may be None)
+    periods : array
+        Full-resolution trial periods; the refinement uses the ones that
+        fall inside the windows around the coarse peaks
+    coarse_grid : str
+        Planned grid method for the coarse pass ('ofir' or 'frequency')
+    coarse_bin : float
+        Coarse-pass bin width (minutes)
+    top_peaks : int
+        Number of coarse peaks refined at full resolution
+    min_transits : int
+        Passed to plan_period_grid for the coarse grid
+
+    Returns:
+        transit_search dict for the refined trials, plus 'coarse_period'
+        and 'coarse_power' arrays, 'coarse_peaks' (list of (period, power),
+        strongest first) and 'n_trials' (coarse + refined)
+    """
+    bin_size = coarse_bin / (24 * 60)
+    binned_time, binned_flux, binned_err = bin_lightcurve(time, flux, flux_err, bin_size)
+
+    # One trial per coarse step is enough on binned data; phase bins finer
+    # than the data bins add nothing
+    coarse_periods, _ = plan_period_grid(binned_time, periods.min(), periods.max(),
+                                         coarse_grid, oversample=1, min_transits=min_transits)
+    coarse_oversample = max(1, int(round(min(DEFAULT_DURATIONS) / bin_size)))
+    coarse = transit_search(binned_time, binned_flux, binned_err, coarse_periods,
+                            coarse_oversample)
+
+    peaks = select_peaks(coarse_periods, coarse['power'], top_peaks, REFINE_HALF_WIDTH)
+
+    refine = np.zeros(len(periods), dtype=bool)
+    last = len(coarse_periods) - 1
+    for index in peaks:
+        low = coarse_periods[max(index - REFINE_HALF_WIDTH, 0)]
+        high = coarse_periods[min(index + REFINE_HALF_WIDTH, last)]
+        refine |= (periods >= low) & (periods <= high)
+
+    search = transit_search(time, flux, flux_err, periods[refine])
+    search['coarse_period'] = coarse_periods
+    search['coarse_power'] = coarse['power']
+    search['coarse_peaks'] = [(float(coarse_periods[i]), float(coarse['power'][i]))
+                              for i in peaks]
+    search['n_trials'] = len(coarse_periods) + int(refine.sum())
+    return search
+
+def save_plots(target_name, time, flux, flat_flux, search, output_dir, backend='pyplot'):
+    """
+    Save the analysis figure (raw and flattened light curve, periodogram)
+    and the phase-folded light curve at the best period
+
+    backend 'fast' draws the same panels with figures reused across calls
+    (fast_plots.py)
+    """
+    if backend == 'fast':
+        fast_plots.render_plots(target_name, time, flux, flat_flux, search, output_dir)
+        return
+    if backend != 'pyplot':
+        raise ValueError(f"Unknown plot backend '{backend}'")
+
+    best_period = search['period_at_max_power']
 
     # Create plots
     fig, axes = plt.subplots(3, 1, figsize=(12, 10))
 
     # Plot 1: Raw light curve
-    lc.plot(ax=axes[0], label='Raw')
+    axes[0].plot(time, flux, color='k', linewidth=0.5, label='Raw')
+    axes[0].set_xlabel('Time - 2457000 [BTJD days]')
+    axes[0].set_ylabel('Normalized Flux')
     axes[0].set_title(f'{target_name} - Raw Light Curve')
     axes[0].legend()
 
     # Plot 2: Flattened light curve
-    flat_lc.plot(ax=axes[1], label='Flattened')
+    axes[1].plot(time, flat_flux, color='k', linewidth=0.5, label='Flattened')
+    axes[1].set_xlabel('Time - 2457000 [BTJD days]')
+    axes[1].set_ylabel('Normalized Flux')
     axes[1].set_title('Flattened Light Curve')
     axes[1].legend()
 
     # Plot 3: Periodogram
-    periodogram.plot(ax=axes[2])
-    axes[2].axvline(best_period.value, color='r', linestyle='--',
+    if 'coarse_period' in search:
+        axes[2].plot(search['coarse_period'], search['coarse_power'], color='0.6',
+                     linewidth=0.5, label='Coarse (binned)')
+        axes[2].plot(search['period'], search['power'], 'k.', markersize=1,
+                     label='Refined')
+    else:
+        axes[2].plot(search['period'], search['power'], color='k', linewidth=0.5)
+    axes[2].set_xlabel('Period [d]')
+    axes[2].set_ylabel('BLS Power')
+    axes[2].axvline(best_period, color='r', linestyle='--',
                     label=f'Best Period: {best_period:.4f} days')
     axes[2].set_title('BLS Periodogram')
     axes[2].legend()
@@ -98,9 +399,12 @@ def analyze_lightcurve(fits_file, output_dir='../results'):
     print(f"  Saved plot to {plot_file}")
 
     # Create phase-folded plot
+    # (phase relative to the first cadence, wrapped to +-P/2, as LightCurve.fold)
     fig, ax = plt.subplots(1, 1, figsize=(10, 6))
-    folded_lc = flat_lc.fold(period=best_period)
-    folded_lc.scatter(ax=ax, s=1, alpha=0.5)
+    phase = np.mod(time - time[0] + 0.5 * best_period, best_period) - 0.5 * best_period
+    ax.scatter(phase, flat_flux, s=1, alpha=0.5, color='k')
+    ax.set_xlabel('Phase [JD]')
+    ax.set_ylabel('Normalized Flux')
     ax.set_title(f'{target_name} - Phase-Folded at {best_period:.4f} days')
 
     folded_file = os.path.join(output_dir, f'{target_name}_folded.png')
@@ -109,57 +413,805 @@ def analyze_lightcurve(fits_file, output_dir='../results'):
 
     print(f"  Saved phase-folded plot to {folded_file}")
 
+def analyze_lightcurve(fits_file, output_dir='../results', period_grid='fixed', grid_oversample=3, min_transits=2,
+                       search_mode='full', coarse_bin=COARSE_BIN_MINUTES,
+                       top_peaks=COARSE_TOP_PEAKS, loader='fast', preprocess_cache=None,
+                       cache_max_gb=DEFAULT_MAX_GB, plots=True, plot_backend='pyplot'):
+    """
+    Analyze a single TESS light curve for transits
+
+    Parameters:
+    -----------
+    fits_file : str
+        Path to FITS file containing light curve
+    output_dir : str
+        Directory to save results
+    period_grid : str
+        Trial period grid (see period_grid.GRID_METHODS)
+    grid_oversample : float
+        Oversampling of the 'frequency' and 'ofir' grids
+    min_transits : int
+        Minimum number of transits the baseline must hold ('frequency'/'ofir')
+    search_mode : str
+        'full' or 'coarse-to-fine' (see coarse_to_fine_search)
+    coarse_bin : float
+        Coarse-pass bin width in minutes (coarse-to-fine)
+    top_peaks : int
+        Coarse peaks refined at full resolution (coarse-to-fine)
+    loader : str
+        FITS reader (see LOADERS and prepare_lightcurve)
+    preprocess_cache : str
+        Cache file for the cleaned light curves (None = no cache)
+    cache_max_gb : float
+        Size limit of the preprocessing cache
+    plots : bool
+        Save the analysis and phase-folded plots (False defers them to
+        render_plots.py)
+    plot_backend : str
+        Plot renderer (see PLOT_BACKENDS and save_plots)
+    """
+
+    # Load and clean the light curve
+    lc = prepare_lightcurve(fits_file, loader, preprocess_cache, cache_max_gb)
+    time, flat_flux, flat_err = lc['time'], lc['flat_flux'], lc['flat_err']
+
+    # Get target name from filename
+    target_name = os.path.basename(fits_file).replace('.fits', '')
+
+    print(f"\nAnalyzing {target_name}...")
+    print(f"  Data points: {lc['n_raw']}")
+    print(f"  Time range: {lc['time_min']:.2f} to {lc['time_max']:.2f} days")
+
+    # Create output directory
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Run BLS (Box Least Squares) periodogram to find transits
+    print("  Running transit search...")
+    periods, grid = plan_period_grid(time, PERIOD_MIN, PERIOD_MAX, period_grid,
+                                     PERIOD_STEP, grid_oversample, min_transits=min_transits)
+    if period_grid != 'fixed':
+        print(f"  Period grid: {grid['n_trials']} trials ({period_grid}, "
+              f"{grid['period_min']:.2f}-{grid['period_max']:.2f} days), "
+              f"{grid['n_fixed'] / grid['n_trials']:.1f}x fewer than the fixed grid")
+    if search_mode == 'coarse-to-fine':
+        coarse_grid = 'ofir' if period_grid == 'fixed' else period_grid
+        search = coarse_to_fine_search(time, flat_flux, flat_err, periods, coarse_grid,
+                                       coarse_bin, top_peaks, min_transits)
+        print("  Coarse peaks: " + ", ".join(f"{p:.4f} d" for p, _ in search['coarse_peaks']))
+        print(f"  Trials: {search['n_trials']} (coarse + refined) "
+              f"instead of {grid['n_trials']} at full resolution")
+    elif search_mode == 'full':
+        search = transit_search(time, flat_flux, flat_err, periods)
+        search['n_trials'] = grid['n_trials']
+    else:
+        raise ValueError(f"Unknown search mode '{search_mode}'")
+
+    # Get best period
+    best_period = search['period_at_max_power']
+    best_power = search['max_power']
+
+    print(f"  Best period found: {best_period:.4f} days")
+    print(f"  Transit power: {best_power:.4f}")
+
+    if plots:
+        save_plots(target_name, time, lc['flux'], flat_flux, search, output_dir, plot_backend)
+
+    tic_id = lc['tic_id'] or tic_from_name(target_name)
+    sector = lc['sector']
+
+    result = {
+        'target': target_name,
+        'tic_id': int(tic_id) if tic_id is not None else None,
+        'sector': int(sector) if sector is not None else None,
+        'n_points': len(time),
+        'period': best_period,
+        'power': best_power,
+        'depth': search['depth_at_max_power'],
+        'duration': search['duration_at_max_power'],
+        'transit_time': search['transit_time_at_max_power'],
+        'n_trials': search['n_trials']
+    }
+    if 'coarse_peaks' in search:
+        result['coarse_peaks'] = search['coarse_peaks']
+
+    return result
+
+def grid_baseline(baseline, max_baseline=MAX_GRID_BASELINE):
+    """
+    Baseline a multi-sector trial grid is planned for (see SECTOR_DAYS)
+    """
+    doublings = max(0, int(np.ceil(np.log2(max(baseline, SECTOR_DAYS) / SECTOR_DAYS))))
+    return min(SECTOR_DAYS * 2 ** doublings, max(max_baseline, SECTOR_DAYS))
+
+def _sector_statistics(fits_files, sectors, periods, weighted, stats_cache, stats_max_gb):
+    """
+    Yield the BLS statistics of each sector, from the cache where possible
+    """
+    conn = open_stats_cache(stats_cache) if stats_cache else None
+    search_params = {'grid': grid_digest(periods, DEFAULT_DURATIONS), 'oversample': 10,
+                     'epoch': STATISTICS_EPOCH, 'weighted': weighted}
+    try:
+        for fits_file, lc in zip(fits_files, sectors):
+            key = None
+            if conn is not None:
+                key = stats_key(fits_file, preprocess_parameters(), search_params)
+                stats = load_stats(conn, key, periods, DEFAULT_DURATIONS)
+                if stats is not None:
+                    yield stats
+                    continue
+            stats = sector_statistics(lc['time'], lc['flat_flux'],
+                                      lc['flat_err'] if weighted else None, periods,
+                                      DEFAULT_DURATIONS, epoch=STATISTICS_EPOCH)
+            if conn is not None:
+                stats, row = compact_stats(stats)
+                store_stats(conn, key, row, stats_max_gb * 1024 ** 3)
+                print(f"  Sector {lc['sector']}: folded and cached")
+            yield stats
+    finally:
+        if conn is not None:
+            conn.close()
+
+def analyze_sectors(fits_files, output_dir='../results', period_grid='fixed', grid_oversample=3, min_transits=2, search_mode='full',
+                    coarse_bin=COARSE_BIN_MINUTES, top_peaks=COARSE_TOP_PEAKS, loader='fast',
+                    preprocess_cache=None, cache_max_gb=DEFAULT_MAX_GB, multi_sector=True,
+                    stats_cache=None, stats_max_gb=STATS_MAX_GB,
+                    max_grid_baseline=MAX_GRID_BASELINE, plots=True, plot_backend='pyplot'):
+    """
+    Analyze all sectors of one star together
+
+    Each sector is folded into additive BLS statistics on a trial grid
+    shared by the star's sectors (bls_engine.sector_statistics); their sum
+    is searched as one light curve. With a statistics cache, sectors
+    folded by an earlier run are read back instead of folded again, so a
+    new sector costs about as much as a single-sector analysis.
+
+    Parameters:
+    -----------
+    fits_files : list of str
+        The star's light curves, one per sector (see
+        lightcurve_archive.sector_filename)
+    stats_cache : str
+        Cache file for the per-sector statistics (None = no cache)
+    stats_max_gb : float
+        Size limit of the statistics cache
+    max_grid_baseline : float
+        Longest baseline (days) a planned grid is made for
+    Other parameters as analyze_lightcurve; only the full search is
+    supported.
+    """
+    if search_mode != 'full':
+        raise ValueError(f"Multi-sector analysis supports only the full search, "
+                         f"not '{search_mode}'")
+
+    sectors = [prepare_lightcurve(f, loader, preprocess_cache, cache_max_gb)
+               for f in fits_files]
+    order = np.argsort([lc['time_min'] for lc in sectors], kind='stable')
+    fits_files = [fits_files[i] for i in order]
+    sectors = [sectors[i] for i in order]
+
+    time = np.concatenate([lc['time'] for lc in sectors])
+    flux = np.concatenate([lc['flux'] for lc in sectors])
+    flat_flux = np.concatenate([lc['flat_flux'] for lc in sectors])
+    # Same rule as lightkurve: unweighted unless every sector has usable
+    # errors (so all sectors are weighted alike)
+    weighted = all(lc['flat_err'] is not None and np.isfinite(lc['flat_err']).all()
+                   for lc in sectors)
+
+    target_name = sector_stem(fits_files[0])[0]
+    sector_numbers = [lc['sector'] for lc in sectors]
+
+    print(f"\nAnalyzing {target_name} (sectors {', '.join(str(n) for n in sector_numbers)})...")
+    print(f"  Data points: {sum(lc['n_raw'] for lc in sectors)}")
+    print(f"  Time range: {sectors[0]['time_min']:.2f} to "
+          f"{max(lc['time_max'] for lc in sectors):.2f} days")
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    print("  Running transit search...")
+    baseline = float(time.max() - time.min())
+    periods, grid = plan_period_grid(time, PERIOD_MIN, PERIOD_MAX, period_grid, PERIOD_STEP,
+                                     grid_oversample, min_transits=min_transits,
+                                     baseline=grid_baseline(baseline, max_grid_baseline))
+    period_max = None
+    if period_grid != 'fixed' and min_transits > 1:
+        # The grid may be planned for a longer baseline than the data has
+        period_max = baseline / (min_transits - 1)
+    if period_grid != 'fixed':
+        print(f"  Period grid: {grid['n_trials']} trials ({period_grid}, planned for "
+              f"{grid['baseline']:.0f} days)")
+
+    combined = combine_statistics(_sector_statistics(fits_files, sectors, periods, weighted,
+                                                     stats_cache, stats_max_gb))
+    search = search_statistics(combined, period_max)
+
+    best_period = search['period_at_max_power']
+    best_power = search['max_power']
+    print(f"  Best period found: {best_period:.4f} days")
+    print(f"  Transit power: {best_power:.4f}")
+
+    if plots:
+        save_plots(target_name, time, flux, flat_flux, search, output_dir, plot_backend)
+
+    tic_id = sectors[0]['tic_id'] or tic_from_name(target_name)
     return {
         'target': target_name,
-        'n_points': len(lc),
-        'period': float(best_period.value),
-        'power': float(best_power.value)
+        'tic_id': int(tic_id) if tic_id is not None else None,
+        'sector': sector_numbers[0],
+        'sectors': sector_numbers,
+        'n_points': len(time),
+        'period': best_period,
+        'power': best_power,
+        'depth': search['depth_at_max_power'],
+        'duration': search['duration_at_max_power'],
+        'transit_time': search['transit_time_at_max_power'],
+        'n_trials': len(search['period'])
     }
 
-def analyze_all_targets(data_dir='../data/tess', output_dir='../results'):
+def default_workers():
     """
-    Analyze all TESS light curves in directory
+    Number of worker processes to use when --workers is not given
+
+    Uses the SLURM CPU allocation if running inside a job, otherwise 1
+    (the original serial behaviour).
+    """
+    try:
+        return max(1, int(os.environ.get('SLURM_CPUS_PER_TASK', 1)))
+    except ValueError:
+        return 1
+
+def _analyze_target(task):
+    """
+    Pool entry point: analyze one file and never raise
+
+    Returns (index, fits_file, result, error) so a failure on one star is
+    reported by the parent without killing the other workers.
     """
+    index, fits_file, output_dir, options = task
+    try:
+        if isinstance(fits_file, tuple):
+            # All sectors of one star (--multi-sector)
+            return index, fits_file, analyze_sectors(list(fits_file), output_dir, **options), None
+        return index, fits_file, analyze_lightcurve(fits_file, output_dir, **options), None
+    except Exception as e:
+        return index, fits_file, None, str(e)
+
+def _init_worker():
+    # SLURM may signal every process in the job; only the parent should
+    # react to SIGUSR1 (workers are stopped by pool.terminate instead)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
 
-    # Find all FITS files
-    fits_files = glob(os.path.join(data_dir, '*.fits'))
+def _iter_results(tasks, workers):
+    """
+    Yield (index, fits_file, result, error) as each target finishes
 
-    if len(fits_files) == 0:
-        print(f"No FITS files found in {data_dir}")
+    With several workers the yield order depends on which worker finishes
+    first; callers use the index to restore input order.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield _analyze_target(task)
         return
 
-    print(f"Found {len(fits_files)} light curves to analyze")
+    # Pin BLAS threads before the workers import numpy. The 'spawn' start
+    # method gives each worker a fresh interpreter that inherits these
+    # variables, instead of a fork of a parent whose thread pools already exist.
+    for var in BLAS_THREAD_VARS:
+        os.environ[var] = '1'
 
-    results = []
-    for fits_file in fits_files:
-        try:
-            result = analyze_lightcurve(fits_file, output_dir)
-            results.append(result)
-        except Exception as e:
-            print(f"Error analyzing {fits_file}: {e}")
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(processes=workers, initializer=_init_worker) as pool:
+        # Unordered so each result reaches the ledger as soon as it exists
+        for item in pool.imap_unordered(_analyze_target, tasks, chunksize=1):
+            yield item
+
+def _raise_interrupted(signum, frame):
+    raise AnalysisInterrupted(signum)
+
+def shard_from_environment():
+    """
+    Shard (index, count) for a SLURM array task, or (0, 1) outside an array
+
+    SLURM_ARRAY_TASK_ID starts at whatever the --array range starts at
+    (often 1), so it is offset by SLURM_ARRAY_TASK_MIN to get a 0-based index.
+    """
+    task_id = os.environ.get('SLURM_ARRAY_TASK_ID')
+    task_count = os.environ.get('SLURM_ARRAY_TASK_COUNT')
+    if task_id is None or task_count is None:
+        return 0, 1
+
+    task_min = int(os.environ.get('SLURM_ARRAY_TASK_MIN', 0))
+    return int(task_id) - task_min, int(task_count)
+
+def select_shard(fits_files, shard_index=0, num_shards=1):
+    """
+    Deterministically pick this shard's files from a sorted file list
+
+    Files are dealt round-robin, so every shard gets a similar mix of
+    targets and the shards together cover the list exactly once.
+    """
+    if num_shards < 1 or not 0 <= shard_index < num_shards:
+        raise ValueError(f"Invalid shard {shard_index} of {num_shards}")
+    return fits_files[shard_index::num_shards]
+
+def list_inputs(data_dir):
+    """
+    Light curves in a directory (*.fits, sorted) or archive (its entries)
+
+    An archive lists its entries from the index without touching the
+    directory; a download in progress adds entries (or renames finished
+    FITS files into place) atomically, so only complete inputs are listed.
+    """
+    if data_dir.endswith(ARCHIVE_SUFFIX):
+        if not is_archive(data_dir):
+            return []
+        return [member_path(data_dir, entry['name']) for entry in list_entries(data_dir)]
+    return sorted(glob(os.path.join(data_dir, '*.fits')))
+
+def group_sectors(inputs):
+    """
+    Group light curves by star for --multi-sector
+
+    Per-sector files of one target (TIC_123_s0011.fits, TIC_123_s0012.fits)
+    form one group; any other file is a group of its own.
+
+    Returns:
+        list of tuples of paths, sorted by target
+    """
+    groups = {}
+    for path in inputs:
+        stem, sector = sector_stem(path)
+        key = os.path.join(os.path.dirname(path), stem) if sector is not None else path
+        groups.setdefault(key, []).append(path)
+    return [tuple(sorted(paths)) for _, paths in sorted(groups.items())]
+
+def _follow_inputs(data_dir, poll_interval, idle_timeout, stop):
+    """
+    Yield light curves as a running download lands them in data_dir
+
+    Rescans every poll_interval seconds. Ends once the downloader's
+    completion marker exists and a scan after it finds nothing new, when
+    nothing new arrives for idle_timeout seconds, or when stop is set.
+    """
+    marker = completion_marker(data_dir, data_dir if data_dir.endswith(ARCHIVE_SUFFIX) else None)
+    seen = set()
+    last_new = time.time()
+    while not stop.is_set():
+        # Checked before scanning, so files that landed before the
+        # marker are picked up by this scan
+        finished = os.path.exists(marker)
+        new_files = [f for f in list_inputs(data_dir) if f not in seen]
+        for fits_file in new_files:
+            seen.add(fits_file)
+            yield fits_file
+        if new_files:
+            last_new = time.time()
+        elif finished:
+            return
+        elif time.time() - last_new > idle_timeout:
+            print(f"No new light curves for {idle_timeout / 3600:.1f} h and no "
+                  f"{os.path.basename(marker)} marker - stopping")
+            return
+        else:
+            stop.wait(poll_interval)
+
+def summary_filename(shard_index=0, num_shards=1):
+    """
+    Name of the summary file written by one run (or one shard of a run)
+    """
+    if num_shards == 1:
+        return 'analysis_summary.txt'
+    return f'analysis_summary.shard-{shard_index:04d}-of-{num_shards:04d}.txt'
+
+def run_parameters(options):
+    """
+    Analysis parameters stored alongside the results
+    """
+    params = {
+        'outlier_sigma': OUTLIER_SIGMA,
+        'flatten_window': FLATTEN_WINDOW,
+        'period_min': PERIOD_MIN,
+        'period_max': PERIOD_MAX,
+        'period_step': PERIOD_STEP,
+    }
+    params.update(options)
+    # The BLS implementation behind the results: astropy through lightkurve
+    # for single light curves, the additive statistics of bls_engine.py
+    # for --multi-sector
+    params['bls_engine'] = 'native' if options.get('multi_sector') else 'lightkurve'
+    return params
+
+# Options that change how a light curve is read, cached or plotted, not its result
+RESULT_NEUTRAL_OPTIONS = ('loader', 'cache_max_gb', 'stats_max_gb', 'plots', 'plot_backend')
+
+# Caches that store float32 arrays, so searches with the cache on give
+# (slightly) different results: cache option -> search parameter recording
+# the precision when it is on. Which cache file is used does not matter.
+CACHE_PRECISION_OPTIONS = {'preprocess_cache': 'preprocess_precision',
+                           'stats_cache': 'stats_precision'}
+
+def _search_parameters(params):
+    search = {k: v for k, v in params.items()
+              if k not in RESULT_NEUTRAL_OPTIONS and k not in CACHE_PRECISION_OPTIONS}
+    for option, precision in CACHE_PRECISION_OPTIONS.items():
+        if params.get(option):
+            search[precision] = 'float32'
+    return search
+
+def search_digest(params):
+    """
+    Digest of the search parameters among run parameters (run_parameters
+    or load_run_params), stored with every ledger record
+    """
+    return params_digest(_search_parameters(params))
+
+def _matching_records(records, digest, db_path):
+    """
+    The ledger records analyzed with the search parameters of digest
+
+    Records written before ledgers carried parameters count as analyzed
+    with those of the run's results database (db_path), if there is one.
+    """
+    legacy = search_digest(load_run_params(db_path)) if os.path.exists(db_path) else None
+    return {key: record for key, record in records.items()
+            if record.get('params', legacy) == digest}
+
+def load_reusable_results(results_dirs, params):
+    """
+    Results of store objects analyzed by other runs (e.g. another phase's
+    output directory) with the same search parameters
+
+    Returns:
+        dict mapping object key -> (result, results directory)
+    """
+    reusable = {}
+    wanted = search_digest(params)
+    for results_dir in results_dirs:
+        db_path = os.path.join(results_dir, RESULTS_DB)
+        if not os.path.exists(db_path):
+            print(f"  Not reusing {results_dir}: no {RESULTS_DB} (run not finished)")
             continue
+        records = load_ledgers(results_dir)
+        matching = _matching_records(records, wanted, db_path)
+        if len(matching) < len(records):
+            print(f"  Not reusing {len(records) - len(matching)} results of {results_dir}: "
+                  f"analyzed with different search parameters")
+        for record in matching.values():
+            if record['status'] == 'ok' and record.get('object'):
+                reusable[record['object']] = (record['result'], results_dir)
+    return reusable
+
+def _copy_result(result, source_dir, fits_file, output_dir):
+    """
+    A result (and its plots) under the target name of another input file
+    that holds the same light curve
+    """
+    target = os.path.basename(fits_file).replace('.fits', '')
+    for suffix in ('_analysis.png', '_folded.png'):
+        source = os.path.join(source_dir, result['target'] + suffix)
+        destination = os.path.join(output_dir, target + suffix)
+        if os.path.exists(source) and not os.path.exists(destination):
+            shutil.copyfile(source, destination)
+    return dict(result, target=target)
 
-    # Save summary
-    summary_file = os.path.join(output_dir, 'analysis_summary.txt')
+def write_summary(results, summary_file):
+    """
+    Write the human-readable summary consumed by analyze_results.py
+    """
     with open(summary_file, 'w') as f:
         f.write("TESS Transit Analysis Summary\n")
         f.write("=" * 60 + "\n\n")
         for r in results:
             f.write(f"Target: {r['target']}\n")
+            if r.get('sectors') and len(r['sectors']) > 1:
+                f.write(f"  Sectors: {', '.join(str(n) for n in r['sectors'])}\n")
             f.write(f"  Data points: {r['n_points']}\n")
             f.write(f"  Best period: {r['period']:.4f} days\n")
-            f.write(f"  Transit power: {r['power']:.4f}\n\n")
+            f.write(f"  Transit power: {r['power']:.4f}\n")
+            if r.get('coarse_peaks'):
+                peaks = ', '.join(f"{p:.4f}" for p, _ in r['coarse_peaks'])
+                f.write(f"  Coarse peaks: {peaks} days\n")
+            f.write("\n")
 
-    print(f"\nAnalysis complete! Summary saved to {summary_file}")
+def analyze_all_targets(data_dir='../data/tess', output_dir='../results', workers=1,
+                        shard_index=0, num_shards=1, retry_errors=False, text_summary=True,
+                        follow=False, poll_interval=FOLLOW_POLL_SECONDS,
+                        idle_timeout=FOLLOW_IDLE_TIMEOUT, reuse_results=None, **options):
+    """
+    Analyze all TESS light curves in directory
+
+    Parameters:
+    -----------
+    data_dir : str
+        Directory containing TESS FITS files, or a packed light-curve
+        archive (*.lcpack, see lightcurve_archive.py)
+    output_dir : str
+        Directory to save results
+    workers : int
+        Number of worker processes (1 = serial)
+    shard_index : int
+        0-based index of the shard to analyze
+    num_shards : int
+        Total number of shards the file list is split into
+    retry_errors : bool
+        Re-analyze targets the ledger records as failed
+    text_summary : bool
+        Also write the human-readable analysis_summary.txt
+    follow : bool
+        Analyze light curves while a download is still writing data_dir,
+        until the downloader's completion marker appears
+    poll_interval : float
+        Seconds between scans for new light curves when following
+    idle_timeout : float
+        Stop following after this many seconds without a new light curve
+    reuse_results : list of str
+        Output directories of other runs (e.g. other phases). If data_dir
+        is a view of a light-curve store (lc_store.py), light curves those
+        runs already analyzed with the same search parameters are not
+        analyzed again.
+    options :
+        Search options passed to analyze_lightcurve (period_grid,
+        search_mode, ...); recorded with the results. With
+        multi_sector=True the sectors of each star are analyzed together
+        by analyze_sectors (which also takes stats_cache, ...).
+    """
+    multi_sector = options.get('multi_sector', False)
+
+    os.makedirs(output_dir, exist_ok=True)
+    # Resume only what was analyzed with the same search parameters
+    digest = search_digest(run_parameters(options))
+    results_file = os.path.join(output_dir, results_db_filename(shard_index, num_shards))
+    recorded = load_ledgers(output_dir)
+    done = _matching_records(recorded, digest, results_file)
+    if len(done) < len(recorded):
+        print(f"{len(recorded) - len(done)} ledger records were analyzed with different "
+              f"search parameters - analyzing those targets again")
+    results = {}
+    fits_files = []
+    # Ends a --follow scan waiting for new files when the run stops early
+    stop_following = threading.Event()
+
+    # Inputs that are views of one stored light curve are analyzed once
+    view_store = open_view_store(data_dir) if os.path.isdir(data_dir) else None
+    object_keys = {}
+    first_by_object = {}
+    duplicates = {}
+    reusable = {}
+    if reuse_results and view_store:
+        reusable = load_reusable_results(reuse_results, run_parameters(options))
+        print(f"{len(reusable)} light curves analyzed by other runs can be reused")
+
+    ledger_path = os.path.join(output_dir, ledger_filename(shard_index, num_shards))
+    ledger_fd = open_ledger(ledger_path)
+
+    def make_tasks(inputs):
+        for fits_file in inputs:
+            index = len(fits_files)
+            fits_files.append(fits_file)
+            key = None
+            if view_store and not isinstance(fits_file, tuple):
+                key = view_store.key_of(fits_file)
+            if key is not None:
+                if key in first_by_object:
+                    # Same stored light curve as an earlier input
+                    duplicates[index] = first_by_object[key]
+                    continue
+                first_by_object[key] = index
+                object_keys[index] = key
+            # Resume: reuse every target already recorded in a ledger
+            record = done.get(file_key(fits_file))
+            if record is not None and (record['status'] == 'ok' or not retry_errors):
+                if record['status'] == 'ok':
+                    results[index] = record['result']
+                continue
+            if key in reusable:
+                result, source_dir = reusable[key]
+                results[index] = _copy_result(result, source_dir, fits_file, output_dir)
+                append_record(ledger_fd, file_key(fits_file), 'ok', result=results[index],
+                              object_key=key, params=digest)
+                continue
+            yield index, fits_file, output_dir, options
+
+    if follow:
+        if num_shards > 1:
+            raise ValueError("--follow analyzes one growing data set and can't be sharded")
+        if multi_sector:
+            raise ValueError("--follow can't know when a star's last sector has arrived; "
+                             "run --multi-sector after the download")
+        # Tasks are generated as the download lands files; the pool pulls
+        # them as workers free up
+        tasks = make_tasks(_follow_inputs(data_dir, poll_interval, idle_timeout,
+                                          stop_following))
+        print(f"Following {data_dir}: analyzing light curves as they arrive")
+    else:
+        # Sorted so runs are reproducible
+        inputs = list_inputs(data_dir)
+
+        if len(inputs) == 0:
+            print(f"No FITS files found in {data_dir}")
+            os.close(ledger_fd)
+            return
+
+        if multi_sector:
+            # One input per star; grouped before sharding so a star's
+            # sectors stay in one shard
+            n_files = len(inputs)
+            inputs = group_sectors(inputs)
+            print(f"Multi-sector: {n_files} light curves of {len(inputs)} stars")
+
+        if num_shards > 1:
+            total_files = len(inputs)
+            inputs = select_shard(inputs, shard_index, num_shards)
+            print(f"Shard {shard_index + 1}/{num_shards}: "
+                  f"{len(inputs)} of {total_files} light curves")
+            if len(inputs) == 0:
+                print("Nothing to do for this shard")
+
+        tasks = list(make_tasks(inputs))
+        if duplicates:
+            print(f"{len(duplicates)} inputs are the same stored light curve as another "
+                  f"input - analyzing each once")
+        if len(tasks) < len(fits_files) - len(duplicates):
+            print(f"Resuming: {len(fits_files) - len(duplicates) - len(tasks)} targets already "
+                  f"in ledger or reused, {len(tasks)} remaining")
+
+        workers = max(1, min(workers, len(tasks)))
+        print(f"Found {len(fits_files)} light curves to analyze")
+    print(f"Using {workers} worker process(es)")
+
+    def interrupt(signum, frame):
+        # A --follow scan waiting for files must end before the pool can
+        # shut down (its idle workers wait for the next task until then)
+        stop_following.set()
+        _raise_interrupted(signum, frame)
+
+    previous_handlers = {sig: signal.signal(sig, interrupt) for sig in STOP_SIGNALS}
+    interrupted = None
+    result_iter = _iter_results(tasks, workers)
+
+    try:
+        for index, fits_file, result, error in result_iter:
+            if error is not None:
+                print(f"Error analyzing {fits_file}: {error}")
+                append_record(ledger_fd, file_key(fits_file), 'error', error=error,
+                              object_key=object_keys.get(index), params=digest)
+                continue
+            append_record(ledger_fd, file_key(fits_file), 'ok', result=result,
+                          object_key=object_keys.get(index), params=digest)
+            results[index] = result
+
+        for index, original in duplicates.items():
+            if original in results:
+                fits_file = fits_files[index]
+                results[index] = _copy_result(results[original], output_dir, fits_file,
+                                              output_dir)
+                append_record(ledger_fd, file_key(fits_file), 'ok', result=results[index],
+                              params=digest)
+    except AnalysisInterrupted as e:
+        interrupted = e.args[0]
+        print(f"\nReceived signal {interrupted} - stopping workers, "
+              f"finished targets are saved in {ledger_path}")
+    finally:
+        # Stops the pool (if any) before the summary is written
+        stop_following.set()
+        result_iter.close()
+        os.close(ledger_fd)
+        for sig, handler in previous_handlers.items():
+            signal.signal(sig, handler)
+
+    # Input (file name) order, also for files that arrived while following
+    results = [results[i] for i in sorted(results, key=lambda i: fits_files[i])]
+
+    # Save results (one set per shard; merge_analysis_shards.py combines them)
+    write_results(results_file, results, run_parameters(options))
+    if text_summary:
+        write_summary(results, os.path.join(output_dir, summary_filename(shard_index, num_shards)))
+
+    if interrupted is not None:
+        print(f"\nPartial results ({len(results)} targets) saved to {results_file}")
+        print("Resubmit the same command to continue where this run stopped")
+        sys.exit(128 + interrupted)
+
+    print(f"\nAnalysis complete! Results saved to {results_file}")
     print(f"Analyzed {len(results)} targets successfully")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Analyze TESS light curves for transits')
     parser.add_argument('-d', '--data-dir', type=str, default='../data/tess',
-                        help='Directory containing TESS FITS files')
+                        help='Directory containing TESS FITS files, or a packed '
+                             'light-curve archive (*.lcpack)')
     parser.add_argument('-o', '--output-dir', type=str, default='../results',
                         help='Output directory for results')
+    parser.add_argument('-w', '--workers', type=int, default=default_workers(),
+                        help='Number of worker processes '
+                             '(default: $SLURM_CPUS_PER_TASK, or 1 outside SLURM)')
+
+    parser.add_argument('--shard-index', type=int, default=None,
+                        help='0-based shard to analyze (default: from SLURM_ARRAY_TASK_ID)')
+    parser.add_argument('--num-shards', type=int, default=None,
+                        help='Total number of shards (default: SLURM_ARRAY_TASK_COUNT, or 1)')
+    parser.add_argument('--retry-errors', action='store_true',
+                        help='When resuming, retry targets that failed in an earlier run')
+    parser.add_argument('--no-text-summary', action='store_true',
+                        help='Skip analysis_summary.txt (results are always in analysis_results.sqlite)')
+    parser.add_argument('--no-plots', action='store_true',
+                        help='Skip the per-star PNGs; render them afterwards for the '
+                             'candidates of interest with render_plots.py')
+    parser.add_argument('--plot-backend', choices=PLOT_BACKENDS, default='pyplot',
+                        help='pyplot: new figures per star (default); fast: figures built '
+                             'once per worker and updated in place (fast_plots.py)')
+    parser.add_argument('--follow', action='store_true',
+                        help='Analyze light curves as a running download lands them in '
+                             '--data-dir; stop once the downloader has finished')
+    parser.add_argument('--poll-interval', type=float, default=FOLLOW_POLL_SECONDS,
+                        help=f'--follow: seconds between scans for new light curves '
+                             f'(default: {FOLLOW_POLL_SECONDS})')
+    parser.add_argument('--idle-timeout', type=float, default=FOLLOW_IDLE_TIMEOUT / 3600,
+                        help=f'--follow: stop after this many hours without a new light '
+                             f'curve (default: {FOLLOW_IDLE_TIMEOUT / 3600:g})')
+    parser.add_argument('--reuse-results', type=str, nargs='+', default=None,
+                        help='Output directories of other runs: reuse their results for '
+                             'light curves they share with --data-dir through a '
+                             'light-curve store (lc_store.py)')
+    parser.add_argument('--period-grid', choices=GRID_METHODS, default='fixed',
+                        help='Trial periods: fixed (0.5-20 d in 0.001 d steps, default), '
+                             'or planned per light curve from its baseline and cadence: '
+                             'ofir (uniform in frequency^1/3) or frequency (uniform in frequency)')
+    parser.add_argument('--grid-oversample', type=float, default=3,
+                        help='Oversampling of the planned period grids (default: 3)')
+    parser.add_argument('--min-transits', type=int, default=2,
+                        help='Planned grids stop at baseline / (min_transits - 1) (default: 2)')
+    parser.add_argument('--search', choices=SEARCH_MODES, default='full',
+                        help='full: every trial period at full resolution (default); '
+                             'coarse-to-fine: binned data on a sparse grid, then full '
+                             'resolution only around the strongest peaks')
+    parser.add_argument('--coarse-bin', type=float, default=COARSE_BIN_MINUTES,
+                        help=f'Coarse-pass bin width in minutes (default: {COARSE_BIN_MINUTES})')
+    parser.add_argument('--top-peaks', type=int, default=COARSE_TOP_PEAKS,
+                        help=f'Coarse peaks refined at full resolution (default: {COARSE_TOP_PEAKS})')
+    parser.add_argument('--loader', choices=LOADERS, default='fast',
+                        help='FITS reader: fast (memory-mapped columns, NumPy cleaning; default) '
+                             'or lightkurve (lk.read and LightCurve methods)')
+    parser.add_argument('--preprocess-cache', type=str, default=None,
+                        help='SQLite file caching cleaned/flattened light curves across runs, '
+                             'e.g. ../cache/preprocess.sqlite (default: no cache)')
+    parser.add_argument('--cache-max-gb', type=float, default=DEFAULT_MAX_GB,
+                        help=f'Size limit of the preprocessing cache (default: {DEFAULT_MAX_GB:g})')
+    parser.add_argument('--multi-sector', action='store_true',
+                        help='Search all sectors of a star together (TIC_123_s0011.fits, ... '
+                             'from the downloaders\' --all-sectors)')
+    parser.add_argument('--stats-cache', type=str, default=None,
+                        help='--multi-sector: SQLite file caching per-sector BLS statistics, '
+                             'so re-analyzing a star folds only its new sectors, e.g. '
+                             '../cache/sector_stats.sqlite (default: no cache)')
+    parser.add_argument('--stats-max-gb', type=float, default=STATS_MAX_GB,
+                        help=f'Size limit of the statistics cache (default: {STATS_MAX_GB:g})')
+    parser.add_argument('--max-grid-baseline', type=float, default=MAX_GRID_BASELINE,
+                        help=f'--multi-sector: longest baseline in days a planned period grid '
+                             f'is made for (default: {MAX_GRID_BASELINE:g})')
 
     args = parser.parse_args()
 
-    analyze_all_targets(args.data_dir, args.output_dir)
+    # Only recorded with the run parameters when used
+    extra_options = {}
+    if args.multi_sector:
+        extra_options.update(multi_sector=True, stats_cache=args.stats_cache,
+                             stats_max_gb=args.stats_max_gb,
+                             max_grid_baseline=args.max_grid_baseline)
+    if args.no_plots:
+        extra_options['plots'] = False
+    elif args.plot_backend != 'pyplot':
+        extra_options['plot_backend'] = args.plot_backend
+
+    env_index, env_count = shard_from_environment()
+    shard_index = env_index if args.shard_index is None else args.shard_index
+    num_shards = env_count if args.num_shards is None else args.num_shards
+
+    analyze_all_targets(args.data_dir, args.output_dir, args.workers,
+                        shard_index, num_shards, args.retry_errors,
+                        not args.no_text_summary, args.follow, args.poll_interval,
+                        args.idle_timeout * 3600, args.reuse_results,
+                        period_grid=args.period_grid, grid_oversample=args.grid_oversample,
+                        min_transits=args.min_transits, search_mode=args.search,
+                        coarse_bin=args.coarse_bin, top_peaks=args.top_peaks,
+                        loader=args.loader, preprocess_cache=args.preprocess_cache,
+                        cache_max_gb=args.cache_max_gb, **extra_options)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark the plot backends of analyze_tess_transits.py
+
+Each light curve is cleaned and searched once, as the analyzer does it
+(native engine), then both plots are drawn with every backend into a
+scratch directory. Reports the wall time per star and backend and the
+size of the written PNGs. The first 'fast' star includes building the
+reused figures, as it does in every analysis worker.
+
+Usage:
+    python benchmark_plots.py -d ../data/tess
+    python benchmark_plots.py -d ../data/tess_random -n 20 --search coarse-to-fine
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from analyze_tess_transits import (PLOT_BACKENDS, PERIOD_MIN, PERIOD_MAX, PERIOD_STEP,
+                                   SEARCH_MODES, list_inputs, prepare_lightcurve,
+                                   transit_search, coarse_to_fine_search, save_plots)
+
+def plot_size(output_dir, target):
+    """
+    Total bytes of a target's two PNGs
+    """
+    return sum(os.path.getsize(os.path.join(output_dir, target + suffix))
+               for suffix in ('_analysis.png', '_folded.png'))
+
+def benchmark(data_dir, max_files=None, backends=PLOT_BACKENDS, search_mode='full'):
+    """
+    Time every plot backend on the light curves in data_dir
+
+    Parameters:
+    -----------
+    data_dir : str
+        Directory (or archive) containing FITS light curves
+    max_files : int
+        Only benchmark the first max_files light curves (sorted by name)
+    backends : list of str
+        Backends to compare; the first is the reference
+    search_mode : str
+        Search whose periodogram is plotted (see SEARCH_MODES)
+    """
+    fits_files = list_inputs(data_dir)
+    if max_files:
+        fits_files = fits_files[:max_files]
+
+    if not fits_files:
+        print(f"No FITS files found in {data_dir}")
+        return
+
+    periods = np.arange(PERIOD_MIN, PERIOD_MAX, PERIOD_STEP)
+    reference = backends[0]
+    times = {backend: [] for backend in backends}
+    sizes = {backend: 0 for backend in backends}
+    scratch = tempfile.mkdtemp(prefix='benchmark_plots_')
+
+    print(f"Benchmarking plot backends {', '.join(backends)} on {len(fits_files)} light curves")
+    print("=" * 60)
+
+    try:
+        for fits_file in fits_files:
+            target = os.path.basename(fits_file).replace('.fits', '')
+            try:
+                lc = prepare_lightcurve(fits_file)
+            except Exception as e:
+                print(f"✗ {target}: {e}")
+                continue
+            if search_mode == 'coarse-to-fine':
+                search = coarse_to_fine_search(lc['time'], lc['flat_flux'], lc['flat_err'],
+                                               periods, 'native')
+            else:
+                search = transit_search(lc['time'], lc['flat_flux'], lc['flat_err'], periods,
+                                        'native')
+
+            line = f"{target} ({len(lc['time'])} points):"
+            for backend in backends:
+                output_dir = os.path.join(scratch, backend)
+                os.makedirs(output_dir, exist_ok=True)
+                start = time.perf_counter()
+                save_plots(target, lc['time'], lc['flux'], lc['flat_flux'], search,
+                           output_dir, backend)
+                elapsed = time.perf_counter() - start
+                times[backend].append(elapsed)
+                sizes[backend] += plot_size(output_dir, target)
+                line += f" {backend} {elapsed:.3f}s"
+            print(f"✓ {line}")
+    finally:
+        shutil.rmtree(scratch)
+
+    n = len(times[reference])
+    if n == 0:
+        return
+    print("=" * 60)
+    for backend in backends:
+        per_star = np.array(times[backend])
+        print(f"{backend:>8}: {per_star.mean():.3f}s per star (median {np.median(per_star):.3f}s), "
+              f"{sizes[backend] / n / 1024:.0f} KB of PNG per star")
+    for backend in backends[1:]:
+        print(f"Speedup of {backend} over {reference}: "
+              f"x{sum(times[reference]) / sum(times[backend]):.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark plot backends on TESS light curves')
+    parser.add_argument('-d', '--data-dir', type=str, default='../data/tess',
+                        help='Directory containing FITS files, or a packed archive')
+    parser.add_argument('-n', '--max-files', type=int, default=None,
+                        help='Only use the first N files')
+    parser.add_argument('--backends', nargs='+', choices=PLOT_BACKENDS, default=PLOT_BACKENDS,
+                        help='Backends to compare (the first is the reference)')
+    parser.add_argument('--search', choices=SEARCH_MODES, default='full',
+                        help='Search whose periodogram is plotted (default: full)')
+
+    args = parser.parse_args()
+
+    benchmark(args.data_dir, args.max_files, args.backends, args.search)
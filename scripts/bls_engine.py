@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Additive Box Least Squares (BLS) statistics for multi-sector searches
+
+A star observed in several TESS sectors is searched as one light curve
+(analyze_tess_transits.py --multi-sector), but folding every sector again
+each time a new one arrives wastes most of the work. This module uses the
+binned algorithm of astropy's BoxLeastSquares (method='fast', which
+lightkurve's to_periodogram(method='bls') runs) with phases counted from a
+fixed epoch, so the phase-binned sums of separate sectors add up:
+
+1. sector_statistics folds one sector, a chunk of trial periods per NumPy
+   call, into bins of width min(duration) / oversample and keeps the
+   binned weighted flux and inverse variance. Two equivalent folds are
+   available and the cheaper one is picked per light curve:
+     - 'prefix': evaluate prefix sums of the time-sorted data at every
+       bin edge of every orbital cycle (cost ~ baseline / bin width,
+       independent of the number of points - best for dense 2-min and
+       20-s cadence data)
+     - 'bincount': scatter every point into its phase bin (cost ~ number
+       of points - best for sparse or widely gapped data)
+2. combine_statistics adds the sums of a star's sectors (sector_stats.py
+   caches them per sector).
+3. search_statistics evaluates the log-likelihood objective for every box
+   (phase, duration) as differences of the cumulative sums and keeps the
+   best box per period.
+
+Inputs are float arrays (no astropy Time/Quantity objects) and the search
+output mirrors the BoxLeastSquaresPeriodogram fields the analyzer uses
+(period_at_max_power, max_power, depth/duration/transit_time at max power).
+Single light curves are searched with lightkurve.
+"""
+
+import numpy as np
+
+# lightkurve's default BLS durations (days), used when none are given
+DEFAULT_DURATIONS = [0.05, 0.10, 0.15, 0.20, 0.25, 0.33]
+
+# Target number of array elements per vectorized chunk; small enough that
+# the temporaries of the box scan stay in CPU cache
+CHUNK_ELEMENTS = 100000
+
+EPSILON = np.finfo(np.float64).eps
+
+# Phase origin (BTJD) of sector_statistics, shared by every sector so
+# their binned sums line up
+STATISTICS_EPOCH = 0.0
+
+def sector_statistics(time, flux, flux_err=None, periods=None, durations=None, oversample=10,
+                      fold=None, epoch=STATISTICS_EPOCH):
+    """
+    Additive BLS statistics of one light curve (e.g. one TESS sector)
+
+    The search only needs, per trial period, the weighted flux and inverse
+    variance summed into phase bins, plus their totals. With phases counted
+    from a fixed epoch instead of the first point, these sums of two
+    sectors add up to the sums of both together, so a star's periodogram
+    can be updated with a new sector without folding the old ones again
+    (see combine_statistics and search_statistics). Flux is taken relative
+    to this light curve's own median.
+
+    Parameters:
+    -----------
+    time : array
+        Observation times (days)
+    flux : array
+        Normalized flux (NaNs must already be removed)
+    flux_err : array or None
+        Flux uncertainties; uniform weights if None
+    periods : array
+        Trial periods (days)
+    durations : list of float
+        Trial transit durations (days); default DEFAULT_DURATIONS
+    oversample : int
+        Phase bins per minimum duration (astropy/lightkurve default: 10)
+    fold : str or None
+        'prefix', 'bincount', or None to pick the cheaper one
+    epoch : float
+        Time (days, same scale as time) phases are counted from; must be
+        the same for every light curve that is combined
+
+    Returns:
+        dict with 'period', 'durations', 'oversample', 'bin_duration',
+        'epoch', the binned sums 'y_ivar' and 'ivar' (flat arrays; period i
+        occupies ceil(period[i] / bin_duration) bins, in period order),
+        their totals 'sum_y' and 'sum_ivar', and 'n_points', 'time_min',
+        'time_max'
+    """
+    lc, t_ref, periods, durations, bin_duration, fold = _prepare(
+        time, flux, flux_err, periods, durations, oversample, fold)
+    t = lc['t']
+
+    n_real = np.ceil(periods / bin_duration).astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(n_real)])
+    binned_y = np.zeros(offsets[-1])
+    binned_ivar = np.zeros(offsets[-1])
+
+    start = 0
+    while start < len(periods):
+        stop = start + _chunk_size(periods[start], t[-1], bin_duration, len(t),
+                                   oversample, fold)
+        stop = min(stop, len(periods))
+        chunk = periods[start:stop]
+        row_len = int(n_real[start:stop].max()) + 1
+        # Cycles start at epoch + k*P, i.e. at -((t_ref - epoch) mod P)
+        # relative to the first point
+        origin = -np.mod(t_ref - epoch, chunk)
+        if fold == 'prefix':
+            cum_y, cum_ivar = _fold_prefix(lc, chunk, bin_duration, row_len, origin)
+        else:
+            cum_y, cum_ivar = _fold_bincount(lc, chunk, bin_duration, row_len, origin)
+
+        inside = np.arange(row_len - 1)[None, :] < n_real[start:stop, None]
+        binned_y[offsets[start]:offsets[stop]] = np.diff(cum_y, axis=1)[inside]
+        binned_ivar[offsets[start]:offsets[stop]] = np.diff(cum_ivar, axis=1)[inside]
+        start = stop
+
+    return {
+        'period': periods,
+        'durations': durations,
+        'oversample': int(oversample),
+        'bin_duration': float(bin_duration),
+        'epoch': float(epoch),
+        'y_ivar': binned_y,
+        'ivar': binned_ivar,
+        'sum_y': float(lc['sum_y']),
+        'sum_ivar': float(lc['sum_ivar']),
+        'n_points': len(t),
+        'time_min': float(t_ref),
+        'time_max': float(t_ref + t[-1]),
+    }
+
+def combine_statistics(statistics):
+    """
+    Sum the sector_statistics of several light curves of one star
+
+    All must have been computed on the same periods, durations, oversample
+    and epoch. statistics may be a generator, so only the running sum and
+    one light curve's statistics are held at a time.
+    """
+    statistics = iter(statistics)
+    first = next(statistics)
+    combined = dict(first, y_ivar=first['y_ivar'].copy(), ivar=first['ivar'].copy())
+    for stats in statistics:
+        if not (np.array_equal(stats['period'], first['period']) and
+                np.array_equal(stats['durations'], first['durations']) and
+                stats['oversample'] == first['oversample'] and
+                stats['epoch'] == first['epoch']):
+            raise ValueError("Statistics computed on different grids can't be combined")
+        combined['y_ivar'] += stats['y_ivar']
+        combined['ivar'] += stats['ivar']
+        combined['sum_y'] += stats['sum_y']
+        combined['sum_ivar'] += stats['sum_ivar']
+        combined['n_points'] += stats['n_points']
+        combined['time_min'] = min(combined['time_min'], stats['time_min'])
+        combined['time_max'] = max(combined['time_max'], stats['time_max'])
+    return combined
+
+def search_statistics(stats, period_max=None):
+    """
+    BLS search from (combined) sector statistics
+
+    Parameters:
+    -----------
+    stats : dict
+        From sector_statistics or combine_statistics
+    period_max : float
+        Only search trial periods up to this (days)
+
+    Returns:
+        dict with per-period arrays 'period', 'power', 'depth', 'duration',
+        'transit_time' and the values at maximum power:
+        'period_at_max_power', 'max_power', 'depth_at_max_power',
+        'duration_at_max_power', 'transit_time_at_max_power'
+    """
+    periods = stats['period']
+    bin_duration = stats['bin_duration']
+    oversample = stats['oversample']
+    duration_bins = np.round(stats['durations'] / bin_duration).astype(np.int64)
+
+    n_real = np.ceil(periods / bin_duration).astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(n_real)])
+    n_periods = len(periods)
+    if period_max is not None:
+        n_periods = int(np.searchsorted(periods, period_max, side='right'))
+        if n_periods == 0:
+            raise ValueError(f"No trial periods up to {period_max} days")
+
+    power = np.full(n_periods, -np.inf)
+    depth = np.zeros(n_periods)
+    best_duration = np.zeros(n_periods)
+    transit_time = np.zeros(n_periods)
+
+    start = 0
+    while start < n_periods:
+        stop = min(n_periods, start + max(1, CHUNK_ELEMENTS // int(n_real[start] + oversample + 2)))
+        chunk_real = n_real[start:stop]
+        row_len = int(chunk_real.max()) + oversample + 1
+
+        # Rebuild the cumulative sums the folds return: column j holds the
+        # bins below j, columns past the last bin hold the total
+        inside = np.arange(row_len - 1)[None, :] < chunk_real[:, None]
+        cum_y = np.zeros((stop - start, row_len))
+        cum_ivar = np.zeros((stop - start, row_len))
+        binned = np.zeros((stop - start, row_len - 1))
+        binned[inside] = stats['y_ivar'][offsets[start]:offsets[stop]]
+        np.cumsum(binned, axis=1, out=cum_y[:, 1:])
+        binned[inside] = stats['ivar'][offsets[start]:offsets[stop]]
+        np.cumsum(binned, axis=1, out=cum_ivar[:, 1:])
+
+        chunk = slice(start, stop)
+        _scan_boxes(cum_y, cum_ivar, stats['sum_y'], stats['sum_ivar'], periods[chunk],
+                    chunk_real, bin_duration, duration_bins, oversample, power[chunk],
+                    depth[chunk], best_duration[chunk], transit_time[chunk])
+        start = stop
+
+    # First transit at or after the first point, as astropy reports it
+    periods = periods[:n_periods]
+    transit_time += stats['epoch']
+    transit_time += periods * np.ceil((stats['time_min'] - transit_time) / periods)
+    return _summarize(periods, power, depth, best_duration, transit_time)
+
+def _prepare(time, flux, flux_err, periods, durations, oversample, fold):
+    """
+    Sorted, centered and weighted light curve (plus the tables of the
+    chosen fold) of sector_statistics
+
+    Returns:
+        (light curve dict, time of the first point, periods, durations,
+        phase bin width, fold method)
+    """
+    if durations is None:
+        durations = DEFAULT_DURATIONS
+
+    time = np.asarray(time, dtype=np.float64)
+    flux = np.asarray(flux, dtype=np.float64)
+    periods = np.ascontiguousarray(periods, dtype=np.float64)
+    durations = np.asarray(durations, dtype=np.float64)
+
+    if len(time) == 0 or len(periods) == 0:
+        raise ValueError("sector_statistics needs at least one data point and one period")
+    if np.max(durations) >= np.min(periods):
+        raise ValueError("Longest duration must be shorter than the shortest period")
+
+    # Same conventions as astropy: times relative to the first point,
+    # flux relative to its median, inverse-variance weights
+    order = np.argsort(time, kind='stable')
+    t_ref = time[order[0]]
+    t = time[order] - t_ref
+    y = flux[order] - np.median(flux)
+    if flux_err is None:
+        ivar = np.ones_like(y)
+    else:
+        ivar = 1.0 / np.asarray(flux_err, dtype=np.float64)[order] ** 2
+
+    bin_duration = np.min(durations) / oversample
+
+    if fold is None:
+        fold = 'prefix' if t[-1] / bin_duration < len(t) else 'bincount'
+    if fold not in ('prefix', 'bincount'):
+        raise ValueError(f"Unknown fold method '{fold}'")
+
+    y_ivar = y * ivar
+    lc = {
+        't': t,
+        't_bins': t / bin_duration,
+        'y_ivar': y_ivar,
+        'ivar': ivar,
+        'sum_y': np.sum(y_ivar),
+        'sum_ivar': np.sum(ivar),
+    }
+    if fold == 'prefix':
+        lc.update(_prefix_tables(t, y_ivar, ivar))
+    return lc, t_ref, periods, durations, bin_duration, fold
+
+def _summarize(periods, power, depth, best_duration, transit_time):
+    """
+    Result dict of a search: per-period arrays and the values at max power
+    """
+    best = int(np.argmax(power))
+    return {
+        'period': periods,
+        'power': power,
+        'depth': depth,
+        'duration': best_duration,
+        'transit_time': transit_time,
+        'period_at_max_power': float(periods[best]),
+        'max_power': float(power[best]),
+        'depth_at_max_power': float(depth[best]),
+        'duration_at_max_power': float(best_duration[best]),
+        'transit_time_at_max_power': float(transit_time[best]),
+    }
+
+def _prefix_tables(t, y_ivar, ivar):
+    """
+    Prefix sums and the grid lookup table used by the 'prefix' fold
+    """
+    n_points = len(t)
+    cum = np.zeros((n_points + 1, 2))
+    cum[1:, 0] = np.cumsum(y_ivar)
+    cum[1:, 1] = np.cumsum(ivar)
+
+    # Grid cells about one cadence wide, so each holds only a few points
+    spacing = np.diff(t)
+    spacing = spacing[spacing > 0]
+    cell_width = np.median(spacing) if len(spacing) else 1.0
+    n_cells = int(t[-1] / cell_width) + 1
+    first_in_cell = np.searchsorted(t, np.arange(n_cells + 1) * cell_width, side='left')
+    max_per_cell = int(np.max(np.diff(first_in_cell), initial=0)) + 1
+
+    return {
+        'cum': cum,
+        'cell_scale': 1.0 / cell_width,
+        'n_cells': n_cells,
+        'first_in_cell': first_in_cell,
+        'max_per_cell': max_per_cell,
+        # inf padding so probes past the last point compare False
+        't_padded': np.concatenate([t, np.full(max_per_cell + 1, np.inf)]),
+    }
+
+def _chunk_size(period, baseline, bin_duration, n_points, oversample, fold):
+    """
+    Number of periods (starting at `period`) to search in one chunk
+    """
+    n_bins = period / bin_duration + oversample + 2
+    if fold == 'prefix':
+        per_period = (baseline / period + 2) * n_bins
+    else:
+        per_period = n_points + n_bins
+    return max(1, int(CHUNK_ELEMENTS // per_period))
+
+def _fold_prefix(lc, periods, bin_duration, row_len, origin=None):
+    """
+    Cumulative phase-binned sums from prefix sums evaluated at bin edges
+
+    For cycle c, phase bin j spans times [c*P + j*bin, c*P + (j+1)*bin),
+    so the sum of all bins below j is the prefix sum at c*P + j*bin minus
+    the prefix sum at c*P, summed over cycles. With an origin (per period,
+    in (-P, 0]) the cycles start at origin + c*P instead.
+    """
+    t = lc['t']
+    n_cycles = int(np.floor(t[-1] / periods.min())) + 1
+
+    cycle_start = np.arange(n_cycles + (origin is not None))[None, :, None] * \
+        periods[:, None, None]
+    if origin is not None:
+        # An origin before the first point can take one more cycle to cover
+        cycle_start = cycle_start + origin[:, None, None]
+    edges = cycle_start + np.arange(row_len)[None, None, :] * bin_duration
+    # The last bin of each cycle ends at the next cycle, not a full bin
+    # later (so columns past a period's last bin all hold its total)
+    edges = np.minimum(edges, cycle_start + periods[:, None, None])
+
+    cum = lc['cum'][_count_before(lc, edges)].sum(axis=1)
+    cum -= cum[:, :1]
+    return cum[..., 0], cum[..., 1]
+
+def _count_before(lc, x):
+    """
+    Number of (sorted) times strictly less than each x
+
+    Equivalent to np.searchsorted(t, x, side='left'), but uses a uniform
+    grid lookup: cell g of width cell_width holds at most max_per_cell
+    points, so the answer is the count before the cell plus a few
+    comparisons inside it.
+    """
+    t_padded = lc['t_padded']
+    cell = np.clip(x * lc['cell_scale'], 0, lc['n_cells']).astype(np.int64)
+    count = lc['first_in_cell'][cell]
+    probe = count.copy()
+    for _ in range(lc['max_per_cell']):
+        count += t_padded[probe] < x
+        probe += 1
+    return count
+
+def _fold_bincount(lc, periods, bin_duration, row_len, origin=None):
+    """
+    Cumulative phase-binned sums by scattering every point into its bin
+    """
+    n_chunk = len(periods)
+    rows = np.arange(n_chunk)
+
+    t_bins = lc['t_bins'][None, :]
+    if origin is not None:
+        t_bins = t_bins - (origin / bin_duration)[:, None]
+    index = np.mod(t_bins, (periods / bin_duration)[:, None]).astype(np.int64)
+    index += 1 + (rows * row_len)[:, None]
+    index = index.ravel()
+
+    n_total = n_chunk * row_len
+    binned_y = np.bincount(index, weights=np.tile(lc['y_ivar'], n_chunk), minlength=n_total)
+    binned_ivar = np.bincount(index, weights=np.tile(lc['ivar'], n_chunk), minlength=n_total)
+
+    cum_y = np.cumsum(binned_y[:n_total].reshape(n_chunk, row_len), axis=1)
+    cum_ivar = np.cumsum(binned_ivar[:n_total].reshape(n_chunk, row_len), axis=1)
+    return cum_y, cum_ivar
+
+def _scan_boxes(cum_y, cum_ivar, sum_y, sum_ivar, periods, n_real, bin_duration,
+                duration_bins, oversample, power, depth, best_duration, transit_time):
+    """
+    Best box per period from cumulative phase-binned sums (modified in
+    place), written into the output slices
+    """
+    rows = np.arange(len(periods))
+    n_bins = n_real + oversample
+    row_len = cum_y.shape[1]
+
+    # Wrap padding exactly as astropy's bls.c does it: bins 1..oversample
+    # are copied to positions n_real..n_real+oversample-1 (this replaces
+    # the last, partial phase bin), then the sums are accumulated.
+    last = cum_y[rows, n_real - 1]
+    last_ivar = cum_ivar[rows, n_real - 1]
+    for k in range(1, oversample + 1):
+        cum_y[rows, n_real - 1 + k] = last + cum_y[:, k]
+        cum_ivar[rows, n_real - 1 + k] = last_ivar + cum_ivar[:, k]
+    cum_y[rows, n_bins] = cum_y[rows, n_bins - 1]
+    cum_ivar[rows, n_bins] = cum_ivar[rows, n_bins - 1]
+
+    # Boxes may not extend past n_bins; NaN there makes them fail the
+    # depth test below without a separate mask per duration
+    beyond = np.arange(row_len)[None, :] > n_bins[:, None]
+    cum_y[beyond] = np.nan
+
+    for dur in duration_bins:
+        y_in = cum_y[:, dur:] - cum_y[:, :-dur]
+        ivar_in = cum_ivar[:, dur:] - cum_ivar[:, :-dur]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            box_depth = sum_y - y_in
+            box_depth /= sum_ivar - ivar_in
+            y_in /= ivar_in
+            box_depth -= y_in
+            # Log-likelihood without the constant 1/2 (applied below)
+            objective = box_depth * box_depth
+            objective *= ivar_in
+
+        # Keep dips with data both in and out of transit; empty boxes give
+        # NaN depth and so fail the depth test
+        valid = box_depth > 0
+        valid &= ivar_in <= sum_ivar - EPSILON
+        objective[~valid] = -np.inf
+
+        best_start = np.argmax(objective, axis=1)
+        best_objective = 0.5 * objective[rows, best_start]
+
+        # Strictly greater: earlier (shorter) durations win ties, as in astropy
+        better = best_objective > power
+        if not np.any(better):
+            continue
+
+        dur_days = dur * bin_duration
+        power[better] = best_objective[better]
+        depth[better] = box_depth[rows, best_start][better]
+        best_duration[better] = dur_days
+        transit_time[better] = np.mod(best_start[better] * bin_duration + 0.5 * dur_days,
+                                      periods[better])
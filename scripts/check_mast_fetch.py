@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Exercise the MAST fetch layer against a local stub archive
+
+Starts mast_stub_server.py on a few synthetic SPOC light curves and runs
+mast_fetch searches and downloads through it while the stub injects
+failures: HTTP 429/503, garbled JSON, dropped connections, a download cut
+short, a permanent 404 and an outage long enough to trip the circuit
+breaker. Checks that transient failures are retried, permanent ones are
+not, a star without data is None rather than an error, and that the
+breaker holds requests back. No network access is needed.
+
+Usage:
+    python check_mast_fetch.py
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import lightkurve as lk
+from astropy.io import fits
+
+from mast_session import CircuitBreaker
+from mast_fetch import configure, fetch_lightcurve, FetchError
+from mast_stub_server import start_server, parse_schedule
+
+# Breaker of the checks: opens after BREAKER_THRESHOLD failures in a row
+# for BREAKER_COOLDOWN s (doubling while failures continue)
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 0.5
+
+def write_spoc_lightcurve(path, tic_id, sector, days=27.0, cadence_minutes=2.0):
+    """
+    Write a flat, noisy light curve in the SPOC format lightkurve reads
+    """
+    rng = np.random.default_rng(tic_id)
+    time_ = np.arange(1325.0, 1325.0 + days, cadence_minutes / 1440)
+    flux = 1e4 * (1 + rng.normal(0, 1e-3, len(time_)))
+    error = np.full(len(time_), 10.0)
+    columns = [fits.Column(name='TIME', format='D', unit='BJD - 2457000, days', array=time_),
+               fits.Column(name='CADENCENO', format='J', array=np.arange(len(time_))),
+               fits.Column(name='SAP_FLUX', format='E', unit='e-/s', array=flux),
+               fits.Column(name='SAP_FLUX_ERR', format='E', unit='e-/s', array=error),
+               fits.Column(name='PDCSAP_FLUX', format='E', unit='e-/s', array=flux),
+               fits.Column(name='PDCSAP_FLUX_ERR', format='E', unit='e-/s', array=error),
+               fits.Column(name='QUALITY', format='J', array=np.zeros(len(time_), dtype=int))]
+    primary = fits.PrimaryHDU()
+    primary.header.update(TELESCOP='TESS', CREATOR='LightCurveExporterPipelineModule',
+                          ORIGIN='NASA/Ames', OBJECT=f'TIC {tic_id}', TICID=tic_id, SECTOR=sector)
+    table = fits.BinTableHDU.from_columns(columns, name='LIGHTCURVE')
+    table.header.update(TELESCOP='TESS', TIMEDEL=cadence_minutes / 1440,
+                        TSTART=time_[0], TSTOP=time_[-1])
+    fits.HDUList([primary, table]).writeto(path, overwrite=True)
+
+def _outcome(target):
+    """
+    ('lightcurve' | 'none' | 'transient' | 'permanent', detail) of one fetch
+    """
+    try:
+        lc = fetch_lightcurve(target, mission='TESS')
+    except FetchError as e:
+        return e.error_class, str(e)
+    if lc is None:
+        return 'none', 'no light curve'
+    return 'lightcurve', f"TIC {lc.meta.get('TICID')}, {len(lc)} cadences"
+
+# (description, failure schedule, target, expected outcome, retries)
+# Requests of one fetch, in order: Mast.Caom.Filtered, Mast.Caom.Products,
+# download HEAD, download GET (the column config is fetched once per run)
+SCENARIOS = [
+    ('Star in the archive', '', 'TIC 11', 'lightcurve', 4),
+    ('Star without TESS data', '', 'TIC 999', 'none', 4),
+    ('429, garbled JSON, 503 and a dropped connection are retried',
+     '429,garbled,503,drop', 'TIC 11', 'lightcurve', 4),
+    ('A download cut short is downloaded again', 'ok*3,garbled', 'TIC 22', 'lightcurve', 4),
+    ('404 is permanent and not retried', '404', 'TIC 11', 'permanent', 4),
+    ('An outage longer than the retries is transient', '503*10', 'TIC 11', 'transient', 2),
+    ('The circuit breaker holds requests during an outage', f'503*{2 * BREAKER_THRESHOLD}',
+     'TIC 11', 'lightcurve', 2 * BREAKER_THRESHOLD),
+]
+
+def check_mast_fetch(work_dir):
+    """
+    Run every scenario against a stub archive in work_dir
+
+    Returns:
+        Number of failed checks
+    """
+    data_dir = f'{work_dir}/archive'
+    os.makedirs(data_dir)
+    write_spoc_lightcurve(f'{data_dir}/TIC_11.fits', 11, 1)
+    write_spoc_lightcurve(f'{data_dir}/TIC_22_s0005.fits', 22, 5)
+    server, url = start_server(data_dir)
+    stub = server.stub
+    print(f"Stub archive at {url}")
+    print("=" * 60)
+
+    failures = 0
+    for description, schedule, target, expected, retries in SCENARIOS:
+        # A fresh download cache, so every scenario downloads its file
+        lk.conf.cache_dir = tempfile.mkdtemp(dir=work_dir)
+        breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+        recorder = configure(server=url, rate=None, retries=retries, breaker=breaker,
+                             backoff=0.01)
+        stub.set_schedule(schedule)
+
+        start = time.monotonic()
+        outcome, detail = _outcome(target)
+        elapsed = time.monotonic() - start
+        injected = sum(count for kind, count in stub.counts.items() if kind != 'ok')
+        scheduled = sum(kind != 'ok' for kind in parse_schedule(schedule))
+
+        problems = []
+        if outcome != expected:
+            problems.append(f"expected {expected}, got {outcome}: {detail}")
+        if expected != 'transient' and injected != scheduled:
+            problems.append(f"only {injected} of {scheduled} scheduled failures were served")
+        if expected == 'permanent' and sum(stub.counts.values()) != 1:
+            problems.append(f"retried a permanent failure ({sum(stub.counts.values())} requests)")
+        if 'circuit breaker' in description and elapsed < 3 * BREAKER_COOLDOWN:
+            problems.append(f"finished in {elapsed:.2f} s, the breaker did not pause requests")
+
+        failures += bool(problems)
+        print(f"{'✗' if problems else '✓'} {description}: {outcome} ({detail}), "
+              f"{sum(stub.counts.values())} requests, {elapsed:.2f} s")
+        for problem in problems:
+            print(f"    {problem}")
+        recorder.close()
+
+    server.shutdown()
+    print("=" * 60)
+    print(f"{len(SCENARIOS) - failures}/{len(SCENARIOS)} checks passed")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Exercise mast_fetch retries, circuit breaker '
+                                                 'and error classification against a local '
+                                                 'stub archive')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the temporary archive and download cache')
+
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='mast_stub_')
+    try:
+        failed = check_mast_fetch(work_dir)
+    finally:
+        if args.keep:
+            print(f"Files kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
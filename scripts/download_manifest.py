@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Resumable download manifest: the state of every target of a download job
+
+Each downloader records its targets in download_manifest.sqlite in the
+output directory (or phase3_ultra.lcpack.manifest next to an archive):
+
+    pending      selected, not queried yet
+    searching    query in flight (a job killed mid-query leaves this)
+    no_data      the archive has no light curve for the target
+    downloaded   saved; path, sector and size recorded
+    failed       error recorded with its class, transient or permanent
+
+A restarted job skips downloaded and no_data targets (if the saved file
+is still there) and permanent failures, and queries everything else
+again, so a week-long download resumes where it stopped. Summarize a
+manifest with:
+
+    python download_manifest.py ../data/tess_random_ultra_70k
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+
+from lightcurve_archive import split_member, get_entry
+from mast_fetch import classify_error
+
+MANIFEST_FILENAME = 'download_manifest.sqlite'
+ARCHIVE_MANIFEST_SUFFIX = '.manifest'
+
+# Created when a download run exits (see completion_marker)
+COMPLETE_FILENAME = 'DOWNLOAD_COMPLETE'
+ARCHIVE_COMPLETE_SUFFIX = '.complete'
+
+STATES = ('pending', 'searching', 'no_data', 'downloaded', 'failed')
+
+# Seconds to wait for another process's write lock
+LOCK_TIMEOUT = 120
+
+# Seconds between commits of searching/no_data/failed records;
+# downloads are committed immediately
+COMMIT_INTERVAL = 5
+
+TARGET_COLUMNS = ['target', 'state', 'path', 'sector', 'size', 'error_class', 'error',
+                  'attempts', 'updated']
+
+def manifest_filename(output_dir, archive=None):
+    """
+    Manifest that goes with a download directory or archive
+    """
+    if archive:
+        return archive + ARCHIVE_MANIFEST_SUFFIX
+    return os.path.join(output_dir, MANIFEST_FILENAME)
+
+def completion_marker(output_dir, archive=None):
+    """
+    File that exists while no download run is writing to a directory or
+    archive; an analyzer following the download (--follow) stops once it
+    appears and every light curve is analyzed
+    """
+    if archive:
+        return archive + ARCHIVE_COMPLETE_SUFFIX
+    return os.path.join(output_dir, COMPLETE_FILENAME)
+
+def output_size(path):
+    """
+    Size in bytes of a saved light curve (file or archive entry), or None
+    if it no longer exists
+    """
+    member = split_member(path)
+    if member:
+        try:
+            return get_entry(*member)['nbytes']
+        except KeyError:
+            return None
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+class DownloadManifest:
+    """
+    Per-target download state stored in SQLite
+    """
+
+    def __init__(self, path, marker=None):
+        self.path = path
+        # Removed while this run downloads, recreated by close()
+        self.marker = marker
+        if marker and os.path.exists(marker):
+            os.remove(marker)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS targets (target TEXT PRIMARY KEY, '
+                          'state TEXT, path TEXT, sector INTEGER, size INTEGER, '
+                          'error_class TEXT, error TEXT, attempts INTEGER DEFAULT 0, '
+                          'updated REAL)')
+        self.conn.commit()
+        self._last_commit = time.time()
+
+    def add_pending(self, targets):
+        """
+        Record targets as pending unless they are already in the manifest
+        """
+        now = time.time()
+        self.conn.executemany("INSERT OR IGNORE INTO targets (target, state, updated) "
+                              "VALUES (?, 'pending', ?)", [(str(t), now) for t in targets])
+        self.conn.commit()
+
+    def states(self):
+        """
+        dict mapping target -> row dict
+        """
+        rows = self.conn.execute(f'SELECT {", ".join(TARGET_COLUMNS)} FROM targets').fetchall()
+        return {row[0]: dict(zip(TARGET_COLUMNS, row)) for row in rows}
+
+    def resume(self, targets, retry_errors=False):
+        """
+        Register targets and drop the ones an earlier run finished
+
+        Parameters:
+        -----------
+        targets : list
+            Targets of this run, in the order they will be queried
+        retry_errors : bool
+            Also query targets that failed permanently
+
+        Returns:
+            (targets still to query, number of them already downloaded)
+        """
+        self.add_pending(targets)
+        states = self.states()
+        done = {t for t in targets if is_done(states.get(str(t)), retry_errors)}
+        downloaded = sum(states[str(t)]['state'] == 'downloaded' for t in done)
+        if done:
+            print(f"Resuming: {len(done)} targets finished in an earlier run "
+                  f"({downloaded} downloaded)")
+        return [t for t in targets if t not in done], downloaded
+
+    def count(self, state):
+        """
+        Number of targets in state
+        """
+        return self.conn.execute('SELECT COUNT(*) FROM targets WHERE state = ?',
+                                 (state,)).fetchone()[0]
+
+    def _update(self, target, state, commit, **values):
+        values.update(state=state, updated=time.time())
+        assignments = ', '.join(f'{name} = ?' for name in values)
+        params = list(values.values()) + [str(target)]
+        self.conn.execute("INSERT OR IGNORE INTO targets (target, state) VALUES (?, 'pending')",
+                          (str(target),))
+        self.conn.execute(f'UPDATE targets SET {assignments} WHERE target = ?', params)
+        if commit or time.time() - self._last_commit > COMMIT_INTERVAL:
+            self.commit()
+
+    def mark_searching(self, target):
+        self._update(target, 'searching', commit=False)
+        self.conn.execute("UPDATE targets SET attempts = attempts + 1 WHERE target = ?",
+                          (str(target),))
+
+    def mark_no_data(self, target):
+        self._update(target, 'no_data', commit=False, error_class=None, error=None)
+
+    def mark_downloaded(self, target, path, sector=None):
+        """
+        Record a saved light curve (and commit, so it survives a kill)
+        """
+        self._update(target, 'downloaded', commit=True, path=path,
+                     sector=int(sector) if sector is not None else None,
+                     size=output_size(path), error_class=None, error=None)
+
+    def mark_failed(self, target, exc):
+        self._update(target, 'failed', commit=False, error_class=classify_error(exc),
+                     error=f"{type(exc).__name__}: {str(exc)[:200]}")
+
+    def commit(self):
+        self.conn.commit()
+        self._last_commit = time.time()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+        if self.marker:
+            with open(self.marker, 'w') as f:
+                f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+
+def is_done(row, retry_errors=False):
+    """
+    True if a manifest row needs no further queries: downloaded (and the
+    file is still there), no data, or a permanent failure (unless
+    retry_errors)
+    """
+    if row is None:
+        return False
+    if row['state'] == 'downloaded':
+        return output_size(row['path']) is not None
+    if row['state'] == 'no_data':
+        return True
+    if row['state'] == 'failed':
+        return row['error_class'] == 'permanent' and not retry_errors
+    return False
+
+def summarize(path):
+    """
+    Count targets per state (failures split by error class)
+    """
+    conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+    try:
+        rows = conn.execute('SELECT state, error_class, COUNT(*) FROM targets '
+                            'GROUP BY state, error_class').fetchall()
+    finally:
+        conn.close()
+    counts = {}
+    for state, error_class, count in rows:
+        key = f'{state} ({error_class})' if state == 'failed' else state
+        counts[key] = counts.get(key, 0) + count
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Summarize a download manifest')
+    parser.add_argument('path', help='Download directory, archive, or manifest file')
+    args = parser.parse_args()
+
+    path = args.path
+    if os.path.isdir(path):
+        path = manifest_filename(path)
+    elif not path.endswith(('.sqlite', ARCHIVE_MANIFEST_SUFFIX)):
+        path = manifest_filename(None, path)
+
+    for state, count in sorted(summarize(path).items()):
+        print(f"{state:22s} {count:>10,d}")
@@ -4,12 +4,66 @@ Download TESS light curves for analysis
 This script downloads a sample of TESS targets for exoplanet transit analysis
 """
 
-import lightkurve as lk
 import argparse
 import os
 from tqdm import tqdm
 
-def download_tess_sample(num_targets=10, output_dir='../data/tess'):
+from lightcurve_archive import save_lightcurve, sector_filename, member_path
+from download_manifest import (DownloadManifest, manifest_filename, completion_marker,
+                               output_size)
+from mast_session import DEFAULT_SERVER
+from lc_store import LightCurveStore
+from mast_fetch import (fetch_lightcurve, search_sectors, fetch_sector, configure,
+                        print_latency_summary, DEFAULT_RATE)
+
+def download_sectors(target, stem, output_dir, archive=None, slim=False, lc_store=None,
+                     tic_id=None, **search_options):
+    """
+    Download every sector of a target as <stem>_s0011.fits, ...
+
+    Sectors already saved (an earlier run) are not downloaded again, so
+    rerunning a finished download fetches only sectors TESS has observed
+    since. Sectors lc_store holds are linked instead of downloaded.
+
+    Parameters:
+    -----------
+    target : str
+        Anything lk.search_lightcurve accepts ('TIC 123', 'TOI-700', ...)
+    stem : str
+        File name stem of the target's sectors
+    tic_id : int
+        TIC ID of the target, needed to link sectors from lc_store
+    search_options :
+        Passed to lk.search_lightcurve (mission, author, ...)
+
+    Returns:
+        list of (sector, path) of every saved sector, new and earlier;
+        empty if the archive has no matching light curve
+
+    Raises:
+        mast_fetch.FetchError if the search or a download failed
+    """
+    saved = []
+    for sector, row in search_sectors(target, **search_options):
+        filename = sector_filename(stem, sector)
+        path = member_path(archive, filename) if archive else os.path.join(output_dir, filename)
+        if output_size(path) is None:
+            stored = None
+            if lc_store and tic_id is not None:
+                stored = lc_store.find(tic_id, author=search_options.get('author'),
+                                       sector=sector)
+            if stored is not None:
+                lc_store.link(stored, path)
+            else:
+                path = save_lightcurve(fetch_sector(row), output_dir, filename, archive, slim,
+                                       lc_store)
+        saved.append((sector, path))
+    return saved
+
+def download_tess_sample(num_targets=10, output_dir='../data/tess', archive=None,
+                         retry_errors=False, mast_server=DEFAULT_SERVER, rate_limit=DEFAULT_RATE,
+                         latency_log=None, slim=False, store=None, all_sectors=False,
+                         refresh_sectors=False):
     """
     Download TESS light curves for a sample of targets
 
@@ -19,13 +73,42 @@ def download_tess_sample(num_targets=10, output_dir='../data/tess'):
         Number of targets to download
     output_dir : str
         Directory to save downloaded data
+    archive : str
+        Packed light-curve archive to append to instead of writing one
+        FITS file per target (see lightcurve_archive.py)
+    retry_errors : bool
+        Also retry targets that failed permanently in an earlier run
+        (transient failures are always retried)
+    mast_server : str
+        MAST base URL (a local stub archive for testing)
+    rate_limit : float
+        MAST requests per second (0 = unlimited)
+    latency_log : str
+        CSV file to append every MAST request's latency to
+    slim : bool
+        Keep only the columns the analyzer reads, compressed (see
+        slim_fits.write_slim_fits); ~4x smaller files
+    store : str
+        Shared light-curve store directory (see lc_store.py). Targets it
+        already holds (SPOC) are linked instead of downloaded, and new
+        downloads are added to it.
+    all_sectors : bool
+        Download every sector of each target (TIC_123_s0011.fits, ...)
+        instead of only the first, for analyze_tess_transits.py --multi-sector
+    refresh_sectors : bool
+        With all_sectors: search targets an earlier run finished again and
+        download only their new sectors
     """
 
     # Create output directory
-    os.makedirs(output_dir, exist_ok=True)
+    if archive is None:
+        os.makedirs(output_dir, exist_ok=True)
+    elif store:
+        raise ValueError("A light-curve store holds FITS files; it can't be combined "
+                         "with an archive")
 
     print(f"Downloading {num_targets} TESS light curves...")
-    print(f"Output directory: {output_dir}")
+    print(f"Output: {archive or output_dir}")
 
     # PHASE 1: 50 Confirmed Exoplanet Host Stars with TESS Data
     # Curated list of well-studied systems with reliable SPOC pipeline data
@@ -88,41 +171,82 @@ def download_tess_sample(num_targets=10, output_dir='../data/tess'):
     # Limit to requested number
     tic_ids = tic_ids[:num_targets]
 
-    downloaded = 0
-    for tic_id in tqdm(tic_ids):
-        try:
-            # Search for TESS SPOC (Science Processing Operations Center) data only
-            # This ensures we get high-quality, properly processed light curves
-            search_result = lk.search_lightcurve(
-                tic_id,
-                mission='TESS',
-                author='SPOC'  # Use only official TESS pipeline products
-            )
-
-            if len(search_result) == 0:
-                print(f"  No SPOC data found for {tic_id}")
-                continue
+    # Resume: skip targets an earlier run finished
+    manifest = DownloadManifest(manifest_filename(output_dir, archive),
+                                completion_marker(output_dir, archive))
+    total = len(tic_ids)
+    remaining, downloaded = manifest.resume(tic_ids, retry_errors)
+    if all_sectors and refresh_sectors:
+        # Finished targets are searched again for sectors observed since
+        states = manifest.states()
+        refreshed = [t for t in tic_ids if t not in remaining and
+                     states[t]['state'] == 'downloaded']
+        downloaded -= len(refreshed)
+        remaining = [t for t in tic_ids if t in remaining or t in refreshed]
+    tic_ids = remaining
+    recorder = configure(server=mast_server, rate=rate_limit, latency_log=latency_log)
+    lc_store = LightCurveStore(store) if store else None
 
-            # Download first available sector only (faster, less data)
-            # Change to .download_all() if you want all sectors
-            lc = search_result[0].download()
+    try:
+        for tic_id in tqdm(tic_ids):
+            manifest.mark_searching(tic_id)
+            filename = f"{tic_id.replace(' ', '_')}.fits"
+            try:
+                if all_sectors:
+                    sectors = download_sectors(tic_id, tic_id.replace(' ', '_'), output_dir,
+                                               archive, slim, lc_store, int(tic_id.split()[-1]),
+                                               mission='TESS', author='SPOC')
+                    if not sectors:
+                        print(f"  No SPOC data found for {tic_id}")
+                        manifest.mark_no_data(tic_id)
+                        continue
+                    manifest.mark_downloaded(tic_id, sectors[0][1], sectors[0][0])
+                    print(f"  ✓ {tic_id}: Sectors {', '.join(str(s) for s, _ in sectors)}")
+                    downloaded += 1
+                    continue
 
-            if lc is None:
-                print(f"  Download failed for {tic_id}")
-                continue
+                stored = lc_store.find(int(tic_id.split()[-1]), author='SPOC') if lc_store else None
+                if stored is not None:
+                    # Another phase already downloaded this star
+                    path = lc_store.link(stored, os.path.join(output_dir, filename))
+                    manifest.mark_downloaded(tic_id, path, stored['sector'])
+                    print(f"  ✓ Linked {tic_id} from the store: Sector {stored['sector']}")
+                    downloaded += 1
+                    continue
+
+                # Search for TESS SPOC (Science Processing Operations Center) data only
+                # This ensures we get high-quality, properly processed light curves
+                # Downloads the first available sector only (faster, less data);
+                # failed requests are retried with backoff before giving up
+                lc = fetch_lightcurve(
+                    tic_id,
+                    mission='TESS',
+                    author='SPOC'  # Use only official TESS pipeline products
+                )
 
-            # Save to file
-            output_file = os.path.join(output_dir, f"{tic_id.replace(' ', '_')}.fits")
-            lc.to_fits(output_file, overwrite=True)
+                if lc is None:
+                    print(f"  No SPOC data found for {tic_id}")
+                    manifest.mark_no_data(tic_id)
+                    continue
 
-            print(f"  ✓ Downloaded {tic_id}: {len(lc)} data points, Sector {lc.sector}")
-            downloaded += 1
+                # Save to file (or archive entry of the same name)
+                path = save_lightcurve(lc, output_dir, filename, archive, slim, lc_store)
+                manifest.mark_downloaded(tic_id, path, lc.sector)
 
-        except Exception as e:
-            print(f"  ✗ Error downloading {tic_id}: {str(e)[:100]}")
-            continue
+                print(f"  ✓ Downloaded {tic_id}: {len(lc)} data points, Sector {lc.sector}")
+                downloaded += 1
 
-    print(f"\nSuccessfully downloaded {downloaded}/{len(tic_ids)} targets")
+            except Exception as e:
+                print(f"  ✗ Error downloading {tic_id}: {str(e)[:100]}")
+                manifest.mark_failed(tic_id, e)
+                continue
+    finally:
+        # Keep whatever finished if the job is killed
+        manifest.close()
+        if lc_store:
+            lc_store.close()
+    print(f"\nSuccessfully downloaded {downloaded}/{total} targets")
+    print_latency_summary(recorder)
     return downloaded
 
 if __name__ == "__main__":
@@ -131,7 +255,40 @@ if __name__ == "__main__":
                         help='Number of targets to download (default: 10)')
     parser.add_argument('-o', '--output-dir', type=str, default='../data/tess',
                         help='Output directory (default: ../data/tess)')
+    parser.add_argument('-a', '--archive', type=str, default=None,
+                        help='Append to a packed light-curve archive (*.lcpack) '
+                             'instead of writing FITS files to the output directory')
+
+    parser.add_argument('--retry-errors', action='store_true',
+                        help='Also retry targets that failed permanently in an earlier '
+                             'run (transient failures are always retried)')
+
+    parser.add_argument('--mast-server', type=str, default=DEFAULT_SERVER,
+                        help=f'MAST base URL, e.g. a local stub archive for testing '
+                             f'(default: {DEFAULT_SERVER})')
+    parser.add_argument('--rate-limit', type=float, default=DEFAULT_RATE,
+                        help=f'MAST requests per second (default: {DEFAULT_RATE}, '
+                             f'0 = unlimited)')
+    parser.add_argument('--latency-log', type=str, default=None,
+                        help='CSV file to append every MAST request\'s latency to')
+
+    parser.add_argument('--slim', action='store_true',
+                        help='Save only time, flux, flux error and quality, compressed '
+                             '(several times smaller; read transparently by the analyzer)')
+
+    parser.add_argument('--store', type=str, default=None,
+                        help='Shared light-curve store (see lc_store.py): link targets it '
+                             'already has instead of downloading them, add new downloads')
+
+    parser.add_argument('--all-sectors', action='store_true',
+                        help='Download every sector of each target (TIC_123_s0011.fits, ...) '
+                             'for analyze_tess_transits.py --multi-sector')
+    parser.add_argument('--refresh-sectors', action='store_true',
+                        help='With --all-sectors: search finished targets again and download '
+                             'only sectors observed since the last run')
 
     args = parser.parse_args()
 
-    download_tess_sample(args.num_targets, args.output_dir)
+    download_tess_sample(args.num_targets, args.output_dir, args.archive, args.retry_errors,
+                         args.mast_server, args.rate_limit, args.latency_log, args.slim,
+                         args.store, args.all_sectors, args.refresh_sectors)
@@ -4,13 +4,105 @@ PHASE 3: Download Random TESS Stars for Discovery
 Search random TESS-observed stars for missed exoplanet transits
 """
 
-import lightkurve as lk
 import argparse
 import os
+import time
 from tqdm import tqdm
 import random
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-def download_random_tess_stars(num_targets=1000, output_dir='../data/tess_random', seed=42):
+from lightcurve_archive import save_lightcurve
+from mast_session import DEFAULT_SERVER
+from mast_fetch import fetch_lightcurve, configure, print_latency_summary, DEFAULT_RATE
+from target_lists import load_observed_tics, sample_observed
+from tic_registry import TicRegistry
+from download_manifest import DownloadManifest, manifest_filename, completion_marker
+from analysis_ledger import count_records
+from lc_store import LightCurveStore
+
+# Seconds between checks of the analysis ledger while the backlog is full
+BACKLOG_POLL_SECONDS = 30
+
+def fetch_random_star(tic_id):
+    """
+    Search one TIC ID and download its first TESS light curve
+
+    Returns:
+        LightCurve, or None if the star has no TESS data
+
+    Raises:
+        mast_fetch.FetchError if the query failed (after retries)
+    """
+    # Accept both SPOC (2-min) and FFI (30-min) data for better coverage
+    # Removed author='SPOC' filter - accept any TESS data!
+    return fetch_lightcurve(f'TIC {tic_id}', mission='TESS')
+
+def _fetch_quietly(tic_id, store=None):
+    """
+    fetch_random_star() that reports failures instead of raising
+
+    Returns:
+        (LightCurve or None, the exception if the search/download failed);
+        a star the store already has is returned as its store row (a
+        dict) without any request to MAST
+    """
+    try:
+        if store is not None:
+            stored = store.find(tic_id)
+            if stored is not None:
+                return stored, None
+        return fetch_random_star(tic_id), None
+    except Exception as e:
+        # Silent failures - most random TICs won't have data
+        return None, e
+
+def _iter_fetched(tic_ids, concurrency, started=None, store=None):
+    """
+    Yield (tic_id, light curve or None, error) in the order of tic_ids
+
+    With concurrency > 1 up to that many searches/downloads run at once in
+    threads (the work is network round trips, not CPU). Results are still
+    consumed in input order, so which stars end up downloaded depends only
+    on the seed, not on which request happened to finish first. At most
+    2 * concurrency stars are in flight or waiting, which bounds memory.
+    started(tic_id), if given, is called in the calling thread as each
+    query is issued.
+    """
+    if concurrency <= 1:
+        for tic_id in tic_ids:
+            if started:
+                started(tic_id)
+            yield (tic_id,) + _fetch_quietly(tic_id, store)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = deque()
+    tic_iter = iter(tic_ids)
+    try:
+        for tic_id in tic_iter:
+            if started:
+                started(tic_id)
+            pending.append((tic_id, executor.submit(_fetch_quietly, tic_id, store)))
+            if len(pending) >= 2 * concurrency:
+                tic_id, future = pending.popleft()
+                yield (tic_id,) + future.result()
+        while pending:
+            tic_id, future = pending.popleft()
+            yield (tic_id,) + future.result()
+    finally:
+        # Reached when the caller stops early (enough stars, or Ctrl-C):
+        # drop queued requests and don't wait for the ones in flight
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+def download_random_tess_stars(num_targets=1000, output_dir='../data/tess_random', seed=42,
+                               archive=None, concurrency=1, mast_server=DEFAULT_SERVER,
+                               target_lists=None, registry=None, retry_errors=False,
+                               analysis_dir=None, max_backlog=None, rate_limit=DEFAULT_RATE,
+                               latency_log=None, slim=False, store=None):
     """
     Download TESS light curves for random stars
 
@@ -22,13 +114,54 @@ def download_random_tess_stars(num_targets=1000, output_dir='../data/tess_random
         Directory to save downloaded data
     seed : int
         Random seed for reproducibility (default: 42)
+    archive : str
+        Packed light-curve archive to append to instead of writing one
+        FITS file per star (see lightcurve_archive.py)
+    concurrency : int
+        Stars searched/downloaded at once (1 = one after another). The same
+        seed gives the same stars at any concurrency.
+    mast_server : str
+        MAST base URL (a local stub archive for testing)
+    target_lists : list of str
+        Sector target-list CSVs, index files or directories (see
+        target_lists.py). If given, TIC IDs are drawn only from stars
+        listed there instead of the whole catalog range.
+    registry : str
+        Directory of the cross-run TIC registry (see tic_registry.py).
+        Stars any run already downloaded or found without data are not
+        queried again, and this run's outcomes are added to it.
+    retry_errors : bool
+        Also retry stars that failed permanently in an earlier run of this
+        output directory (transient failures are always retried)
+    analysis_dir : str
+        Output directory of an analyzer following this download
+        (analyze_tess_transits.py --follow)
+    max_backlog : int
+        Pause while more than this many downloaded stars are not yet in
+        the analysis_dir ledger, so a slow analyzer does not fall ever
+        further behind
+    rate_limit : float
+        MAST requests per second across all threads (0 = unlimited)
+    latency_log : str
+        CSV file to append every MAST request's latency to
+    slim : bool
+        Keep only the columns the analyzer reads, compressed (see
+        slim_fits.write_slim_fits); ~4x smaller files
+    store : str
+        Shared light-curve store directory (see lc_store.py). Stars it
+        already holds are linked instead of downloaded, and new downloads
+        are added to it.
     """
 
     # Create output directory
-    os.makedirs(output_dir, exist_ok=True)
+    if archive is None:
+        os.makedirs(output_dir, exist_ok=True)
+    elif store:
+        raise ValueError("A light-curve store holds FITS files; it can't be combined "
+                         "with an archive")
 
     print(f"Downloading {num_targets} random TESS star light curves...")
-    print(f"Output directory: {output_dir}")
+    print(f"Output: {archive or output_dir}")
     print("Note: Most will have no transits, but you might discover something new!")
 
     # Strategy: Sample random TIC IDs from TESS Input Catalog
@@ -37,59 +170,141 @@ def download_random_tess_stars(num_targets=1000, output_dir='../data/tess_random
     # Generate random TIC IDs to try
     print("\nGenerating random TIC IDs to search...")
     print(f"Using random seed: {seed}")
-    random.seed(seed)  # Reproducible random selection
 
     # We'll try more than num_targets since many won't have SPOC data
     attempts = num_targets * 5  # Try 5x to account for failures
-    random_tic_ids = random.sample(range(1000000, 500000000), attempts)
+    tic_registry = TicRegistry(registry) if registry else None
+    # Resume: skip stars an earlier run of this output finished, and count
+    # its downloads toward num_targets
+    manifest = DownloadManifest(manifest_filename(output_dir, archive),
+                                completion_marker(output_dir, archive))
+    if tic_registry:
+        # Stars this output already holds stay in the sample, so resume()
+        # counts them; the registry only skips stars other runs covered
+        own = np.array([int(t) for t in manifest.states()], dtype=np.int64)
+        def covered(tic_ids):
+            return tic_registry.seen(tic_ids) & ~np.isin(np.asarray(tic_ids), own)
+    if target_lists:
+        # Only stars a sector actually observed, so nearly every probe
+        # finds a light curve
+        observed = load_observed_tics(target_lists)
+        print(f"Sampling from {len(observed)} TIC IDs in the sector target lists")
+        if tic_registry:
+            # Draw from the stars no earlier run has covered
+            observed = observed[~covered(observed)]
+            print(f"  {len(observed)} not yet downloaded or known to lack data")
+        random_tic_ids = sample_observed(observed, attempts, seed)
+    else:
+        random.seed(seed)  # Reproducible random selection
+        random_tic_ids = random.sample(range(1000000, 500000000), attempts)
+        if tic_registry:
+            # Replace IDs earlier runs covered with further draws from the
+            # same seeded stream, so the sample stays reproducible
+            fresh, skipped = [], 0
+            candidates = random_tic_ids
+            while candidates:
+                seen = covered(candidates)
+                skipped += int(seen.sum())
+                fresh.extend(t for t, skip in zip(candidates, seen) if not skip)
+                if len(fresh) >= attempts or skipped > 10 * attempts:
+                    break
+                chosen = set(fresh)
+                candidates = [t for t in random.sample(range(1000000, 500000000),
+                                                       attempts - len(fresh))
+                              if t not in chosen]
+            random_tic_ids = fresh[:attempts]
+            print(f"Skipping {skipped} TIC IDs covered by earlier runs")
+    attempts = len(random_tic_ids)
 
-    downloaded = 0
+    random_tic_ids, downloaded = manifest.resume(random_tic_ids, retry_errors)
+    resumed = downloaded
     attempted = 0
+    if downloaded >= num_targets:
+        print(f"All {num_targets} stars already downloaded")
+        manifest.close()
+        return downloaded
 
-    print(f"Searching {attempts} random TIC IDs for TESS SPOC data...")
-    print("(This may take a while - most stars don't have TESS observations)\n")
-
-    for tic_id in tqdm(random_tic_ids):
-        if downloaded >= num_targets:
-            break
-
-        attempted += 1
-
-        try:
-            # Search for this TIC ID
-            # Accept both SPOC (2-min) and FFI (30-min) data for better coverage
-            search_result = lk.search_lightcurve(
-                f'TIC {tic_id}',
-                mission='TESS'
-                # Removed author='SPOC' filter - accept any TESS data!
-            )
+    # One keep-alive connection per thread, rate-limited and retried
+    recorder = configure(concurrency, mast_server, rate_limit, latency_log=latency_log)
+    if concurrency > 1:
+        print(f"Running {concurrency} searches/downloads concurrently")
 
-            if len(search_result) == 0:
-                continue  # No data for this star
+    print(f"Searching {len(random_tic_ids)} random TIC IDs for TESS SPOC data...")
+    print("(This may take a while - most stars don't have TESS observations)\n")
 
-            # Download first sector
-            lc = search_result[0].download()
+    analyzed = 0
+    start_time = time.time()
+    lc_store = LightCurveStore(store) if store else None
+    fetched = _iter_fetched(random_tic_ids, concurrency, manifest.mark_searching, lc_store)
+    try:
+        for tic_id, lc, error in tqdm(fetched, total=len(random_tic_ids)):
+            attempted += 1
 
             if lc is None:
+                if error is not None:
+                    manifest.mark_failed(tic_id, error)
+                else:
+                    manifest.mark_no_data(tic_id)
+                if tic_registry:
+                    # Failed queries stay eligible for the next run
+                    tic_registry.record('attempted' if error else 'no_data', tic_id)
+                continue
+
+            try:
+                if isinstance(lc, dict):
+                    # Another run or phase already stored this star: link it
+                    output_file = lc_store.link(lc, os.path.join(output_dir,
+                                                                 f"TIC_{tic_id}.fits"))
+                    sector = lc['sector']
+                else:
+                    # Save to file (or archive entry of the same name)
+                    output_file = save_lightcurve(lc, output_dir, f"TIC_{tic_id}.fits",
+                                                  archive, slim, lc_store)
+                    sector = lc.sector
+            except Exception as e:
+                print(f"  ✗ Could not save TIC {tic_id}: {str(e)[:100]}")
+                manifest.mark_failed(tic_id, e)
+                if tic_registry:
+                    tic_registry.record('attempted', tic_id)
                 continue
 
-            # Save to file
-            output_file = os.path.join(output_dir, f"TIC_{tic_id}.fits")
-            lc.to_fits(output_file, overwrite=True)
+            manifest.mark_downloaded(tic_id, output_file, sector)
+            if tic_registry:
+                tic_registry.record('downloaded', tic_id)
 
-            print(f"  ✓ Downloaded TIC {tic_id}: {len(lc)} data points, Sector {lc.sector}")
+            if isinstance(lc, dict):
+                print(f"  ✓ Linked TIC {tic_id} from the store: Sector {sector}")
+            else:
+                print(f"  ✓ Downloaded TIC {tic_id}: {len(lc)} data points, Sector {sector}")
             downloaded += 1
 
-        except KeyboardInterrupt:
-            print("\n\nDownload interrupted by user")
-            break
-        except Exception as e:
-            # Silent failures - most random TICs won't have data
-            continue
+            if downloaded >= num_targets:
+                break
+
+            if analysis_dir and max_backlog and downloaded - analyzed > max_backlog:
+                analyzed = count_records(analysis_dir)
+                if downloaded - analyzed > max_backlog:
+                    print(f"  Pausing: {downloaded - analyzed} stars waiting for analysis")
+                while downloaded - analyzed > max_backlog:
+                    time.sleep(BACKLOG_POLL_SECONDS)
+                    analyzed = count_records(analysis_dir)
+    except KeyboardInterrupt:
+        print("\n\nDownload interrupted by user")
+    finally:
+        fetched.close()
+        manifest.close()
+        if tic_registry:
+            tic_registry.close()
+        if lc_store:
+            lc_store.close()
 
+    elapsed = time.time() - start_time
     print(f"\nSuccessfully downloaded {downloaded}/{num_targets} random stars")
-    print(f"Searched {attempted} TIC IDs to find {downloaded} with TESS data")
-    print(f"Hit rate: {100*downloaded/attempted:.1f}%")
+    print(f"Searched {attempted} TIC IDs to find {downloaded - resumed} with TESS data")
+    if attempted:
+        print(f"Hit rate: {100*(downloaded - resumed)/attempted:.1f}%")
+        print(f"Throughput: {3600 * attempted / max(elapsed, 1e-9):.0f} TIC IDs/hour")
+    print_latency_summary(recorder)
 
     return downloaded
 
@@ -101,7 +316,56 @@ if __name__ == "__main__":
                         help='Output directory (default: ../data/tess_random)')
     parser.add_argument('-s', '--seed', type=int, default=42,
                         help='Random seed for reproducibility (default: 42)')
+    parser.add_argument('-a', '--archive', type=str, default=None,
+                        help='Append to a packed light-curve archive (*.lcpack) '
+                             'instead of writing FITS files to the output directory')
+
+    parser.add_argument('-j', '--concurrency', type=int, default=1,
+                        help='Stars searched/downloaded at once over pooled keep-alive '
+                             'connections (default: 1); the seed selects the same stars '
+                             'at any concurrency')
+    parser.add_argument('--mast-server', type=str, default=DEFAULT_SERVER,
+                        help=f'MAST base URL, e.g. a local stub archive for testing '
+                             f'(default: {DEFAULT_SERVER})')
+    parser.add_argument('--rate-limit', type=float, default=DEFAULT_RATE,
+                        help=f'MAST requests per second across all threads; failed '
+                             f'requests are retried with backoff (default: {DEFAULT_RATE}, '
+                             f'0 = unlimited)')
+    parser.add_argument('--latency-log', type=str, default=None,
+                        help='CSV file to append every MAST request\'s latency to')
+
+    parser.add_argument('--target-lists', type=str, nargs='+', default=None,
+                        help='Sector target-list CSVs, directories of them, or an index '
+                             'built by target_lists.py; draw TIC IDs only from these '
+                             '(default: the whole TIC range)')
+
+    parser.add_argument('-r', '--registry', type=str, default=None,
+                        help='Cross-run TIC registry directory; skip stars earlier runs '
+                             'downloaded or found without data, and record this run')
+
+    parser.add_argument('--retry-errors', action='store_true',
+                        help='Also retry stars that failed permanently in an earlier run '
+                             '(transient failures are always retried)')
+
+    parser.add_argument('--analysis-dir', type=str, default=None,
+                        help='Output directory of an analyzer following this download '
+                             '(analyze_tess_transits.py --follow)')
+    parser.add_argument('--max-backlog', type=int, default=None,
+                        help='With --analysis-dir: pause while more than this many '
+                             'downloaded stars wait for analysis')
+
+    parser.add_argument('--slim', action='store_true',
+                        help='Save only time, flux, flux error and quality, compressed '
+                             '(several times smaller; read transparently by the analyzer)')
+
+    parser.add_argument('--store', type=str, default=None,
+                        help='Shared light-curve store (see lc_store.py): link stars it '
+                             'already has instead of downloading them, add new downloads')
 
     args = parser.parse_args()
 
-    download_random_tess_stars(args.num_targets, args.output_dir, args.seed)
+    download_random_tess_stars(args.num_targets, args.output_dir, args.seed, args.archive,
+                               args.concurrency, args.mast_server, args.target_lists,
+                               args.registry, args.retry_errors, args.analysis_dir,
+                               args.max_backlog, args.rate_limit, args.latency_log,
+                               args.slim, args.store)
@@ -9,7 +9,97 @@ import argparse
 import os
 from tqdm import tqdm
 
-def download_toi_candidates(num_targets=200, output_dir='../data/tess_toi'):
+from lightcurve_archive import save_lightcurve
+from download_manifest import DownloadManifest, manifest_filename, completion_marker
+from mast_session import DEFAULT_SERVER
+from mast_fetch import (fetch_lightcurve, download_first, with_retries, configure,
+                        print_latency_summary, DEFAULT_RATE)
+from toi_catalog import open_catalog
+from lc_store import LightCurveStore
+from download_tess_data import download_sectors
+
+def _download_toi_numbers(toi_numbers, tic_ids, manifest, output_dir, archive, retry_errors,
+                          slim=False, lc_store=None, all_sectors=False, refresh_sectors=False):
+    """
+    Download the first SPOC light curve of each TOI number (every sector
+    with all_sectors)
+
+    TOIs with a known TIC ID (tic_ids: TOI number -> TIC ID) are searched
+    by TIC ID, or linked from lc_store if it already has the star; the
+    others are searched by name, which costs MAST a name resolution.
+
+    Returns:
+        Number of TOIs downloaded (including earlier runs)
+    """
+    all_names = [f'TOI-{toi_num}' for toi_num in toi_numbers]
+    toi_names, downloaded = manifest.resume(all_names, retry_errors)
+    if all_sectors and refresh_sectors:
+        # Finished TOIs are searched again for sectors observed since
+        states = manifest.states()
+        refreshed = [t for t in all_names if t not in toi_names and
+                     states[t]['state'] == 'downloaded']
+        downloaded -= len(refreshed)
+        toi_names = [t for t in all_names if t in toi_names or t in refreshed]
+
+    for toi_name in tqdm(toi_names):
+        manifest.mark_searching(toi_name)
+        try:
+            toi_num = int(toi_name[len('TOI-'):])
+            target = f'TIC {tic_ids[toi_num]}' if toi_num in tic_ids else toi_name
+
+            if all_sectors:
+                stem = f"TOI_{toi_num}_TIC_{tic_ids[toi_num]}" if toi_num in tic_ids \
+                    else f"TOI_{toi_num}"
+                sectors = download_sectors(target, stem, output_dir, archive, slim, lc_store,
+                                           tic_ids.get(toi_num), mission='TESS', author='SPOC')
+                if not sectors:
+                    manifest.mark_no_data(toi_name)
+                    continue
+                manifest.mark_downloaded(toi_name, sectors[0][1], sectors[0][0])
+                print(f"  ✓ {toi_name}: Sectors {', '.join(str(s) for s, _ in sectors)}")
+                downloaded += 1
+                continue
+
+            stored = None
+            if lc_store and toi_num in tic_ids:
+                stored = lc_store.find(tic_ids[toi_num], author='SPOC')
+            if stored is not None:
+                # Another phase already downloaded this star
+                filename = f"TOI_{toi_num}_TIC_{tic_ids[toi_num]}.fits"
+                path = lc_store.link(stored, os.path.join(output_dir, filename))
+                manifest.mark_downloaded(toi_name, path, stored['sector'])
+                print(f"  ✓ Linked {toi_name} (TIC {tic_ids[toi_num]}) from the store: "
+                      f"Sector {stored['sector']}")
+                downloaded += 1
+                continue
+
+            # Download first sector
+            lc = fetch_lightcurve(target, mission='TESS', author='SPOC')
+
+            if lc is None:
+                manifest.mark_no_data(toi_name)
+                continue
+
+            # Save to file
+            # Get TIC ID from light curve if available
+            tic_id = tic_ids.get(toi_num) or getattr(lc, 'targetid', toi_name.replace('-', '_'))
+            path = save_lightcurve(lc, output_dir, f"TOI_{toi_num}_TIC_{tic_id}.fits", archive,
+                                   slim, lc_store)
+            manifest.mark_downloaded(toi_name, path, lc.sector)
+
+            print(f"  ✓ Downloaded {toi_name} (TIC {tic_id}): {len(lc)} data points, Sector {lc.sector}")
+            downloaded += 1
+
+        except Exception as e:
+            manifest.mark_failed(toi_name, e)
+            continue
+
+    return downloaded
+
+def download_toi_candidates(num_targets=200, output_dir='../data/tess_toi', archive=None,
+                            retry_errors=False, mast_server=DEFAULT_SERVER, rate_limit=DEFAULT_RATE,
+                            latency_log=None, toi_catalog=None, slim=False, store=None,
+                            all_sectors=False, refresh_sectors=False):
     """
     Download TESS light curves for TOI candidates
 
@@ -19,23 +109,80 @@ def download_toi_candidates(num_targets=200, output_dir='../data/tess_toi'):
         Number of TOI targets to download
     output_dir : str
         Directory to save downloaded data
+    archive : str
+        Packed light-curve archive to append to instead of writing one
+        FITS file per target (see lightcurve_archive.py)
+    retry_errors : bool
+        Also retry targets that failed permanently in an earlier run
+        (transient failures are always retried)
+    mast_server : str
+        MAST base URL (a local stub archive for testing)
+    rate_limit : float
+        MAST requests per second (0 = unlimited)
+    latency_log : str
+        CSV file to append every MAST request's latency to
+    toi_catalog : str
+        Local TOI catalog (CSV or cache, see toi_catalog.py). If given,
+        the first num_targets catalog TOIs are resolved to TIC IDs in one
+        local query and searched by TIC ID, with no per-TOI name lookups.
+    slim : bool
+        Keep only the columns the analyzer reads, compressed (see
+        slim_fits.write_slim_fits); ~4x smaller files
+    store : str
+        Shared light-curve store directory (see lc_store.py). Stars it
+        already holds (SPOC) are linked instead of downloaded, and new
+        downloads are added to it.
+    all_sectors : bool
+        Download every sector of each TOI (TOI_45_TIC_123_s0011.fits, ...)
+        for analyze_tess_transits.py --multi-sector; needs toi_catalog
+    refresh_sectors : bool
+        With all_sectors: search TOIs an earlier run finished again and
+        download only their new sectors
     """
 
     # Create output directory
-    os.makedirs(output_dir, exist_ok=True)
+    if archive is None:
+        os.makedirs(output_dir, exist_ok=True)
+    elif store:
+        raise ValueError("A light-curve store holds FITS files; it can't be combined "
+                         "with an archive")
+    if all_sectors and not toi_catalog:
+        # The archive-wide 'TOI' search lists products, not targets
+        raise ValueError("--all-sectors needs --toi-catalog")
 
     print(f"Downloading {num_targets} TOI candidate light curves...")
-    print(f"Output directory: {output_dir}")
+    print(f"Output: {archive or output_dir}")
     print("Note: These are UNCONFIRMED candidates - your analysis helps validate them!")
 
     # Search for TOI candidates using lightkurve
     # We'll search for targets with "TOI" in their name
     print("\nSearching TESS archive for TOI candidates...")
 
+    manifest = DownloadManifest(manifest_filename(output_dir, archive),
+                                completion_marker(output_dir, archive))
+    # Failed requests are retried with backoff before a target counts as failed
+    recorder = configure(server=mast_server, rate=rate_limit, latency_log=latency_log)
+    lc_store = LightCurveStore(store) if store else None
+
     # Get TOI catalog
     try:
+        if toi_catalog:
+            catalog = open_catalog(toi_catalog)
+            toi_numbers = catalog.toi_numbers()[:num_targets]
+            # Resolve every TOI before the first light-curve request
+            tic_ids = catalog.resolve(toi_numbers)
+            catalog.close()
+            print(f"Resolved {len(tic_ids)} TOIs to TIC IDs from {toi_catalog}")
+
+            downloaded = _download_toi_numbers(toi_numbers, tic_ids, manifest, output_dir,
+                                               archive, retry_errors, slim, lc_store,
+                                               all_sectors, refresh_sectors)
+            print(f"\nSuccessfully downloaded {downloaded}/{len(toi_numbers)} TOI candidates")
+            return downloaded
+
         # Search for TESS observations with TOI designation
-        search_results = lk.search_lightcurve(
+        search_results = with_retries(
+            lk.search_lightcurve,
             'TOI',
             mission='TESS',
             author='SPOC'
@@ -48,33 +195,9 @@ def download_toi_candidates(num_targets=200, output_dir='../data/tess_toi'):
             # Fallback: Try specific TOI numbers
             # For full catalog: range(1, 7500) covers all known TOIs
             toi_numbers = list(range(1, 7500))  # TOI-1 through TOI-7499
-            downloaded = 0
-
-            for toi_num in tqdm(toi_numbers[:num_targets]):
-                try:
-                    toi_name = f'TOI-{toi_num}'
-                    search = lk.search_lightcurve(toi_name, mission='TESS', author='SPOC')
-
-                    if len(search) == 0:
-                        continue
-
-                    # Download first sector
-                    lc = search[0].download()
-
-                    if lc is None:
-                        continue
-
-                    # Save to file
-                    # Get TIC ID from light curve if available
-                    tic_id = getattr(lc, 'targetid', toi_name.replace('-', '_'))
-                    output_file = os.path.join(output_dir, f"TOI_{toi_num}_TIC_{tic_id}.fits")
-                    lc.to_fits(output_file, overwrite=True)
-
-                    print(f"  ✓ Downloaded {toi_name} (TIC {tic_id}): {len(lc)} data points, Sector {lc.sector}")
-                    downloaded += 1
-
-                except Exception as e:
-                    continue
+            downloaded = _download_toi_numbers(toi_numbers[:num_targets], {}, manifest,
+                                               output_dir, archive, retry_errors, slim,
+                                               lc_store)
 
             print(f"\nSuccessfully downloaded {downloaded}/{num_targets} TOI candidates")
             return downloaded
@@ -92,27 +215,43 @@ def download_toi_candidates(num_targets=200, output_dir='../data/tess_toi'):
         print(f"Found {len(unique_targets)} unique TOI targets")
 
         # Download up to num_targets
-        targets_to_download = list(unique_targets.items())[:num_targets]
-        downloaded = 0
+        target_names, downloaded = manifest.resume(list(unique_targets)[:num_targets],
+                                                   retry_errors)
+        targets_to_download = [(name, unique_targets[name]) for name in target_names]
 
         for target_name, result in tqdm(targets_to_download):
+            manifest.mark_searching(target_name)
+            safe_name = target_name.replace(' ', '_').replace('/', '_')
             try:
-                lc = result.download()
+                # SPOC target names are TIC IDs
+                stored = None
+                if lc_store and target_name.isdigit():
+                    stored = lc_store.find(int(target_name), author='SPOC')
+                if stored is not None:
+                    path = lc_store.link(stored, os.path.join(output_dir, f"{safe_name}.fits"))
+                    manifest.mark_downloaded(target_name, path, stored['sector'])
+                    print(f"  ✓ Linked {target_name} from the store: Sector {stored['sector']}")
+                    downloaded += 1
+                    continue
+
+                lc = with_retries(download_first, result)
 
                 if lc is None:
                     print(f"  Download failed for {target_name}")
+                    manifest.mark_no_data(target_name)
                     continue
 
                 # Save to file
-                safe_name = target_name.replace(' ', '_').replace('/', '_')
-                output_file = os.path.join(output_dir, f"{safe_name}.fits")
-                lc.to_fits(output_file, overwrite=True)
+                path = save_lightcurve(lc, output_dir, f"{safe_name}.fits", archive, slim,
+                                       lc_store)
+                manifest.mark_downloaded(target_name, path, lc.sector)
 
                 print(f"  ✓ Downloaded {target_name}: {len(lc)} data points, Sector {lc.sector}")
                 downloaded += 1
 
             except Exception as e:
                 print(f"  ✗ Error downloading {target_name}: {str(e)[:100]}")
+                manifest.mark_failed(target_name, e)
                 continue
 
         print(f"\nSuccessfully downloaded {downloaded}/{num_targets} TOI candidates")
@@ -122,6 +261,12 @@ def download_toi_candidates(num_targets=200, output_dir='../data/tess_toi'):
         print(f"Error in TOI search: {e}")
         print("This may be due to MAST archive issues. Try again later.")
         return 0
+    finally:
+        # Keep whatever finished if the job is killed
+        manifest.close()
+        if lc_store:
+            lc_store.close()
+        print_latency_summary(recorder)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Download TOI candidate light curves')
@@ -129,7 +274,45 @@ if __name__ == "__main__":
                         help='Number of TOI candidates to download (default: 200)')
     parser.add_argument('-o', '--output-dir', type=str, default='../data/tess_toi',
                         help='Output directory (default: ../data/tess_toi)')
+    parser.add_argument('-a', '--archive', type=str, default=None,
+                        help='Append to a packed light-curve archive (*.lcpack) '
+                             'instead of writing FITS files to the output directory')
+
+    parser.add_argument('--retry-errors', action='store_true',
+                        help='Also retry targets that failed permanently in an earlier '
+                             'run (transient failures are always retried)')
+
+    parser.add_argument('--mast-server', type=str, default=DEFAULT_SERVER,
+                        help=f'MAST base URL, e.g. a local stub archive for testing '
+                             f'(default: {DEFAULT_SERVER})')
+    parser.add_argument('--rate-limit', type=float, default=DEFAULT_RATE,
+                        help=f'MAST requests per second (default: {DEFAULT_RATE}, '
+                             f'0 = unlimited)')
+    parser.add_argument('--latency-log', type=str, default=None,
+                        help='CSV file to append every MAST request\'s latency to')
+
+    parser.add_argument('--toi-catalog', type=str, default=None,
+                        help='Local TOI catalog CSV or cache (see toi_catalog.py): resolve '
+                             'TOIs to TIC IDs locally instead of one MAST lookup per TOI')
+
+    parser.add_argument('--slim', action='store_true',
+                        help='Save only time, flux, flux error and quality, compressed '
+                             '(several times smaller; read transparently by the analyzer)')
+
+    parser.add_argument('--store', type=str, default=None,
+                        help='Shared light-curve store (see lc_store.py): link stars it '
+                             'already has instead of downloading them, add new downloads')
+
+    parser.add_argument('--all-sectors', action='store_true',
+                        help='Download every sector of each TOI for analyze_tess_transits.py '
+                             '--multi-sector (needs --toi-catalog)')
+    parser.add_argument('--refresh-sectors', action='store_true',
+                        help='With --all-sectors: search finished TOIs again and download '
+                             'only sectors observed since the last run')
 
     args = parser.parse_args()
 
-    download_toi_candidates(args.num_targets, args.output_dir)
+    download_toi_candidates(args.num_targets, args.output_dir, args.archive, args.retry_errors,
+                            args.mast_server, args.rate_limit, args.latency_log,
+                            args.toi_catalog, args.slim, args.store, args.all_sectors,
+                            args.refresh_sectors)
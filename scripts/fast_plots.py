@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Fast rendering of the per-star analysis plots for bulk runs
+
+analyze_tess_transits.save_plots builds two new pyplot figures per star,
+lays them out with tight_layout and encodes them through savefig. With
+--plot-backend fast the same two figures are built once per process and
+only their data and titles change from star to star:
+
+- The figures are plain matplotlib Figures on an Agg canvas (no pyplot
+  figure manager). The canvas's RGBA buffer is written as an RGB PNG at
+  a lower zlib level than savefig's (PNG_COMPRESS_LEVEL), which encodes
+  ~2x faster into files of about the same size.
+- Line plots (light curves, periodograms) are reduced to the minimum and
+  maximum of every pixel column before drawing. A 2-min sector has ~18k
+  points on a ~1,600 pixel wide axes. The reduced line spans the same
+  range in every column, though it overdraws less, so noisy light curves
+  look slightly less solid.
+- The phase-folded points are drawn as Line2D markers, which Agg stamps
+  from one rasterized marker, instead of a scatter PathCollection that
+  is drawn point by point. The pixels are the same.
+- The layout is computed once, for typical tick label widths.
+
+The panels, labels and file names are the same as save_plots'. See
+benchmark_plots.py for the per-plot timings of both backends.
+"""
+
+import os
+
+import numpy as np
+from PIL import Image
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+PLOT_DPI = 150
+ANALYSIS_FIGSIZE = (12, 10)
+FOLDED_FIGSIZE = (10, 6)
+
+# zlib level of the written PNGs (savefig uses Pillow's default, 6)
+PNG_COMPRESS_LEVEL = 3
+
+# Axis ranges with typically wide tick labels, used to fix the layout of
+# the analysis figure once
+LAYOUT_XLIM = (1325.0, 1355.0)
+LAYOUT_FLUX_YLIM = (0.9925, 1.0075)
+LAYOUT_POWER_YLIM = (0.0, 100000.0)
+
+def minmax_decimate(x, y, n_columns):
+    """
+    Reduce a line to the points that set its pixels
+
+    Splits the x range into n_columns equal columns and keeps, for each,
+    the points with the lowest and highest y (in their original order).
+    Drawn n_columns pixels wide, the reduced line spans the same range in
+    every pixel column as the full one. x must be sorted; unsorted or short input is returned
+    unchanged.
+
+    Returns:
+        (x, y) arrays
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(x) <= 4 * n_columns or not np.all(np.diff(x) >= 0):
+        return x, y
+
+    span = x[-1] - x[0]
+    if not span > 0:
+        return x, y
+    column = np.minimum(((x - x[0]) / span * n_columns).astype(np.int64), n_columns - 1)
+
+    # Within each column (runs of equal column index), the first point of
+    # the y-sorted order is the minimum and the last is the maximum
+    order = np.lexsort((y, column))
+    starts = np.flatnonzero(np.diff(column[order])) + 1
+    first = np.concatenate(([0], starts))
+    last = np.concatenate((starts - 1, [len(order) - 1]))
+    keep = np.union1d(order[first], order[last])
+    keep = np.union1d(keep, [0, len(x) - 1])
+    return x[keep], y[keep]
+
+def write_png(figure, path):
+    """
+    Draw a figure on its Agg canvas and save the pixels as an RGB PNG
+    """
+    figure.canvas.draw()
+    image = Image.fromarray(np.asarray(figure.canvas.buffer_rgba())).convert('RGB')
+    image.save(path, format='png', compress_level=PNG_COMPRESS_LEVEL,
+               dpi=(figure.dpi, figure.dpi))
+
+class PlotRenderer:
+    """
+    The analysis and phase-folded figures of save_plots, built once and
+    updated for each star
+    """
+
+    def __init__(self, dpi=PLOT_DPI):
+        self.analysis = Figure(figsize=ANALYSIS_FIGSIZE, dpi=dpi)
+        FigureCanvasAgg(self.analysis)
+        self.axes = self.analysis.subplots(3, 1)
+        raw_ax, flat_ax, power_ax = self.axes
+
+        self.raw, = raw_ax.plot([], [], color='k', linewidth=0.5, label='Raw')
+        raw_ax.set_xlabel('Time - 2457000 [BTJD days]')
+        raw_ax.set_ylabel('Normalized Flux')
+        # Where loc='best' puts it for dense light curves; on the reduced
+        # line it would wander
+        raw_ax.legend(loc='upper left')
+
+        self.flat, = flat_ax.plot([], [], color='k', linewidth=0.5, label='Flattened')
+        flat_ax.set_xlabel('Time - 2457000 [BTJD days]')
+        flat_ax.set_ylabel('Normalized Flux')
+        flat_ax.set_title('Flattened Light Curve')
+        flat_ax.legend(loc='upper left')
+
+        self.coarse, = power_ax.plot([], [], color='0.6', linewidth=0.5,
+                                     label='Coarse (binned)')
+        self.refined, = power_ax.plot([], [], 'k.', markersize=1, label='Refined')
+        self.periodogram, = power_ax.plot([], [], color='k', linewidth=0.5)
+        self.best = power_ax.axvline(0, color='r', linestyle='--')
+        power_ax.set_xlabel('Period [d]')
+        power_ax.set_ylabel('BLS Power')
+        power_ax.set_title('BLS Periodogram')
+        self._coarse_legend = None
+
+        raw_ax.set_title('TIC_0 - Raw Light Curve')
+        for ax in (raw_ax, flat_ax):
+            ax.set_xlim(*LAYOUT_XLIM)
+            ax.set_ylim(*LAYOUT_FLUX_YLIM)
+        power_ax.set_ylim(*LAYOUT_POWER_YLIM)
+        self.analysis.tight_layout()
+        for ax in self.axes:
+            ax.set_autoscale_on(True)
+
+        # Pixel columns of the (equally wide) analysis axes
+        self.columns = int(np.ceil(raw_ax.get_window_extent().width))
+
+        self.folded = Figure(figsize=FOLDED_FIGSIZE, dpi=dpi)
+        FigureCanvasAgg(self.folded)
+        self.folded_ax = self.folded.subplots(1, 1)
+        # Draws the same pixels as scatter(s=1, alpha=0.5)
+        self.folded_points, = self.folded_ax.plot(
+            [], [], linestyle='none', marker='o', markersize=1, markeredgewidth=1,
+            color='k', alpha=0.5)
+        self.folded_ax.set_xlabel('Phase [JD]')
+        self.folded_ax.set_ylabel('Normalized Flux')
+
+    def _update_periodogram(self, search, best_period):
+        power_ax = self.axes[2]
+        coarse = 'coarse_period' in search
+        if coarse:
+            self.coarse.set_data(*minmax_decimate(search['coarse_period'],
+                                                  search['coarse_power'], self.columns))
+            self.refined.set_data(search['period'], search['power'])
+            self.periodogram.set_data([], [])
+        else:
+            self.periodogram.set_data(*minmax_decimate(search['period'], search['power'],
+                                                       self.columns))
+            self.coarse.set_data([], [])
+            self.refined.set_data([], [])
+        self.best.set_xdata([best_period, best_period])
+        self.best.set_label(f'Best Period: {best_period:.4f} days')
+
+        # The legend only changes with the search mode; otherwise just
+        # its best-period entry is updated
+        if coarse != self._coarse_legend:
+            handles = [self.coarse, self.refined, self.best] if coarse else [self.best]
+            power_ax.legend(handles=handles)
+            self._coarse_legend = coarse
+        power_ax.get_legend().get_texts()[-1].set_text(self.best.get_label())
+
+    def render(self, target_name, time, flux, flat_flux, search, output_dir):
+        """
+        Save both plots of one star (same arguments and files as save_plots)
+        """
+        best_period = search['period_at_max_power']
+        raw_ax, flat_ax, power_ax = self.axes
+
+        self.raw.set_data(*minmax_decimate(time, flux, self.columns))
+        raw_ax.set_title(f'{target_name} - Raw Light Curve')
+        self.flat.set_data(*minmax_decimate(time, flat_flux, self.columns))
+        self._update_periodogram(search, best_period)
+        for ax in self.axes:
+            ax.relim()
+            ax.autoscale_view()
+
+        plot_file = os.path.join(output_dir, f'{target_name}_analysis.png')
+        write_png(self.analysis, plot_file)
+        print(f"  Saved plot to {plot_file}")
+
+        # (phase relative to the first cadence, wrapped to +-P/2, as save_plots)
+        phase = np.mod(time - time[0] + 0.5 * best_period, best_period) - 0.5 * best_period
+        self.folded_points.set_data(phase, flat_flux)
+        self.folded_ax.set_title(f'{target_name} - Phase-Folded at {best_period:.4f} days')
+        self.folded_ax.relim()
+        self.folded_ax.autoscale_view()
+
+        folded_file = os.path.join(output_dir, f'{target_name}_folded.png')
+        write_png(self.folded, folded_file)
+        print(f"  Saved phase-folded plot to {folded_file}")
+
+# One renderer per process, built on first use
+_renderer = None
+
+def render_plots(target_name, time, flux, flat_flux, search, output_dir):
+    """
+    save_plots with the figures of this process's PlotRenderer
+    """
+    global _renderer
+    if _renderer is None:
+        _renderer = PlotRenderer()
+    _renderer.render(target_name, time, flux, flat_flux, search, output_dir)
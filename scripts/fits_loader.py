@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Column-selective reader for TESS SPOC light-curve FITS files
+
+lk.read() builds a full LightCurve (astropy Table, Time and Quantity
+columns for every SPOC column) that the analyzer immediately strips back
+to plain arrays. This reader opens the file with astropy.io.fits
+(memory-mapped), and copies out only TIME, the flux and its error, and
+QUALITY of the LIGHTCURVE binary table as native-endian arrays, applying
+the same column and row selection as lightkurve's TESS reader: FLUX/FLUX_ERR
+if the file has them (files written by LightCurve.to_fits(), i.e.
+everything the downloaders save), otherwise PDCSAP_FLUX/PDCSAP_FLUX_ERR
+(SPOC products); then drop NaN times and cadences whose QUALITY matches
+the default bitmask. Scaled columns (TSCAL/TZERO) are scaled by astropy,
+and TNULL cadences read as NaN (no flags for QUALITY).
+
+Files laid out differently (no binary table, vector or string columns)
+raise ValueError; the analyzer then reads them with lk.read() instead.
+"""
+
+import numpy as np
+from astropy.io import fits
+
+# lightkurve's TessQualityFlags.DEFAULT_BITMASK: AttitudeTweak, SafeMode,
+# CoarsePoint, EarthPoint, Desat, ManualExclude, DetectorAnomaly, NoData,
+# ThrusterFiring
+DEFAULT_QUALITY_BITMASK = 1 | 2 | 4 | 8 | 32 | 128 | 16384 | 65536 | 1048576
+
+def _column(hdu, name, dtype):
+    """
+    One column as a contiguous native-endian array, with TNULL cadences
+    set to NaN (0 for an integer dtype)
+    """
+    column = hdu.columns[name]
+    stored = hdu.data[name]
+    if stored.ndim != 1 or stored.dtype.kind not in 'iuf':
+        raise ValueError(f"Unsupported {name} column (format {column.format})")
+    values = np.array(stored, dtype=dtype)
+    if column.null is not None:
+        # astropy has already applied TSCAL/TZERO, so compare the scaled null
+        null = column.null * (column.bscale or 1) + (column.bzero or 0)
+        values[stored == null] = np.nan if values.dtype.kind == 'f' else 0
+    return values
+
+def read_lightcurve(path, flux_column='PDCSAP_FLUX', quality_bitmask=DEFAULT_QUALITY_BITMASK):
+    """
+    Read the columns the transit search needs from a SPOC light-curve file
+
+    Parameters:
+    -----------
+    path : str
+        FITS file (optionally gzipped)
+    flux_column : str
+        Flux column to read if the file has no FLUX column; its
+        uncertainty is <flux_column>_ERR
+    quality_bitmask : int
+        Cadences whose QUALITY shares a bit with this mask are dropped
+        (0 keeps everything)
+
+    Returns:
+        dict with 'time' (float64, BTJD days), 'flux' and 'flux_err' (as
+        stored, float32 for SPOC files; flux_err is None if the file has
+        none), 'quality' (int32), 'tic_id' and 'sector' (None if absent)
+    """
+    with fits.open(path, memmap=True) as hdul:
+        primary = hdul[0].header
+        # The light curve is the first binary table (EXTNAME LIGHTCURVE in SPOC files)
+        hdu = next((h for h in hdul[1:] if isinstance(h, fits.BinTableHDU)), None)
+        if hdu is None:
+            raise ValueError(f"{path} has no binary table")
+        names = [name.upper() for name in hdu.columns.names]
+
+        # lk.read() uses an existing FLUX column and only falls back to
+        # flux_column (and FLUX_ERR to <flux_column>_ERR) when there is none
+        flux_column = flux_column.upper()
+        flux_name = 'FLUX' if 'FLUX' in names else flux_column
+        err_name = 'FLUX_ERR' if 'FLUX_ERR' in names else flux_column + '_ERR'
+        for name in ('TIME', flux_name):
+            if name not in names:
+                raise ValueError(f"{path} has no {name} column")
+
+        def float_dtype(name):
+            # As stored (float32 for SPOC files), float64 for integer columns
+            return np.result_type(hdu.data[name].dtype.newbyteorder('='), np.float32)
+
+        time = _column(hdu, 'TIME', np.float64)
+        flux = _column(hdu, flux_name, float_dtype(flux_name))
+        flux_err = None
+        if err_name in names:
+            flux_err = _column(hdu, err_name, float_dtype(err_name))
+        if 'QUALITY' in names:
+            quality = _column(hdu, 'QUALITY', np.int32)
+        else:
+            quality = np.zeros(len(time), dtype=np.int32)
+        tic_id = primary.get('TICID')
+        sector = primary.get('SECTOR')
+
+    keep = ~np.isnan(time)
+    keep &= (quality & quality_bitmask) == 0
+
+    return {
+        'time': time[keep],
+        'flux': flux[keep],
+        'flux_err': flux_err[keep] if flux_err is not None else None,
+        'quality': quality[keep],
+        'tic_id': int(tic_id) if tic_id is not None else None,
+        'sector': int(sector) if sector is not None else None,
+    }
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Shared light-curve store: one copy of each (TIC, sector, author, cadence)
+
+Phase 1 (data/tess), Phase 2 (data/tess_toi) and the Phase 3 random
+directories are downloaded independently. A star that is both a TOI and
+a random pick used to be fetched and stored twice, as TOI_45_TIC_123.fits
+and TIC_123.fits. The store keeps every light curve once, addressed by
+what it is:
+
+    ../data/lc_store/
+        store.sqlite                      objects and views index
+        objects/123/TIC_123_s0011_SPOC_120s.fits
+
+and phase directories become views: their files are hard links to store
+objects (copies where the file system has no hard links), so nothing
+reading a phase directory changes. Each view directory holds a .lc_store
+file pointing at its store. With --store, the downloaders link a star the
+store already has instead of downloading it, and add what they download.
+The analyzer recognizes view files that are the same object, analyzes
+them once, and can reuse results from other phases (--reuse-results).
+
+Register existing downloads, and inspect the store:
+
+    python lc_store.py import -s ../data/lc_store --author SPOC ../data/tess ../data/tess_toi
+    python lc_store.py import -s ../data/lc_store ../data/tess_random
+    python lc_store.py stats -s ../data/lc_store
+"""
+
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+from glob import glob
+
+import numpy as np
+
+from fits_loader import read_lightcurve
+from results_store import tic_from_name
+
+STORE_INDEX = 'store.sqlite'
+OBJECTS_DIR = 'objects'
+
+# Written into every view directory: absolute path of its store
+VIEW_MARKER = '.lc_store'
+
+# Seconds to wait for another process's write lock
+LOCK_TIMEOUT = 120
+
+OBJECT_COLUMNS = ['key', 'tic_id', 'sector', 'author', 'cadence', 'path', 'size', 'sha256',
+                  'added']
+
+def object_key(tic_id, sector, author, cadence):
+    """
+    Store key (and object file name, without .fits) of one light curve
+    """
+    return f'TIC_{int(tic_id)}_s{int(sector or 0):04d}_{author}_{int(cadence)}s'
+
+def cadence_seconds(time_values):
+    """
+    Cadence of a light curve in whole seconds (median time step)
+    """
+    steps = np.diff(np.asarray(time_values, dtype=np.float64))
+    steps = steps[np.isfinite(steps) & (steps > 0)]
+    return int(round(np.median(steps) * 86400)) if len(steps) else 0
+
+def file_digest(path):
+    """
+    SHA-256 of a file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _link(source, dest):
+    """
+    Hard-link source at dest (replacing dest), or copy it where the file
+    system does not allow the link
+
+    Returns:
+        True if dest is a hard link
+    """
+    partial = os.path.join(os.path.dirname(dest), f'.{os.path.basename(dest)}.part')
+    if os.path.exists(partial):
+        os.remove(partial)
+    try:
+        os.link(source, partial)
+        linked = True
+    except OSError:
+        shutil.copy2(source, partial)
+        linked = False
+    os.replace(partial, dest)
+    return linked
+
+class LightCurveStore:
+    """
+    Objects and views of a store directory
+
+    Lookups (find) use a snapshot of the objects index taken when the
+    store is opened plus this process's own additions, so threads can call
+    them freely; writes go through one locked SQLite connection.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(os.path.join(self.root, OBJECTS_DIR), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(self.root, STORE_INDEX), timeout=LOCK_TIMEOUT,
+                                    check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS objects (key TEXT PRIMARY KEY, '
+                          'tic_id INTEGER, sector INTEGER, author TEXT, cadence INTEGER, '
+                          'path TEXT, size INTEGER, sha256 TEXT, added REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS objects_tic ON objects (tic_id)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS views (path TEXT PRIMARY KEY, key TEXT)')
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self._by_tic = {}
+        rows = self.conn.execute(f'SELECT {", ".join(OBJECT_COLUMNS)} FROM objects '
+                                 f'ORDER BY sector, author, cadence')
+        for row in rows:
+            self._remember(dict(zip(OBJECT_COLUMNS, row)))
+
+    def _remember(self, row):
+        self._by_tic.setdefault(row['tic_id'], []).append(row)
+
+    def object_path(self, row):
+        return os.path.join(self.root, row['path'])
+
+    def find(self, tic_id, author=None, sector=None):
+        """
+        An object of tic_id (lowest sector first), optionally only from
+        one author (SPOC, TESS-SPOC, QLP, ...) or one sector, or None
+        """
+        for row in self._by_tic.get(int(tic_id), []):
+            if (author is None or row['author'] == author) and \
+                    (sector is None or row['sector'] == int(sector)) and \
+                    os.path.exists(self.object_path(row)):
+                return row
+        return None
+
+    def get(self, key):
+        row = self.conn.execute(f'SELECT {", ".join(OBJECT_COLUMNS)} FROM objects '
+                                f'WHERE key = ?', (key,)).fetchone()
+        return dict(zip(OBJECT_COLUMNS, row)) if row else None
+
+    def add_file(self, path, tic_id, sector, author, cadence):
+        """
+        Move a light-curve file into the store (hard link, or copy), unless
+        an object with the same key exists
+
+        Returns:
+            Object row (the existing one if the key was already stored)
+        """
+        key = object_key(tic_id, sector, author, cadence)
+        relative = os.path.join(OBJECTS_DIR, str(int(tic_id)), key + '.fits')
+        with self._lock:
+            existing = self.get(key)
+            if existing and os.path.exists(self.object_path(existing)):
+                return existing
+            destination = os.path.join(self.root, relative)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            _link(path, destination)
+            row = {'key': key, 'tic_id': int(tic_id), 'sector': int(sector or 0),
+                   'author': author, 'cadence': int(cadence), 'path': relative,
+                   'size': os.path.getsize(destination), 'sha256': file_digest(destination),
+                   'added': time.time()}
+            self.conn.execute(f'INSERT OR REPLACE INTO objects VALUES '
+                              f'({", ".join("?" * len(OBJECT_COLUMNS))})',
+                              [row[c] for c in OBJECT_COLUMNS])
+            self.conn.commit()
+            self._remember(row)
+        return row
+
+    def add_lightcurve(self, lc, path, tic_id=None):
+        """
+        Add a downloaded LightCurve that was just saved at path
+
+        Returns:
+            Object row
+        """
+        tic_id = tic_id or lc.meta.get('TARGETID') or lc.meta.get('TICID')
+        time_values = np.asarray(getattr(lc.time.value, 'unmasked', lc.time.value))
+        return self.add_file(path, tic_id, lc.meta.get('SECTOR'),
+                             lc.meta.get('AUTHOR') or 'unknown', cadence_seconds(time_values))
+
+    def link(self, row, dest):
+        """
+        Make dest (a file in a phase directory) a view of an object
+
+        Returns:
+            dest
+        """
+        directory = os.path.dirname(os.path.abspath(dest))
+        source = self.object_path(row)
+        if not (os.path.exists(dest) and os.path.samefile(source, dest)):
+            _link(source, dest)
+        marker = os.path.join(directory, VIEW_MARKER)
+        if not os.path.exists(marker):
+            with open(marker, 'w') as f:
+                f.write(self.root + '\n')
+        with self._lock:
+            self.conn.execute('INSERT OR REPLACE INTO views VALUES (?, ?)',
+                              (os.path.abspath(dest), row['key']))
+            self.conn.commit()
+        return dest
+
+    def key_of(self, path):
+        """
+        Object key of a view file, or None if it is not a current view
+        """
+        row = self.conn.execute('SELECT key FROM views WHERE path = ?',
+                                (os.path.abspath(path),)).fetchone()
+        if row is None:
+            return None
+        stored = self.get(row[0])
+        # A file replaced since it was linked is no longer the object
+        if stored is None or not os.path.exists(path) or \
+                os.path.getsize(path) != stored['size']:
+            return None
+        return row[0]
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects').fetchone()
+
+    def close(self):
+        self.conn.close()
+
+def open_view_store(data_dir):
+    """
+    The store a phase directory is a view of, or None
+    """
+    marker = os.path.join(data_dir, VIEW_MARKER)
+    if not os.path.isfile(marker):
+        return None
+    with open(marker) as f:
+        root = f.read().strip()
+    return LightCurveStore(root) if os.path.isdir(root) else None
+
+def import_directory(store, data_dir, author='unknown'):
+    """
+    Add every FITS file of a download directory to the store and turn the
+    directory into a view (files already stored under the same key are
+    replaced by links to the stored copy)
+
+    Returns:
+        (files imported, of which duplicates of an existing object)
+    """
+    imported = duplicates = 0
+    for fits_file in sorted(glob(os.path.join(data_dir, '*.fits'))):
+        if store.key_of(fits_file):
+            continue
+        try:
+            raw = read_lightcurve(fits_file, quality_bitmask=0)
+        except (ValueError, KeyError, OSError) as e:
+            print(f"  ✗ {os.path.basename(fits_file)}: {e}")
+            continue
+        tic_id = raw['tic_id'] or tic_from_name(os.path.basename(fits_file))
+        if tic_id is None:
+            print(f"  ✗ {os.path.basename(fits_file)}: no TIC ID")
+            continue
+        key = object_key(tic_id, raw['sector'], author, cadence_seconds(raw['time']))
+        duplicates += store.get(key) is not None
+        row = store.add_file(fits_file, tic_id, raw['sector'], author,
+                             cadence_seconds(raw['time']))
+        store.link(row, fits_file)
+        imported += 1
+    return imported, duplicates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Shared store of downloaded light curves')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help='Add download directories to the store '
+                                                       'and turn them into views')
+    import_parser.add_argument('-s', '--store', type=str, required=True)
+    import_parser.add_argument('--author', type=str, default='unknown',
+                               help='Pipeline the files came from, e.g. SPOC for Phase 1/2 '
+                                    'downloads (default: unknown, never matched by the '
+                                    'SPOC-only downloaders)')
+    import_parser.add_argument('paths', nargs='+', help='Download directories')
+
+    stats_parser = commands.add_parser('stats', help='Count stored objects')
+    stats_parser.add_argument('-s', '--store', type=str, required=True)
+
+    args = parser.parse_args()
+
+    store = LightCurveStore(args.store)
+    if args.command == 'import':
+        for path in args.paths:
+            imported, duplicates = import_directory(store, path, args.author)
+            print(f"✓ {path}: {imported} files imported, {duplicates} were duplicates")
+    else:
+        count, size = store.count()
+        print(f"{count} light curves, {size / 1024 ** 3:.2f} GB")
+        for (views,) in store.conn.execute('SELECT COUNT(*) FROM views'):
+            print(f"{views} view files")
+    store.close()
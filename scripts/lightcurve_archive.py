@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+"""
+Packed light-curve archive: many light curves in one file plus an index
+
+A directory of 70k loose FITS files costs one directory entry, one stat
+and one open per star on every scan, which is what hurts on the NFS home
+mounts. An archive keeps the columns the analyzer needs in one data file
+(e.g. ../data/phase3_ultra.lcpack) and an SQLite index next to it
+(phase3_ultra.lcpack.index) mapping each entry to its TIC ID, sector and
+byte offset. The data file is memory-mapped, so reading one star touches
+only its own pages.
+
+Each entry is stored exactly as fits_loader.read_lightcurve returns it
+with quality_bitmask=0 (NaN times already dropped), as little-endian
+arrays, each padded to 8 bytes:
+
+    time      float64[n]
+    flux      float32[n] (float64 if the source file stored float64)
+    flux_err  same dtype as flux, absent if the source had none
+    quality   int32[n]
+
+so the analyzer applies its quality mask and cleaning exactly as it does
+for the FITS file. Entries are named after the file they replace
+(TIC_123.fits), and a path like ../data/phase3_ultra.lcpack/TIC_123.fits
+refers to one entry wherever the analyzer accepts a FITS path.
+
+Appends are serialized through the index (SQLite write lock), so several
+processes can add to one archive. Usage:
+
+    python lightcurve_archive.py pack -d ../data/tess_phase3_ultra -a ../data/phase3_ultra.lcpack
+    python lightcurve_archive.py unpack -a ../data/phase3_ultra.lcpack -o ../data/unpacked
+    python lightcurve_archive.py list -a ../data/phase3_ultra.lcpack --tic 307210830
+"""
+
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+from glob import glob
+
+import numpy as np
+
+from fits_loader import read_lightcurve
+from slim_fits import write_fits, write_slim_fits
+from results_store import tic_from_name
+
+ARCHIVE_SUFFIX = '.lcpack'
+INDEX_SUFFIX = '.index'
+
+# Data file header: magic + format version, padded to the entry alignment
+MAGIC = b'LCPACK\x00\x01'
+ALIGNMENT = 8
+
+# Seconds to wait for another process's write lock
+LOCK_TIMEOUT = 120
+
+# Per-sector files of multi-sector downloads: <stem>_s0011.fits
+SECTOR_SUFFIX = re.compile(r'_s(\d{4})$')
+
+ENTRY_COLUMNS = ['name', 'tic_id', 'sector', 'offset', 'n_points', 'flux_dtype',
+                 'has_err', 'nbytes', 'digest', 'added']
+
+# Per-process state: open memory maps and index connections, one per
+# archive data file (the analyzer looks up every entry it reads)
+_maps = {}
+_index_conns = {}
+_index_lock = threading.Lock()
+
+def index_filename(archive):
+    """
+    SQLite index that goes with an archive data file
+    """
+    return archive + INDEX_SUFFIX
+
+def is_archive(path):
+    """
+    True if path is an archive data file
+    """
+    return path.endswith(ARCHIVE_SUFFIX) and os.path.isfile(path)
+
+def split_member(path):
+    """
+    (archive, entry name) for a path inside an archive, or None for any other path
+    """
+    archive, name = os.path.split(path)
+    if not is_archive(archive):
+        return None
+    return archive, name
+
+def member_path(archive, name):
+    """
+    Path that refers to one archive entry
+    """
+    return os.path.join(archive, name)
+
+def sector_filename(stem, sector):
+    """
+    File (or entry) name of one sector of a multi-sector download
+    """
+    return f'{stem}_s{int(sector):04d}.fits'
+
+def sector_stem(path):
+    """
+    (target stem, sector) of a file name from sector_filename, or
+    (name without .fits, None) for a single-sector file
+    """
+    name = os.path.basename(path).replace('.fits', '')
+    match = SECTOR_SUFFIX.search(name)
+    if match is None:
+        return name, None
+    return name[:match.start()], int(match.group(1))
+
+def open_index(archive, check_same_thread=True):
+    """
+    Open (creating if needed) the index of an archive
+    """
+    os.makedirs(os.path.dirname(archive) or '.', exist_ok=True)
+    conn = sqlite3.connect(index_filename(archive), timeout=LOCK_TIMEOUT,
+                           check_same_thread=check_same_thread)
+    conn.execute('CREATE TABLE IF NOT EXISTS entries (name TEXT PRIMARY KEY, '
+                 'tic_id INTEGER, sector INTEGER, offset INTEGER, n_points INTEGER, '
+                 'flux_dtype TEXT, has_err INTEGER, nbytes INTEGER, digest TEXT, added REAL)')
+    conn.execute('CREATE INDEX IF NOT EXISTS entries_tic ON entries (tic_id)')
+    return conn
+
+def _padded(array):
+    """
+    Bytes of an array, zero-padded to the entry alignment
+    """
+    data = array.tobytes()
+    return data + b'\0' * (-len(data) % ALIGNMENT)
+
+def _entry_bytes(time_values, flux, flux_err, quality):
+    """
+    Packed layout of one light curve, and the flux dtype it was stored with
+    """
+    flux_dtype = '<f8' if np.asarray(flux).dtype == np.float64 else '<f4'
+    arrays = [np.asarray(time_values, dtype='<f8'), np.asarray(flux, dtype=flux_dtype)]
+    if flux_err is not None:
+        arrays.append(np.asarray(flux_err, dtype=flux_dtype))
+    arrays.append(np.asarray(quality, dtype='<i4'))
+    return b''.join(_padded(a) for a in arrays), flux_dtype
+
+def append_arrays(archive, name, time_values, flux, flux_err, quality, tic_id=None,
+                  sector=None, replace=False):
+    """
+    Add one light curve to an archive
+
+    Parameters:
+    -----------
+    archive : str
+        Archive data file (created if missing)
+    name : str
+        Entry name, normally the FITS filename it replaces (TIC_123.fits)
+    time_values, flux, flux_err, quality : array
+        Light curve as returned by fits_loader.read_lightcurve with
+        quality_bitmask=0 (flux_err may be None)
+    tic_id, sector : int
+        Target and sector; tic_id defaults to the one in the name
+    replace : bool
+        Overwrite an existing entry of the same name (its old bytes stay
+        in the data file unused); otherwise the existing entry is kept
+
+    Returns:
+        True if the entry was written
+    """
+    if tic_id is None:
+        tic_id = tic_from_name(name)
+    data, flux_dtype = _entry_bytes(time_values, flux, flux_err, quality)
+
+    conn = open_index(archive)
+    try:
+        # The write lock makes the end-of-data offset ours until commit
+        conn.execute('BEGIN IMMEDIATE')
+        if not replace and conn.execute('SELECT 1 FROM entries WHERE name = ?',
+                                        (name,)).fetchone():
+            conn.rollback()
+            return False
+
+        # Start after the last indexed entry: bytes from an append that
+        # died before its commit are overwritten
+        end = conn.execute('SELECT MAX(offset + nbytes) FROM entries').fetchone()[0]
+        offset = end if end is not None else len(MAGIC)
+
+        with open(archive, 'r+b' if os.path.exists(archive) else 'w+b') as f:
+            f.seek(0)
+            f.write(MAGIC)
+            f.seek(offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        conn.execute(f'INSERT OR REPLACE INTO entries VALUES ({", ".join("?" * len(ENTRY_COLUMNS))})',
+                     (name, tic_id, sector, offset, len(time_values), flux_dtype,
+                      int(flux_err is not None), len(data),
+                      hashlib.sha256(data).hexdigest(), time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+    return True
+
+def append_fits(archive, fits_file, name=None, replace=False):
+    """
+    Add a light-curve FITS file to an archive (entry named after the file)
+    """
+    raw = read_lightcurve(fits_file, quality_bitmask=0)
+    name = name or os.path.basename(fits_file)
+    return append_arrays(archive, name, raw['time'], raw['flux'], raw['flux_err'],
+                         raw['quality'], raw['tic_id'] or tic_from_name(name), raw['sector'],
+                         replace)
+
+def lightcurve_arrays(lc, name=None):
+    """
+    The arrays of a downloaded lightkurve LightCurve, in the form
+    fits_loader.read_lightcurve returns with quality_bitmask=0 (NaN times
+    dropped; flux and flux_err as lightkurve holds them, usually float64)
+    """
+    def values(column):
+        return np.asarray(getattr(column.value, 'unmasked', column.value))
+
+    time_values = values(lc.time)
+    keep = ~np.isnan(time_values)
+    flux_err = None
+    if lc.flux_err is not None:
+        flux_err = values(lc.flux_err)[keep]
+    quality = np.zeros(keep.sum(), dtype=np.int32)
+    if 'quality' in lc.columns:
+        quality = np.asarray(lc.quality, dtype=np.int32)[keep]
+    tic_id = (tic_from_name(name) if name else None) or lc.meta.get('TARGETID')
+    sector = lc.meta.get('SECTOR')
+
+    return {
+        'time': time_values[keep].astype(np.float64),
+        'flux': values(lc.flux)[keep],
+        'flux_err': flux_err,
+        'quality': quality,
+        'tic_id': int(tic_id) if tic_id is not None else None,
+        'sector': int(sector) if sector is not None else None,
+    }
+
+def append_lightcurve(archive, name, lc, replace=False):
+    """
+    Add a downloaded lightkurve LightCurve to an archive
+
+    Stores what lc.to_fits() would have written to the FITS file of the
+    same name (TIME as float64, FLUX and FLUX_ERR as float32, QUALITY).
+    """
+    raw = lightcurve_arrays(lc, name)
+    flux_err = raw['flux_err'].astype(np.float32) if raw['flux_err'] is not None else None
+    return append_arrays(archive, name, raw['time'], raw['flux'].astype(np.float32), flux_err,
+                         raw['quality'], raw['tic_id'], raw['sector'], replace)
+
+def save_lightcurve(lc, output_dir, filename, archive=None, slim=False, store=None):
+    """
+    Write a downloaded light curve as output_dir/filename, or as the
+    archive entry of that name
+
+    The FITS file is written under a temporary name and renamed into
+    place, so anything scanning output_dir for *.fits (e.g. an analyzer
+    following a running download) never sees a partial file.
+
+    With slim=True only the columns the analyzer reads are kept, compressed
+    (see slim_fits.py). Archive entries are always stored that way.
+
+    With a store (lc_store.LightCurveStore), the file is added to the store
+    and output_dir/filename becomes a link to the stored copy (an existing
+    copy of the same TIC, sector, author and cadence wins).
+
+    Returns:
+        Path of the saved file or archive entry
+    """
+    if archive:
+        append_lightcurve(archive, filename, lc, replace=True)
+        return member_path(archive, filename)
+    path = os.path.join(output_dir, filename)
+    staged = path if store is None else os.path.join(output_dir, f'.{filename}.new')
+    if slim:
+        write_slim_fits(staged, lightcurve_arrays(lc, filename))
+    else:
+        partial = os.path.join(output_dir, f'.{filename}.part')
+        lc.to_fits(partial, overwrite=True)
+        os.replace(partial, staged)
+    if store is not None:
+        row = store.add_lightcurve(lc, staged, tic_from_name(filename))
+        store.link(row, path)
+        os.remove(staged)
+    return path
+
+def list_entries(archive, tic_id=None):
+    """
+    Index rows of an archive (dicts, sorted by name), optionally for one TIC
+    """
+    conn = open_index(archive)
+    try:
+        query = f'SELECT {", ".join(ENTRY_COLUMNS)} FROM entries'
+        if tic_id is not None:
+            rows = conn.execute(query + ' WHERE tic_id = ? ORDER BY name', (tic_id,)).fetchall()
+        else:
+            rows = conn.execute(query + ' ORDER BY name').fetchall()
+    finally:
+        conn.close()
+    return [dict(zip(ENTRY_COLUMNS, row)) for row in rows]
+
+def get_entry(archive, name):
+    """
+    Index row of one entry
+
+    Raises:
+        KeyError if the archive has no entry of that name
+    """
+    with _index_lock:
+        pid, conn = _index_conns.get(archive, (None, None))
+        if pid != os.getpid():
+            # One connection per process (a forked worker can't share its
+            # parent's); the row is queried every time, so an entry
+            # rewritten with replace=True is never read at its old offset
+            conn = open_index(archive, check_same_thread=False)
+            _index_conns[archive] = (os.getpid(), conn)
+        row = conn.execute(f'SELECT {", ".join(ENTRY_COLUMNS)} FROM entries WHERE name = ?',
+                           (name,)).fetchone()
+    if row is None:
+        raise KeyError(f"{archive} has no entry {name}")
+    return dict(zip(ENTRY_COLUMNS, row))
+
+def _data_map(archive, end):
+    """
+    Memory map of an archive's data file covering at least end bytes
+    """
+    mapped = _maps.get(archive)
+    if mapped is None or len(mapped) < end:
+        # Entries appended since the file was mapped need a fresh map
+        mapped = np.memmap(archive, dtype=np.uint8, mode='r')
+        if bytes(mapped[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{archive} is not a light-curve archive")
+        _maps[archive] = mapped
+    return mapped
+
+def read_entry(archive, entry, quality_bitmask=0):
+    """
+    Arrays of one archive entry, in fits_loader.read_lightcurve's format
+
+    Parameters:
+    -----------
+    archive : str
+        Archive data file
+    entry : dict or str
+        Index row (from list_entries/get_entry) or entry name
+    quality_bitmask : int
+        Cadences whose QUALITY shares a bit with this mask are dropped
+
+    Returns:
+        dict with 'time', 'flux', 'flux_err', 'quality', 'tic_id', 'sector'
+    """
+    if isinstance(entry, str):
+        entry = get_entry(archive, entry)
+
+    n = entry['n_points']
+    data = _data_map(archive, entry['offset'] + entry['nbytes'])
+    offset = entry['offset']
+
+    def take(dtype):
+        nonlocal offset
+        values = np.frombuffer(data, dtype=dtype, count=n, offset=offset)
+        offset += values.nbytes + (-values.nbytes % ALIGNMENT)
+        return values
+
+    time_values = take('<f8')
+    flux = take(entry['flux_dtype'])
+    flux_err = take(entry['flux_dtype']) if entry['has_err'] else None
+    quality = take('<i4')
+
+    keep = (quality & quality_bitmask) == 0
+    return {
+        'time': time_values[keep].astype(np.float64),
+        'flux': flux[keep].astype(flux.dtype.newbyteorder('=')),
+        'flux_err': flux_err[keep].astype(flux_err.dtype.newbyteorder('='))
+                    if flux_err is not None else None,
+        'quality': quality[keep].astype(np.int32),
+        'tic_id': entry['tic_id'],
+        'sector': entry['sector'],
+    }
+
+def read_member(path, quality_bitmask=0):
+    """
+    read_entry() for a member path (archive/entry name)
+    """
+    archive, name = split_member(path)
+    return read_entry(archive, name, quality_bitmask)
+
+def member_key(path):
+    """
+    (name, size, whole-second time added) of a member path, the archive
+    counterpart of a file's (basename, size, mtime)
+    """
+    archive, name = split_member(path)
+    entry = get_entry(archive, name)
+    return name, entry['nbytes'], int(entry['added'])
+
+def member_digest(path):
+    """
+    SHA-256 of a member's packed bytes
+    """
+    archive, name = split_member(path)
+    return get_entry(archive, name)['digest']
+
+def pack(data_dir, archive, remove=False):
+    """
+    Pack every FITS file in data_dir into an archive
+
+    Files already in the archive (by name) are skipped, so an interrupted
+    pack can be rerun. With remove=True each file is deleted once its
+    entry is committed.
+    """
+    fits_files = sorted(glob(os.path.join(data_dir, '*.fits')))
+    print(f"Packing {len(fits_files)} FITS files from {data_dir} into {archive}")
+
+    added = skipped = failed = 0
+    for fits_file in fits_files:
+        try:
+            if append_fits(archive, fits_file):
+                added += 1
+            else:
+                skipped += 1
+        except (ValueError, KeyError, OSError) as e:
+            print(f"  ✗ {os.path.basename(fits_file)}: {e}")
+            failed += 1
+            continue
+        if remove:
+            os.remove(fits_file)
+
+    print(f"Added {added}, already packed {skipped}, failed {failed}")
+    print(f"Archive: {os.path.getsize(archive) / 1024 ** 2:.1f} MB, "
+          f"index: {index_filename(archive)}")
+
+def unpack(archive, output_dir, tic_id=None):
+    """
+    Write archive entries back out as FITS files (all, or one TIC's)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    entries = list_entries(archive, tic_id)
+    for entry in entries:
+        write_fits(os.path.join(output_dir, entry['name']), read_entry(archive, entry))
+    print(f"Unpacked {len(entries)} light curves to {output_dir}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pack light-curve FITS files into an archive, '
+                                                 'or unpack/list one')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pack_parser = commands.add_parser('pack', help='Add a directory of FITS files to an archive')
+    pack_parser.add_argument('-d', '--data-dir', type=str, required=True,
+                             help='Directory containing FITS files')
+    pack_parser.add_argument('-a', '--archive', type=str, required=True,
+                             help=f'Archive data file (*{ARCHIVE_SUFFIX}), created if missing')
+    pack_parser.add_argument('--remove', action='store_true',
+                             help='Delete each FITS file once it is packed')
+
+    unpack_parser = commands.add_parser('unpack', help='Write archive entries as FITS files')
+    unpack_parser.add_argument('-a', '--archive', type=str, required=True)
+    unpack_parser.add_argument('-o', '--output-dir', type=str, required=True)
+    unpack_parser.add_argument('--tic', type=int, default=None,
+                               help='Only this TIC ID (default: every entry)')
+
+    list_parser = commands.add_parser('list', help='Print the archive index')
+    list_parser.add_argument('-a', '--archive', type=str, required=True)
+    list_parser.add_argument('--tic', type=int, default=None,
+                             help='Only this TIC ID (default: every entry)')
+
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        pack(args.data_dir, args.archive, args.remove)
+    elif args.command == 'unpack':
+        unpack(args.archive, args.output_dir, args.tic)
+    else:
+        for entry in list_entries(args.archive, args.tic):
+            print(f"{entry['name']:40s} TIC {entry['tic_id']}  sector {entry['sector']}  "
+                  f"{entry['n_points']} points")
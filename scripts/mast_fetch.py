@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Shared MAST fetch layer for the download scripts
+
+A search or download can fail for reasons that say nothing about the
+star: a timeout, a dropped connection, MAST answering 503 under load.
+Counting those as "no data" silently loses the star from the survey.
+This module separates the outcomes:
+
+    light curve        search and download succeeded
+    None               the archive has no matching light curve
+    FetchError         the search/download failed, with error_class
+                       'transient' (worth retrying later) or 'permanent'
+
+Transient failures are retried with exponential backoff and full jitter
+before a FetchError is raised. Underneath, configure() routes every MAST
+request through the pooled session of mast_session.py with a process-wide
+token-bucket rate limit, a circuit breaker that pauses all requests during
+archive outages, and per-request latency recording. A local stub server
+(mast_stub_server.py, via --mast-server) injects failures to exercise all
+of this offline; check_mast_fetch.py runs the checks.
+"""
+
+import os
+import re
+import time
+import random
+import socket
+
+import requests
+import lightkurve as lk
+from astroquery import log as astroquery_log
+
+from mast_session import (use_shared_session, TokenBucket, CircuitBreaker, LatencyRecorder,
+                          DEFAULT_SERVER, RETRY_STATUSES)
+
+# Requests per second across all threads of a process
+DEFAULT_RATE = 25
+
+# Retries of a transient failure (per target), and the backoff between
+# them: a random delay of up to BACKOFF_BASE * 2**attempt seconds, capped
+MAX_RETRIES = 4
+BACKOFF_BASE = 2
+BACKOFF_MAX = 120
+
+# Network-level errors worth retrying
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, ConnectionError,
+                    TimeoutError, socket.timeout)
+
+# A truncated or garbled response body (requests >= 2.27)
+_JSON_ERRORS = tuple(e for e in [getattr(requests.exceptions, 'JSONDecodeError', None)] if e)
+
+# lightkurve reports a failed file download as a LightkurveError that
+# quotes astroquery's HTTPError
+_DOWNLOAD_HTTP_ERROR = re.compile(r'HTTPError: (\d{3})')
+
+# ... and a cached file it cannot read as one "corrupt due to an
+# interrupted download"
+_INTERRUPTED_DOWNLOAD = 'interrupted download'
+
+# Cadence (s) kept by search_sectors when a sector has several
+PREFERRED_EXPTIME = 120
+
+# SearchResult.mission of a TESS product, e.g. 'TESS Sector 11'
+_SECTOR_NAME = re.compile(r'Sector\s+(\d+)')
+
+# Backoff jitter; separate from the random module so it never disturbs a
+# seeded target sample
+_jitter = random.Random()
+
+# Set by configure()
+_settings = {'retries': MAX_RETRIES, 'backoff': BACKOFF_BASE, 'recorder': None}
+
+class FetchError(Exception):
+    """
+    A search or download that failed (after retries, if transient)
+    """
+
+    def __init__(self, message, error_class, cause=None):
+        super().__init__(message)
+        self.error_class = error_class
+        self.cause = cause
+
+def classify_error(exc):
+    """
+    'transient' for network errors, timeouts, HTTP 429/5xx, garbled
+    responses and MAST service errors; 'permanent' for anything else
+    (bad data, bugs)
+    """
+    if isinstance(exc, FetchError):
+        return exc.error_class
+    if isinstance(exc, TRANSIENT_ERRORS + _JSON_ERRORS):
+        return 'transient'
+    if isinstance(exc, requests.exceptions.HTTPError):
+        status = getattr(exc.response, 'status_code', None)
+        return 'transient' if status in RETRY_STATUSES else 'permanent'
+    name = type(exc).__name__
+    # Raised when MAST reports a failed query, usually server load
+    if name == 'RemoteServiceError':
+        return 'transient'
+    if name == 'LightkurveError':
+        match = _DOWNLOAD_HTTP_ERROR.search(str(exc))
+        if match and int(match.group(1)) in RETRY_STATUSES:
+            return 'transient'
+        if _INTERRUPTED_DOWNLOAD in str(exc):
+            return 'transient'
+    return 'permanent'
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """
+    Seconds to wait before retry number attempt (0-based): full jitter
+    over an exponentially growing window
+    """
+    return _jitter.uniform(0, min(cap, base * 2 ** attempt))
+
+def with_retries(function, *args, **kwargs):
+    """
+    Call function(*args, **kwargs), retrying transient failures
+
+    Raises:
+        FetchError carrying the error class of the last failure
+    """
+    retries = _settings['retries']
+    for attempt in range(retries + 1):
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            error_class = classify_error(e)
+            if error_class == 'permanent' or attempt == retries:
+                suffix = f" (after {attempt + 1} attempts)" if attempt else ""
+                raise FetchError(f"{type(e).__name__}: {e}{suffix}", error_class, e) from e
+            time.sleep(backoff_delay(attempt, _settings['backoff']))
+
+def _cached_path(search_result):
+    """
+    Where lightkurve caches the first product of a SearchResult
+    """
+    table = search_result.table
+    return os.path.join(search_result._default_download_dir().rstrip('/'), 'mastDownload',
+                        table['obs_collection'][0], table['obs_id'][0],
+                        table['productFilename'][0])
+
+def download_first(search_result):
+    """
+    Download the first row of a lightkurve SearchResult
+
+    SearchResult.download() silences stdout by swapping sys.stdout, which
+    threads would race on; call it unwrapped (configure() quiets
+    astroquery's progress output instead). A failed download removes the
+    cached file: a transfer cut short leaves a partial file there, which
+    lightkurve would otherwise read instead of downloading again.
+    """
+    download = getattr(lk.SearchResult.download, '__wrapped__', lk.SearchResult.download)
+    try:
+        return download(search_result[0])
+    except Exception:
+        path = _cached_path(search_result)
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+def _search_and_download(target, **search_options):
+    search_result = lk.search_lightcurve(target, **search_options)
+    if len(search_result) == 0:
+        return None
+    return download_first(search_result)
+
+def fetch_lightcurve(target, **search_options):
+    """
+    Search a target and download its first light curve, with retries
+
+    Parameters:
+    -----------
+    target : str
+        Anything lk.search_lightcurve accepts ('TIC 123', 'TOI-700', ...)
+    search_options :
+        Passed to lk.search_lightcurve (mission, author, ...)
+
+    Returns:
+        LightCurve, or None if the archive has no matching light curve
+
+    Raises:
+        FetchError if the search or download failed
+    """
+    return with_retries(_search_and_download, target, **search_options)
+
+def _sector_of(search_row):
+    """
+    Sector number of a one-row SearchResult ('TESS Sector 11'), or None
+    """
+    match = _SECTOR_NAME.search(str(search_row.mission[0]))
+    return int(match.group(1)) if match else None
+
+def search_sectors(target, **search_options):
+    """
+    Search a target and keep one product per sector, with retries
+
+    For each sector the pipeline listed first (SearchResult lists SPOC
+    before HLSP products) is kept, at the cadence closest to
+    PREFERRED_EXPTIME, so a star observed at 20 s and 120 s is not
+    downloaded twice.
+
+    Returns:
+        list of (sector, one-row SearchResult), by sector; empty if the
+        archive has no matching light curve
+
+    Raises:
+        FetchError if the search failed
+    """
+    search_result = with_retries(lk.search_lightcurve, target, **search_options)
+    by_sector = {}
+    for index in range(len(search_result)):
+        row = search_result[index]
+        by_sector.setdefault(_sector_of(row), []).append(row)
+    by_sector.pop(None, None)
+
+    chosen = []
+    for sector, rows in sorted(by_sector.items()):
+        author = rows[0].author[0]
+        rows = [row for row in rows if row.author[0] == author]
+        chosen.append((sector, min(rows, key=lambda row: abs(
+            float(row.table['exptime'][0]) - PREFERRED_EXPTIME))))
+    return chosen
+
+def fetch_sector(search_row):
+    """
+    Download one row from search_sectors, with retries
+
+    Raises:
+        FetchError if the download failed
+    """
+    return with_retries(download_first, search_row)
+
+def configure(pool_size=1, server=DEFAULT_SERVER, rate=DEFAULT_RATE, retries=MAX_RETRIES,
+              latency_log=None, breaker=None, backoff=BACKOFF_BASE):
+    """
+    Route this process's MAST traffic through the shared fetch layer
+
+    Parameters:
+    -----------
+    pool_size : int
+        Threads making requests (keep-alive connections kept per host)
+    server : str
+        MAST base URL (a local stub archive for testing)
+    rate : float
+        Requests per second across all threads (None or 0 = unlimited)
+    retries : int
+        Retries of a transient failure per target
+    latency_log : str
+        CSV file to append every request's latency to
+    breaker : CircuitBreaker
+        Pauses all requests during outages (default: CircuitBreaker())
+    backoff : float
+        Base of the retry backoff (s), see backoff_delay
+
+    Returns:
+        The LatencyRecorder collecting this process's request latencies
+    """
+    recorder = LatencyRecorder(latency_log)
+    bucket = TokenBucket(rate) if rate else None
+    use_shared_session(pool_size, server, bucket, breaker or CircuitBreaker(), recorder)
+    astroquery_log.setLevel('WARNING')
+    _settings.update(retries=retries, backoff=backoff, recorder=recorder)
+    return recorder
+
+def print_latency_summary(recorder=None):
+    """
+    Print request counts, failures and latency percentiles per request kind
+    """
+    recorder = recorder or _settings['recorder']
+    if recorder is None:
+        return
+    stats = recorder.summary()
+    if not stats:
+        return
+    print("\nMAST request latency:")
+    print(f"  {'request':24s} {'count':>8s} {'failed':>7s} {'mean s':>7s} {'p50 s':>7s} "
+          f"{'p95 s':>7s} {'max s':>7s}")
+    for kind, s in sorted(stats.items(), key=lambda item: -item[1]['requests']):
+        print(f"  {kind[:24]:24s} {s['requests']:>8d} {s['failed']:>7d} {s['mean']:>7.2f} "
+              f"{s['p50']:>7.2f} {s['p95']:>7.2f} {s['max']:>7.2f}")
+    recorder.close()
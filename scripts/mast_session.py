@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Thread-safe, connection-pooled MAST access for lightkurve searches
+
+lightkurve talks to MAST through astroquery's module-level Observations
+object. That object is not safe to share between threads: the portal
+connection remembers the "current service" between sending a query and
+parsing its response, so concurrent searches can parse each other's
+tables. Its requests session also keeps at most 10 idle connections per
+host, so more threads than that keep opening new TLS connections, and
+object-name lookups (the cone-search fallback lightkurve uses for every
+TIC ID without an exact match, i.e. most random stars) open a fresh
+connection to the name resolver each time.
+
+use_shared_session() replaces astroquery.mast.Observations with a proxy
+that gives every thread its own ObservationsClass. All of them send their
+requests through one requests.Session, whose keep-alive connection pool
+is sized to the number of threads; name lookups use the same session.
+lightkurve looks up Observations at call time, so searches and downloads
+go through the proxy without changes. A different server URL (e.g. a
+local stub archive for testing) replaces https://mast.stsci.edu and the
+name resolver's host in every endpoint.
+
+Every request of the session passes through one ArchiveAdapter, which
+applies the process-wide limits: a token bucket caps the request rate,
+a circuit breaker holds all requests back for a while after a run of
+failures (an archive outage) instead of letting every thread hammer it,
+and each request's latency is recorded (see mast_fetch.py for the
+per-target retries built on top).
+"""
+
+import re
+import time
+import threading
+from urllib.parse import unquote_plus
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_SERVER = 'https://mast.stsci.edu'
+
+# Name resolver astroquery queries outside its session
+RESOLVER_SERVER = 'http://mastresolver.stsci.edu'
+
+# Applied to requests sent without a timeout: (connect, read) seconds
+DEFAULT_TIMEOUT = (30, 300)
+
+# HTTP statuses that mean "try again later"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: at most rate requests per second on average,
+    with bursts of up to burst requests
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take one token, sleeping until one is available
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class CircuitBreaker:
+    """
+    Stops all requests for a cooldown after threshold consecutive failures
+
+    Requests arriving while the circuit is open wait for it to close
+    rather than fail, so targets are delayed instead of dropped. Each
+    consecutive opening doubles the cooldown (up to max_cooldown); one
+    successful request resets it.
+    """
+
+    def __init__(self, threshold=10, cooldown=30, max_cooldown=900):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._failures = 0
+        self._openings = 0
+        self._open_until = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block while the circuit is open
+        """
+        while True:
+            with self._lock:
+                remaining = self._open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._openings = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures < self.threshold or time.monotonic() < self._open_until:
+                return
+            cooldown = min(self.max_cooldown, self.cooldown * 2 ** self._openings)
+            self._openings += 1
+            self._failures = 0
+            self._open_until = time.monotonic() + cooldown
+        print(f"  ! {self.threshold} archive requests failed in a row - "
+              f"pausing all requests for {cooldown:.0f} s")
+
+# Latency histogram of LatencyRecorder: log-spaced bins from 1 ms to
+# 1000 s, 20 per decade (percentiles within ~6%), plus one bin each for
+# faster and slower requests
+LATENCY_MIN = 1e-3
+LATENCY_BINS_PER_DECADE = 20
+LATENCY_DECADES = 6
+
+class LatencyRecorder:
+    """
+    Per-request latency (time to response headers), grouped by request kind
+
+    Each kind keeps a fixed-size state (count, failures, sum, max and a
+    log-spaced histogram), so memory does not grow with the number of
+    requests; percentiles are read off the histogram. With log_path, every
+    request is also appended to a CSV file (unix time, kind, HTTP status or
+    error name, seconds) for exact analysis.
+    """
+
+    def __init__(self, log_path=None):
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._log = None
+        if log_path:
+            self._log = open(log_path, 'a', buffering=1)
+            if self._log.tell() == 0:
+                self._log.write('time,kind,status,seconds\n')
+
+    @staticmethod
+    def _bin(seconds):
+        if seconds < LATENCY_MIN:
+            return 0
+        index = int(np.log10(seconds / LATENCY_MIN) * LATENCY_BINS_PER_DECADE) + 1
+        return min(index, LATENCY_BINS_PER_DECADE * LATENCY_DECADES + 1)
+
+    @staticmethod
+    def _bin_value(index):
+        """
+        Geometric centre of a histogram bin (seconds)
+        """
+        if index == 0:
+            return LATENCY_MIN
+        return LATENCY_MIN * 10 ** ((min(index, LATENCY_BINS_PER_DECADE * LATENCY_DECADES)
+                                     - 0.5) / LATENCY_BINS_PER_DECADE)
+
+    def record(self, kind, status, seconds, failed):
+        with self._lock:
+            stats = self._stats.get(kind)
+            if stats is None:
+                stats = self._stats[kind] = {
+                    'requests': 0, 'failed': 0, 'total': 0.0, 'max': 0.0,
+                    'histogram': np.zeros(LATENCY_BINS_PER_DECADE * LATENCY_DECADES + 2,
+                                          dtype=np.int64)}
+            stats['requests'] += 1
+            stats['failed'] += bool(failed)
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['histogram'][self._bin(seconds)] += 1
+            if self._log:
+                self._log.write(f'{time.time():.3f},{kind},{status},{seconds:.4f}\n')
+
+    def _percentile(self, stats, q):
+        cumulative = np.cumsum(stats['histogram'])
+        index = int(np.searchsorted(cumulative, q / 100 * stats['requests']))
+        return min(self._bin_value(index), stats['max'])
+
+    def summary(self):
+        """
+        {kind: {'requests', 'failed', 'mean', 'p50', 'p95', 'max'}} (seconds)
+        """
+        with self._lock:
+            return {kind: {'requests': s['requests'], 'failed': s['failed'],
+                           'mean': s['total'] / s['requests'],
+                           'p50': self._percentile(s, 50),
+                           'p95': self._percentile(s, 95),
+                           'max': s['max']}
+                    for kind, s in self._stats.items()}
+
+    def close(self):
+        if self._log:
+            self._log.close()
+            self._log = None
+
+def request_kind(request):
+    """
+    Short label for a MAST request: the portal service it invokes, or the
+    endpoint (download, name lookup, ...)
+    """
+    url = request.url.split('?')[0]
+    if url.endswith('/invoke') and request.body:
+        body = request.body if isinstance(request.body, str) else request.body.decode(errors='ignore')
+        match = re.search(r'"service"\s*:\s*"([^"]+)"', unquote_plus(body))
+        if match:
+            return match.group(1)
+    if '/Download/' in url:
+        return 'download'
+    if 'Santa-war' in url or 'resolver' in url:
+        return 'name lookup'
+    return url.rstrip('/').rsplit('/', 1)[-1]
+
+class ArchiveAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that rate-limits, circuit-breaks and times every request
+    """
+
+    def __init__(self, bucket=None, breaker=None, recorder=None, **kwargs):
+        self.bucket = bucket
+        self.breaker = breaker
+        self.recorder = recorder
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = DEFAULT_TIMEOUT
+        if self.breaker:
+            self.breaker.wait()
+        if self.bucket:
+            self.bucket.acquire()
+
+        start = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if self.breaker:
+                self.breaker.record_failure()
+            if self.recorder:
+                self.recorder.record(request_kind(request), type(e).__name__,
+                                     time.monotonic() - start, failed=True)
+            raise
+
+        failed = response.status_code in RETRY_STATUSES
+        if self.breaker:
+            if failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        if self.recorder:
+            self.recorder.record(request_kind(request), response.status_code,
+                                 time.monotonic() - start, failed)
+        return response
+
+class ThreadLocalObservations:
+    """
+    Stand-in for astroquery.mast.Observations with one instance per thread
+    """
+
+    def __init__(self, observations_class, session, server):
+        self._observations_class = observations_class
+        self._session = session
+        self._server = server
+        self._local = threading.local()
+
+    def _instance(self):
+        observations = getattr(self._local, 'observations', None)
+        if observations is None:
+            observations = self._observations_class()
+            _share_session(observations, self._session, self._server)
+            self._local.observations = observations
+        return observations
+
+    def __getattr__(self, name):
+        return getattr(self._instance(), name)
+
+def _share_session(observations, session, server):
+    """
+    Point an ObservationsClass and its API connections at session and server
+    """
+    observations._session = session
+    for connection in (observations._portal_api_connection,
+                       observations._service_api_connection):
+        connection._session = session
+        if server != DEFAULT_SERVER:
+            for name in dir(connection):
+                value = getattr(connection, name)
+                if name.endswith('_URL') and isinstance(value, str) \
+                        and value.startswith(DEFAULT_SERVER):
+                    setattr(connection, name, server + value[len(DEFAULT_SERVER):])
+
+def make_session(pool_size, bucket=None, breaker=None, recorder=None):
+    """
+    requests.Session keeping up to pool_size keep-alive connections per
+    host, with every request passing through one ArchiveAdapter
+    """
+    session = requests.Session()
+    adapter = ArchiveAdapter(bucket, breaker, recorder,
+                             pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def use_shared_session(pool_size, server=DEFAULT_SERVER, bucket=None, breaker=None,
+                       recorder=None):
+    """
+    Route all astroquery MAST traffic through one pooled session
+
+    Parameters:
+    -----------
+    pool_size : int
+        Connections kept open per host (at least the number of threads
+        making requests)
+    server : str
+        MAST base URL; point it at a local stub archive to test downloads
+        without network access
+    bucket : TokenBucket
+        Request rate limit shared by all threads (default: none)
+    breaker : CircuitBreaker
+        Pauses all requests during archive outages (default: none)
+    recorder : LatencyRecorder
+        Collects per-request latencies (default: none)
+
+    Returns:
+        The shared requests.Session
+    """
+    import astroquery.mast
+    import astroquery.mast.utils
+    from astroquery.mast import ObservationsClass
+
+    server = server.rstrip('/')
+    session = make_session(pool_size, bucket, breaker, recorder)
+    # Keep astroquery's User-Agent and response hooks
+    template = ObservationsClass()
+    session.headers.update(template._session.headers)
+    session.hooks['response'].extend(template._session.hooks['response'])
+
+    def simple_request(url, params=None):
+        # Stand-in for astroquery.mast.utils._simple_request (a plain
+        # requests.get per call), which astroquery keeps separate for
+        # exactly this kind of replacement
+        if server != DEFAULT_SERVER:
+            for host in (DEFAULT_SERVER, RESOLVER_SERVER):
+                if url.startswith(host):
+                    url = server + url[len(host):]
+        response = session.get(url, params=params, headers={'Accept': 'text/plain'})
+        response.raise_for_status()
+        return response
+
+    astroquery.mast.utils._simple_request = simple_request
+    astroquery.mast.Observations = ThreadLocalObservations(ObservationsClass, session, server)
+    return session
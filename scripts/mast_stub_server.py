@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the MAST archive, with scheduled failures
+
+Serves the light curves in a directory through the endpoints lightkurve
+and astroquery use for a TESS search and download (portal column
+configs, Mast.Caom.Filtered / Filtered.Position / Products, the name
+resolver and Download/file), so the download scripts can run offline
+with --mast-server http://127.0.0.1:PORT. Files must be SPOC-format light
+curves named TIC_<id>.fits or TIC_<id>_s<sector>.fits; any other TIC ID
+resolves to a sky position without observations, as a star without TESS
+data does at MAST.
+
+A failure schedule decides the outcome of each request, in the order
+the requests arrive:
+
+    ok         normal response
+    429, 5xx   that HTTP status (any status, e.g. 404, works)
+    garbled    status 200 with a truncated body (JSON cut short, or a
+               download that stops halfway)
+    drop       close the connection without answering
+    OUTCOME*N  N requests in a row, e.g. 503*12 for an outage
+
+The schedule is played once and then every request succeeds, unless
+--repeat cycles it. check_mast_fetch.py drives mast_fetch through this
+server; run it by hand to load-test the download scripts:
+
+Usage:
+    python mast_stub_server.py -d ../data/stub --latency 0.3
+    python mast_stub_server.py -d ../data/stub --schedule 'ok*20,503*12' --repeat
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import argparse
+import threading
+from glob import glob
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from astropy.io import fits
+
+# Default cadence (s) of files without a TIMEDEL keyword
+DEFAULT_EXPTIME = 120
+
+_FILE_NAME = re.compile(r'TIC_(\d+)(?:_s(\d+))?\.fits$')
+
+# Observation and product columns returned by the portal services:
+# (name, portal type)
+OBSERVATION_FIELDS = [
+    ('obsid', 'string'), ('obs_id', 'string'), ('obs_collection', 'string'),
+    ('project', 'string'), ('provenance_name', 'string'), ('target_name', 'string'),
+    ('dataproduct_type', 'string'), ('sequence_number', 'int'), ('t_exptime', 'float'),
+    ('t_min', 'float'), ('t_max', 'float'), ('s_ra', 'float'), ('s_dec', 'float'),
+    ('distance', 'float'),
+]
+PRODUCT_FIELDS = [
+    ('obsid', 'string'), ('obs_id', 'string'), ('obs_collection', 'string'),
+    ('dataURI', 'string'), ('productFilename', 'string'), ('description', 'string'),
+    ('productType', 'string'), ('productSubGroupDescription', 'string'),
+    ('productGroupDescription', 'string'), ('size', 'int'),
+]
+
+def parse_schedule(schedule):
+    """
+    Expand a schedule string ('ok*3,503,garbled') into a list of outcomes
+
+    Raises:
+        ValueError for an unknown outcome or a bad repeat count
+    """
+    outcomes = []
+    for item in filter(None, (part.strip() for part in (schedule or '').split(','))):
+        outcome, _, count = item.partition('*')
+        if outcome not in ('ok', 'garbled', 'drop') and not re.fullmatch(r'\d{3}', outcome):
+            raise ValueError(f"Unknown outcome '{outcome}' in failure schedule")
+        outcomes.extend([outcome] * int(count or 1))
+    return outcomes
+
+def _sky_position(tic_id):
+    """
+    Made-up but stable (ra, dec) in degrees for a TIC ID
+    """
+    crc = zlib.crc32(str(tic_id).encode())
+    return (crc % 36000) / 100, ((crc // 36000) % 17000) / 100 - 85
+
+def scan_archive(data_dir):
+    """
+    Observation records of the light curves in data_dir
+
+    Returns:
+        dict of TIC ID (str) -> list of observation dicts, each with the
+        local 'path' of its file and its product fields
+    """
+    archive = {}
+    for path in sorted(glob(os.path.join(data_dir, '*.fits'))):
+        match = _FILE_NAME.search(os.path.basename(path))
+        if not match:
+            continue
+        tic_id = match.group(1)
+        with fits.open(path) as hdul:
+            header = hdul[0].header
+            sector = int(match.group(2) or header.get('SECTOR', 1))
+            exptime = DEFAULT_EXPTIME
+            if len(hdul) > 1 and 'TIMEDEL' in hdul[1].header:
+                exptime = round(hdul[1].header['TIMEDEL'] * 86400)
+            t_min = hdul[1].header.get('TSTART', 0.0) if len(hdul) > 1 else 0.0
+            t_max = hdul[1].header.get('TSTOP', 0.0) if len(hdul) > 1 else 0.0
+        ra, dec = _sky_position(tic_id)
+        obs_id = f'tess-s{sector:04d}-{int(tic_id):016d}'
+        filename = f'{obs_id}-s_lc.fits'
+        archive.setdefault(tic_id, []).append({
+            'path': path, 'obsid': str(zlib.crc32(obs_id.encode())), 'obs_id': obs_id,
+            'obs_collection': 'TESS', 'project': 'TESS', 'provenance_name': 'SPOC',
+            'target_name': tic_id, 'dataproduct_type': 'timeseries', 'sequence_number': sector,
+            't_exptime': float(exptime), 't_min': t_min + 56999.5, 't_max': t_max + 56999.5,
+            's_ra': ra, 's_dec': dec, 'distance': 0.0,
+            'dataURI': f'mast:TESS/product/{filename}', 'productFilename': filename,
+            'description': 'Light curves', 'productType': 'SCIENCE',
+            'productSubGroupDescription': 'LC', 'productGroupDescription': 'Minimum Recommended Products',
+            'size': os.path.getsize(path),
+        })
+    return archive
+
+def _filter_values(filters, name):
+    for entry in filters:
+        if entry.get('paramName', '').lower() == name:
+            return entry.get('values', [])
+    return None
+
+def _matches(observation, filters):
+    """
+    Whether an observation passes the portal filters lightkurve sends
+    (discrete value lists and continuous {min, max} ranges)
+    """
+    for entry in filters:
+        name = entry.get('paramName')
+        if name not in observation:
+            continue
+        value = observation[name]
+        values = entry.get('values', [])
+        if values and isinstance(values[0], dict):
+            if not any(v['min'] <= value <= v['max'] for v in values):
+                return False
+        elif values and str(value).lower() not in [str(v).lower() for v in values]:
+            return False
+    return True
+
+def _table(fields, rows):
+    return {'status': 'COMPLETE', 'msg': '',
+            'fields': [{'name': name, 'type': kind} for name, kind in fields],
+            'data': [{name: row[name] for name, _ in fields} for row in rows],
+            'paging': {'page': 1, 'pageSize': max(len(rows), 1), 'pagesFiltered': 1,
+                       'rows': len(rows), 'rowsFiltered': len(rows), 'rowsTotal': len(rows)}}
+
+class StubArchive:
+    """
+    Archive contents, failure schedule and request counts shared by the
+    server's handler threads
+    """
+
+    def __init__(self, data_dir, schedule=None, repeat=False, latency=0.0):
+        self.archive = scan_archive(data_dir)
+        self.by_obsid = {obs['obsid']: obs for observations in self.archive.values()
+                         for obs in observations}
+        self.by_filename = {obs['productFilename']: obs for obs in self.by_obsid.values()}
+        self.latency = latency
+        self.counts = {}
+        self._lock = threading.Lock()
+        self.set_schedule(schedule, repeat)
+
+    def set_schedule(self, schedule, repeat=False):
+        """
+        Replace the failure schedule and restart it from the next request
+        """
+        outcomes = parse_schedule(schedule) if isinstance(schedule, str) else list(schedule or [])
+        with self._lock:
+            self._outcomes = outcomes
+            self._repeat = repeat
+            self._served = 0
+            self.counts = {}
+
+    def next_outcome(self):
+        with self._lock:
+            index = self._served
+            self._served += 1
+            if self._outcomes and self._repeat:
+                outcome = self._outcomes[index % len(self._outcomes)]
+            elif index < len(self._outcomes):
+                outcome = self._outcomes[index]
+            else:
+                outcome = 'ok'
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+            return outcome
+
+    def invoke(self, request):
+        """
+        JSON answer to a portal service request
+        """
+        service = request.get('service')
+        params = request.get('params', {})
+        if service in ('Mast.Caom.Filtered', 'Mast.Caom.Filtered.Position'):
+            filters = params.get('filters', [])
+            if service == 'Mast.Caom.Filtered':
+                names = _filter_values(filters, 'target_name') or []
+                candidates = [obs for name in names for obs in self.archive.get(str(name), [])]
+            else:
+                # Cone searches only happen for names without an exact
+                # match, i.e. stars the archive does not have
+                candidates = []
+            rows = [obs for obs in candidates if _matches(obs, filters)]
+            return _table(OBSERVATION_FIELDS, rows)
+        if service == 'Mast.Caom.Products':
+            obsids = str(params.get('obsid', '')).split(',')
+            return _table(PRODUCT_FIELDS, [self.by_obsid[o] for o in obsids if o in self.by_obsid])
+        return {'status': 'ERROR', 'msg': f'Unknown service {service}'}
+
+    @staticmethod
+    def column_config():
+        config = {name: {'text': name, 'type': kind} for name, kind in OBSERVATION_FIELDS}
+        for name, _ in OBSERVATION_FIELDS:
+            if name in ('t_exptime', 't_min', 't_max', 's_ra', 's_dec', 'distance'):
+                config[name]['vot.datatype'] = 'double'
+        return config
+
+    def resolve(self, names):
+        resolved = []
+        for name in names:
+            match = re.fullmatch(r'(?:tic|tess)\s*(\d+)', name.strip().lower())
+            if match:
+                ra, dec = _sky_position(match.group(1))
+                resolved.append({'searchString': name.lower(), 'resolver': 'TIC',
+                                 'canonicalName': f'TIC {match.group(1)}',
+                                 'ra': ra, 'decl': dec})
+        return {'resolvedCoordinate': resolved}
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers one request according to the archive's failure schedule
+    """
+
+    protocol_version = 'HTTP/1.1'
+    stub = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode() if length else ''
+
+    def _send(self, status, body, content_type='application/json', truncate=False):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body[:len(body) // 2] if truncate else body)
+        if truncate:
+            self.close_connection = True
+
+    def _handle(self):
+        body = self._body() if self.command == 'POST' else ''
+        outcome = self.stub.next_outcome()
+        if self.stub.latency:
+            time.sleep(self.stub.latency)
+        if outcome == 'drop':
+            self.close_connection = True
+            return
+        if outcome not in ('ok', 'garbled'):
+            self._send(int(outcome), {'status': 'ERROR', 'msg': f'HTTP {outcome}'})
+            return
+        garbled = outcome == 'garbled'
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.endswith('/columnsconfig'):
+            self._send(200, self.stub.column_config(), truncate=garbled)
+        elif url.path.endswith('/invoke'):
+            request = json.loads(parse_qs(body).get('request', ['{}'])[0])
+            self._send(200, self.stub.invoke(request), truncate=garbled)
+        elif url.path.endswith('/Santa-war/query'):
+            self._send(200, self.stub.resolve(query.get('name', [])), truncate=garbled)
+        elif url.path.endswith('/Download/file'):
+            uri = query.get('uri', [''])[0]
+            observation = self.stub.by_filename.get(uri.rsplit('/', 1)[-1])
+            if observation is None:
+                self._send(404, f'{uri} not found', 'text/plain')
+                return
+            with open(observation['path'], 'rb') as f:
+                self._send(200, f.read(), 'application/fits', truncate=garbled)
+        else:
+            self._send(404, f'{url.path} not found', 'text/plain')
+
+    do_GET = do_POST = do_HEAD = _handle
+
+def start_server(data_dir, port=0, schedule=None, repeat=False, latency=0.0):
+    """
+    Serve data_dir from a background thread
+
+    Parameters:
+    -----------
+    data_dir : str
+        Directory of TIC_<id>[_s<sector>].fits light curves
+    port : int
+        Port on 127.0.0.1 (0 = any free port)
+    schedule : str
+        Failure schedule (see module docstring); default: no failures
+    repeat : bool
+        Cycle the schedule instead of playing it once
+    latency : float
+        Seconds every request waits before it is answered
+
+    Returns:
+        (ThreadingHTTPServer, base URL); server.stub is the StubArchive
+    """
+    stub = StubArchive(data_dir, schedule, repeat, latency)
+    handler = type('Handler', (StubHandler,), {'stub': stub})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.stub = stub
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve light curves as a local MAST stub with '
+                                                 'scheduled failures')
+    parser.add_argument('-d', '--data-dir', type=str, required=True,
+                        help='Directory of TIC_<id>[_s<sector>].fits SPOC light curves')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='Port on 127.0.0.1 (default: 8765)')
+    parser.add_argument('--schedule', type=str, default='',
+                        help="Outcomes of successive requests, e.g. 'ok*20,503*12,garbled,drop' "
+                             "(default: no failures)")
+    parser.add_argument('--repeat', action='store_true',
+                        help='Cycle the schedule instead of playing it once')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds every request waits before it is answered')
+
+    args = parser.parse_args()
+
+    try:
+        parse_schedule(args.schedule)
+    except ValueError as e:
+        parser.error(str(e))
+    server, url = start_server(args.data_dir, args.port, args.schedule, args.repeat, args.latency)
+    print(f"Serving {len(server.stub.archive)} stars from {args.data_dir} at {url}")
+    print(f"Run the download scripts with --mast-server {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
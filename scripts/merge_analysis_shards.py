@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Merge sharded transit analysis results into a single summary
+
+When analyze_tess_transits.py runs as a SLURM array (--shard-index/--num-shards),
+each shard writes analysis_summary.shard-XXXX-of-YYYY.txt. This script combines
+them into the analysis_summary.txt that analyze_results.py reads, in the same
+target order an unsharded run would produce. Shard results databases
+(analysis_results.shard-*.sqlite) are merged into analysis_results.sqlite.
+
+Usage:
+    python merge_analysis_shards.py -o ../results/phase3_ultra_analysis
+"""
+
+import os
+import re
+import sys
+import argparse
+from glob import glob
+
+from results_store import RESULTS_DB, find_shard_dbs, merge_results
+
+SHARD_PATTERN = re.compile(r'analysis_summary\.shard-(\d+)-of-(\d+)\.txt$')
+DB_SHARD_PATTERN = re.compile(r'analysis_results\.shard-(\d+)-of-(\d+)\.sqlite$')
+
+def parse_summary_blocks(summary_file):
+    """
+    Split a summary file into per-target text blocks
+
+    Returns:
+        List of (target_name, block_text) tuples in file order
+    """
+    blocks = []
+    current_target = None
+    current_lines = []
+
+    with open(summary_file, 'r') as f:
+        for line in f:
+            if line.startswith('Target: '):
+                if current_target is not None:
+                    blocks.append((current_target, ''.join(current_lines)))
+                current_target = line[len('Target: '):].strip()
+                current_lines = [line]
+            elif current_target is not None and line.strip():
+                current_lines.append(line)
+
+    if current_target is not None:
+        blocks.append((current_target, ''.join(current_lines)))
+
+    return blocks
+
+def index_shards(paths, pattern):
+    """
+    Map shard index -> path for the shard files among paths
+
+    Returns:
+        (dict of shard index -> path, expected number of shards or 0 if none)
+    """
+    shards = {}
+    num_shards = None
+
+    for path in paths:
+        match = pattern.search(os.path.basename(path))
+        if not match:
+            continue
+        index, count = int(match.group(1)), int(match.group(2))
+        if num_shards is not None and count != num_shards:
+            raise ValueError(f"Shard files disagree on shard count ({num_shards} vs {count}) "
+                             f"- remove leftovers from an older run")
+        num_shards = count
+        shards[index] = path
+
+    return shards, num_shards or 0
+
+def find_shard_files(output_dir):
+    """
+    Find shard summaries in output_dir
+
+    Returns:
+        (dict of shard index -> summary file, expected number of shards)
+    """
+    paths = glob(os.path.join(output_dir, 'analysis_summary.shard-*-of-*.txt'))
+    return index_shards(paths, SHARD_PATTERN)
+
+def shard_gaps(output_dir):
+    """
+    Check that every shard left both its summary and its results database
+
+    Returns:
+        (summary files by shard, results databases by shard, list of
+        problems - empty if the shards are complete)
+    """
+    summaries, num_summaries = find_shard_files(output_dir)
+    dbs, num_dbs = index_shards(find_shard_dbs(output_dir), DB_SHARD_PATTERN)
+    num_shards = max(num_summaries, num_dbs)
+
+    gaps = []
+    if num_summaries and num_dbs and num_summaries != num_dbs:
+        gaps.append(f"summaries are from {num_summaries} shards, results databases "
+                    f"from {num_dbs} - remove leftovers from an older run")
+    for kind, found, count in (('summaries', summaries, num_summaries),
+                               ('results databases', dbs, num_dbs)):
+        if not count:
+            continue
+        missing = [i for i in range(num_shards) if i not in found]
+        if missing:
+            gaps.append(f"{len(missing)} of {num_shards} shard {kind} missing: {missing[:20]}")
+    return summaries, dbs, gaps
+
+def merge_shards(output_dir, summary_name='analysis_summary.txt', allow_partial=False):
+    """
+    Combine all shard summaries in output_dir into one summary file
+
+    Parameters:
+    -----------
+    output_dir : str
+        Directory containing analysis_summary.shard-*.txt files
+    summary_name : str
+        Name of the merged summary file written to output_dir
+    allow_partial : bool
+        Merge the shards that are there even if some are missing. Otherwise
+        a missing shard raises ValueError before anything is written.
+    """
+    summaries, dbs, gaps = shard_gaps(output_dir)
+    for gap in gaps:
+        print(f"WARNING: {gap}" if allow_partial else f"  ✗ {gap}")
+    if gaps and not allow_partial:
+        raise ValueError(f"Shards of {output_dir} are incomplete - rerun the missing "
+                         f"array tasks, or merge anyway with --allow-partial")
+
+    count = 0
+    if dbs:
+        shard_dbs = [dbs[i] for i in sorted(dbs)]
+        db_path = os.path.join(output_dir, RESULTS_DB)
+        count = merge_results(db_path, shard_dbs)
+        print(f"Merged {len(shard_dbs)} shard databases ({count} targets) into {db_path}")
+
+    if not summaries:
+        print(f"No shard text summaries found in {output_dir}")
+        return count
+
+    shard_files = [summaries[i] for i in sorted(summaries)]
+    print(f"Merging {len(shard_files)} shard summaries from {output_dir}")
+
+    merged = {}
+    for shard_file in shard_files:
+        blocks = parse_summary_blocks(shard_file)
+        for target, block in blocks:
+            if target in merged:
+                print(f"  Duplicate target {target} in {os.path.basename(shard_file)}, keeping first")
+                continue
+            merged[target] = block
+        print(f"  ✓ {os.path.basename(shard_file)}: {len(blocks)} targets")
+
+    summary_file = os.path.join(output_dir, summary_name)
+    with open(summary_file, 'w') as f:
+        f.write("TESS Transit Analysis Summary\n")
+        f.write("=" * 60 + "\n\n")
+        # Unsharded runs process files in sorted order; match it
+        for target in sorted(merged):
+            f.write(merged[target])
+            f.write("\n")
+
+    print(f"\nMerged {len(merged)} targets into {summary_file}")
+    return len(merged)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Merge sharded TESS analysis summaries')
+    parser.add_argument('-o', '--output-dir', type=str, required=True,
+                        help='Analysis output directory containing shard summaries')
+    parser.add_argument('--allow-partial', action='store_true',
+                        help='Merge the shards that finished even if some are missing')
+
+    args = parser.parse_args()
+
+    try:
+        merge_shards(args.output_dir, allow_partial=args.allow_partial)
+    except ValueError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
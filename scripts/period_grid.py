@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Per-light-curve trial period grids for the BLS transit search
+
+A transit at period P drifts in phase by P * T * df over a baseline T when
+the trial frequency is off by df. The grid is sampled just finely enough
+that this drift stays below a fraction (1/oversample) of the expected
+transit duration, which depends on the period:
+
+  'frequency'  constant duty cycle (duration = duty_cycle * P), giving
+               trials uniform in frequency
+  'ofir'       duration of a central transit across a star of the given
+               density, D ~ P^(1/3) (Ofir 2014), giving trials uniform in
+               frequency^(1/3)
+  'fixed'      the original linear np.arange(period_min, period_max, step)
+
+The drift tolerance never drops below the cadence (finer phase resolution
+than the sampling is wasted), and the longest period is capped so the
+baseline can hold at least min_transits transits.
+"""
+
+import numpy as np
+
+GRID_METHODS = ['fixed', 'frequency', 'ofir']
+
+# Central transit duration across a Sun-density star, D = D_1 * P^(1/3)
+# (days, P in days): R_sun / (pi * a) with a from Kepler's third law
+SOLAR_DURATION_COEFF = 0.0756
+
+def plan_period_grid(time, period_min, period_max, method='ofir', period_step=0.001,
+                     oversample=3, duty_cycle=0.01, stellar_density=1.0, min_transits=2,
+                     baseline=None):
+    """
+    Trial periods for one light curve
+
+    Parameters:
+    -----------
+    time : array
+        Observation times (days)
+    period_min, period_max : float
+        Requested period range (days)
+    method : str
+        One of GRID_METHODS
+    period_step : float
+        Step of the 'fixed' grid (days); also used to report savings
+    oversample : float
+        Trials per expected transit duration of phase drift
+    duty_cycle : float
+        Transit duration / period assumed by the 'frequency' method
+    stellar_density : float
+        Stellar density in solar units assumed by the 'ofir' method
+    min_transits : int
+        Longest period allowed is baseline / (min_transits - 1)
+    baseline : float
+        Plan for this baseline (days) instead of the light curve's own,
+        e.g. to share one grid between several sectors of a star
+
+    Returns:
+        (ascending array of periods, dict with method, n_trials, n_fixed,
+        baseline, cadence and the period range actually searched)
+    """
+    if method not in GRID_METHODS:
+        raise ValueError(f"Unknown period grid method '{method}'")
+
+    time = np.asarray(time, dtype=np.float64)
+    if baseline is None:
+        baseline = float(np.max(time) - np.min(time))
+    spacing = np.diff(np.sort(time))
+    spacing = spacing[spacing > 0]
+    cadence = float(np.median(spacing)) if len(spacing) else 0.0
+
+    n_fixed = len(np.arange(period_min, period_max, period_step))
+
+    if method == 'fixed':
+        periods = np.arange(period_min, period_max, period_step)
+    else:
+        if min_transits > 1:
+            period_max = min(period_max, baseline / (min_transits - 1))
+        if period_max <= period_min or baseline <= 0:
+            raise ValueError(f"Baseline of {baseline:.2f} days is too short for "
+                             f"{min_transits} transits at periods above {period_min} days")
+
+        if method == 'frequency':
+            periods = _frequency_grid(period_min, period_max, baseline, cadence,
+                                      oversample, duty_cycle)
+        else:
+            periods = _ofir_grid(period_min, period_max, baseline, cadence,
+                                 oversample, stellar_density)
+
+    info = {
+        'method': method,
+        'n_trials': len(periods),
+        'n_fixed': n_fixed,
+        'baseline': baseline,
+        'cadence': cadence,
+        'period_min': float(periods[0]),
+        'period_max': float(periods[-1]),
+    }
+    return periods, info
+
+def _frequency_grid(period_min, period_max, baseline, cadence, oversample, duty_cycle):
+    """
+    Trials uniform in frequency: drift P * T * df <= duty_cycle * P / oversample
+
+    Where the cadence is the coarser limit (short periods), the step widens
+    to keep the drift at one cadence instead.
+    """
+    f_min, f_max = 1.0 / period_max, 1.0 / period_min
+
+    df = duty_cycle / (oversample * baseline)
+    frequencies = np.arange(f_min, f_max, df)
+
+    if cadence > 0:
+        # Drift tolerance max(duty_cycle * P / oversample, cadence): below
+        # P = cadence * oversample / duty_cycle the cadence wins and df grows
+        # like f (uniform in log frequency)
+        f_cross = duty_cycle / (oversample * cadence)
+        if f_cross < f_max:
+            low = frequencies[frequencies < f_cross]
+            n_log = int(np.ceil(np.log(f_max / f_cross) * baseline / cadence)) + 1
+            high = np.geomspace(f_cross, f_max, n_log)
+            frequencies = np.concatenate([low, high])
+
+    return np.unique(1.0 / np.append(frequencies, f_max))
+
+def _ofir_grid(period_min, period_max, baseline, cadence, oversample, stellar_density):
+    """
+    Trials uniform in x = f^(1/3) (Ofir 2014)
+
+    With D = C * P^(1/3), the drift P * T * df <= D / oversample becomes a
+    constant step dx = C / (3 * oversample * T) in x.
+    """
+    coeff = SOLAR_DURATION_COEFF * stellar_density ** (-1.0 / 3.0)
+    x_min, x_max = period_max ** (-1.0 / 3.0), period_min ** (-1.0 / 3.0)
+
+    dx = coeff / (3.0 * oversample * baseline)
+    x = np.arange(x_min, x_max, dx)
+
+    if cadence > 0:
+        # Cadence-limited when D / oversample < cadence, i.e. at periods
+        # below (oversample * cadence / C)^3: cap the step in frequency there
+        p_cross = (oversample * cadence / coeff) ** 3
+        if p_cross > period_min:
+            x = x[x < p_cross ** (-1.0 / 3.0)]
+            f_cross, f_max = 1.0 / min(p_cross, period_max), 1.0 / period_min
+            n_log = int(np.ceil(np.log(f_max / f_cross) * baseline / cadence)) + 1
+            x = np.concatenate([x, np.geomspace(f_cross, f_max, n_log) ** (1.0 / 3.0)])
+
+    return np.unique(1.0 / np.append(x, x_max) ** 3)
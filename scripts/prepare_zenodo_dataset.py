@@ -61,8 +61,11 @@ def prepare_zenodo_package(base_dir='/homes/tylerdoe/beocat-astronomy'):
         tic_id = row['TIC_ID']
         phase = row['phase']
 
-        # Determine source directory
-        if 'Phase3_529' in phase:
+        # Determine source directory (recorded by the results catalog;
+        # older compiled CSVs only have the phase)
+        if isinstance(row.get('results_dir'), str):
+            source_dir = row['results_dir']
+        elif 'Phase3_529' in phase:
             source_dir = os.path.join(results_dir, 'phase3_random')
         else:
             source_dir = os.path.join(results_dir, 'phase3_mega_analysis')
@@ -392,7 +395,7 @@ PERIOD STATISTICS:
 TOP 5 CANDIDATES:
 """
 
-    top5 = df.nlargest(5, 'transit_power')
+    top5 = top50.head(5)
     for idx, (i, row) in enumerate(top5.iterrows(), 1):
         stats_content += f"  {idx}. {row['TIC_ID']}: Period = {row['period_days']:.4f} d, Power = {row['transit_power']:,.1f}\n"
 
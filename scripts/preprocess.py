@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Light-curve cleaning on plain NumPy arrays
+
+Reproduces the analyzer's lightkurve cleaning chain
+(remove_nans -> median normalization -> remove_outliers -> flatten) step
+for step, including lightkurve's defaults and dtypes, without building
+LightCurve/Time/Quantity objects. Used with the fast FITS loader.
+"""
+
+import warnings
+
+import numpy as np
+from scipy.signal import savgol_filter
+from scipy.interpolate import interp1d
+
+# lightkurve LightCurve.flatten() defaults
+FLATTEN_POLYORDER = 2
+FLATTEN_BREAK_TOLERANCE = 5
+FLATTEN_NITERS = 3
+FLATTEN_SIGMA = 3
+
+# astropy sigma_clip() default number of iterations
+SIGMA_CLIP_MAXITERS = 5
+
+def sigma_clip_mask(values, sigma, maxiters=SIGMA_CLIP_MAXITERS):
+    """
+    Outlier mask of astropy.stats.sigma_clip (median center, std width)
+
+    Returns:
+        Boolean array, True for values clipped as outliers (or non-finite)
+    """
+    filtered = values[np.isfinite(values)]
+    low, high = -np.inf, np.inf
+    for _ in range(maxiters):
+        center = np.median(filtered)
+        spread = np.std(filtered)
+        low, high = center - spread * sigma, center + spread * sigma
+        size = filtered.size
+        filtered = filtered[(filtered >= low) & (filtered <= high)]
+        if filtered.size == size:
+            break
+
+    with np.errstate(invalid='ignore'):
+        return ~np.isfinite(values) | (values < low) | (values > high)
+
+def flatten_trend(time, flux, window_length, polyorder=FLATTEN_POLYORDER,
+                  break_tolerance=FLATTEN_BREAK_TOLERANCE, niters=FLATTEN_NITERS,
+                  sigma=FLATTEN_SIGMA):
+    """
+    Savitzky-Golay trend as computed by lightkurve's LightCurve.flatten()
+
+    The light curve is split at gaps longer than break_tolerance median
+    cadences, each segment is filtered separately, and the fit is repeated
+    niters times with points more than sigma standard deviations from the
+    trend masked out (the trend is interpolated across them).
+
+    Returns:
+        Trend (float64), one value per input point
+    """
+    with np.errstate(invalid='ignore'):
+        mask = np.isfinite(flux)
+        mask &= np.nan_to_num(np.abs(flux - np.nanmedian(flux))) <= np.nanstd(flux) * sigma
+
+    if polyorder >= window_length:
+        polyorder = window_length - 1
+
+    trend = None
+    for _ in range(niters):
+        masked_time = time[mask]
+        masked_flux = flux[mask]
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            dt = masked_time[1:] - masked_time[:-1]
+            cut = np.where(dt > break_tolerance * np.nanmedian(dt))[0] + 1
+        low = np.append([0], cut)
+        high = np.append(cut, len(masked_time))
+
+        segment_trend = np.zeros(len(masked_time))
+        for l, h in zip(low, high):
+            if window_length > (h - l) or (h - l) < break_tolerance:
+                segment_trend[l:h] = np.nanmedian(masked_flux[l:h])
+            else:
+                segment_trend[l:h] = savgol_filter(masked_flux[l:h], window_length, polyorder)
+
+        residual = masked_flux - segment_trend
+        keep = np.nan_to_num(np.abs(residual)) < np.nanstd(residual) * sigma + 1e-14
+        trend = interp1d(masked_time[keep], segment_trend[keep],
+                         fill_value="extrapolate")(time)
+        mask[mask] &= keep
+
+    return trend
+
+def clean_arrays(time, flux, flux_err, outlier_sigma, flatten_window):
+    """
+    Normalize, clip and flatten a light curve given as arrays
+
+    Parameters:
+    -----------
+    time, flux, flux_err : array
+        Light curve as returned by fits_loader.read_lightcurve
+        (flux_err may be None)
+    outlier_sigma : float
+        Sigma-clipping threshold for outlier removal
+    flatten_window : int
+        Savitzky-Golay window length (cadences)
+
+    Returns:
+        dict with 'time', 'flux', 'flux_err' (normalized, outliers removed)
+        and 'flat_flux', 'flat_err' (divided by the flatten trend)
+    """
+    # Remove NaNs first
+    keep = ~np.isnan(flux)
+    time, flux = time[keep], flux[keep]
+    if flux_err is not None:
+        flux_err = flux_err[keep]
+
+    # Normalize by the median (in the file's precision, as lightkurve does)
+    median_flux = np.nanmedian(flux)
+    flux = flux / median_flux
+    if flux_err is not None:
+        flux_err = flux_err / median_flux
+
+    keep = ~sigma_clip_mask(flux, outlier_sigma)
+    time, flux = time[keep], flux[keep]
+    if flux_err is not None:
+        flux_err = flux_err[keep]
+
+    # Flatten to remove stellar variability
+    trend = flatten_trend(time, flux, flatten_window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        flat_flux = flux / trend
+        flat_err = flux_err / trend if flux_err is not None else None
+
+    return {
+        'time': time,
+        'flux': flux,
+        'flux_err': flux_err,
+        'flat_flux': flat_flux,
+        'flat_err': flat_err,
+    }
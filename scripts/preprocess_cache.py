@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of cleaned, flattened light curves
+
+Preprocessing (read, normalize, clip, flatten) is the same for every rerun
+that only changes the search, so its output is kept in one SQLite file
+(e.g. ../cache/preprocess.sqlite) and looked up before the FITS file is
+even read. Entries are keyed by the SHA-256 of the input file's contents
+plus the preprocessing parameters, so renamed or re-downloaded copies of
+the same file hit and any change of parameters misses.
+
+Arrays are stored as little-endian float32 (time as a float32 offset from
+a float64 reference, ~0.1 s precision over a sector). Searches with the
+cache enabled always use these float32 arrays, hit or miss, so a rerun
+gives exactly the same results as the run that filled the cache.
+
+The file is kept below a size limit by dropping least-recently-used
+entries. Several workers and array tasks may share one cache; SQLite's
+locking serializes the writes.
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+import numpy as np
+
+from lightcurve_archive import split_member, member_digest
+
+# Bump when the stored layout or the preprocessing code changes meaning
+CACHE_VERSION = 1
+
+DEFAULT_MAX_GB = 5.0
+
+# Seconds to wait for another process's write lock
+LOCK_TIMEOUT = 120
+
+ARRAY_COLUMNS = ['time', 'flux', 'flat_flux', 'flat_err']
+META_KEYS = ['tic_id', 'sector', 'n_raw', 'time_min', 'time_max']
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    SHA-256 hex digest of a file's contents
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_key(path, params):
+    """
+    Cache key of an input file under a set of preprocessing parameters
+
+    Entries of a packed archive are keyed by the digest of their packed
+    bytes, which the archive index already holds.
+    """
+    digest = member_digest(path) if split_member(path) else file_digest(path)
+    payload = json.dumps({'version': CACHE_VERSION, 'file': digest,
+                          'params': params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def open_cache(cache_path):
+    """
+    Open (creating if needed) a preprocessing cache database
+    """
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(cache_path, timeout=LOCK_TIMEOUT)
+    conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, '
+                 'time_ref REAL, time BLOB, flux BLOB, flat_flux BLOB, flat_err BLOB, '
+                 'meta TEXT, nbytes INTEGER, last_used REAL)')
+    conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+    return conn
+
+def compact(prepared):
+    """
+    Round a prepare_lightcurve() dict through the cache's float32 layout
+
+    Returns:
+        (dict with the same keys and float32-exact values, row tuple for
+        the entries table without key/last_used)
+    """
+    time_ref = float(prepared['time'][0])
+    stored = {
+        'time': np.asarray(prepared['time'] - time_ref, dtype='<f4'),
+        'flux': np.asarray(prepared['flux'], dtype='<f4'),
+        'flat_flux': np.asarray(prepared['flat_flux'], dtype='<f4'),
+        'flat_err': (np.asarray(prepared['flat_err'], dtype='<f4')
+                     if prepared['flat_err'] is not None else None),
+    }
+    meta = {k: prepared[k] for k in META_KEYS}
+
+    blobs = [stored[name].tobytes() if stored[name] is not None else None
+             for name in ARRAY_COLUMNS]
+    nbytes = sum(len(b) for b in blobs if b is not None)
+    row = (time_ref, *blobs, json.dumps(meta), nbytes)
+
+    return _expand(time_ref, stored, meta), row
+
+def _expand(time_ref, stored, meta):
+    """
+    prepare_lightcurve()-style dict from stored float32 arrays
+    """
+    flat_err = stored['flat_err']
+    prepared = {
+        'time': stored['time'].astype(np.float64) + time_ref,
+        'flux': stored['flux'],
+        'flux_err': None,
+        'flat_flux': stored['flat_flux'].astype(np.float64),
+        'flat_err': flat_err.astype(np.float64) if flat_err is not None else None,
+    }
+    prepared.update(meta)
+    return prepared
+
+def load_entry(conn, key):
+    """
+    Cached preprocessing output for key, or None on a miss
+    """
+    row = conn.execute('SELECT time_ref, time, flux, flat_flux, flat_err, meta '
+                       'FROM entries WHERE key = ?', (key,)).fetchone()
+    if row is None:
+        return None
+
+    conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+    conn.commit()
+
+    time_ref, blobs, meta = row[0], row[1:5], json.loads(row[5])
+    stored = {name: np.frombuffer(blob, dtype='<f4') if blob is not None else None
+              for name, blob in zip(ARRAY_COLUMNS, blobs)}
+    return _expand(time_ref, stored, meta)
+
+def store_entry(conn, key, row, max_bytes):
+    """
+    Insert one entry (row from compact()) and evict LRU entries above max_bytes
+    """
+    conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                 (key, *row, time.time()))
+    conn.commit()
+    evict(conn, key, max_bytes)
+
+def evict(conn, key, max_bytes):
+    """
+    Drop least-recently-used entries (other than key) while the entries
+    table holds more than max_bytes
+    """
+    total = conn.execute('SELECT COALESCE(SUM(nbytes), 0) FROM entries').fetchone()[0]
+    if total <= max_bytes:
+        return
+
+    # Evict down to 90% of the limit so every insert doesn't evict again
+    excess = total - 0.9 * max_bytes
+    victims = []
+    for victim, nbytes in conn.execute('SELECT key, nbytes FROM entries ORDER BY last_used'):
+        if excess <= 0:
+            break
+        if victim != key:
+            victims.append((victim,))
+            excess -= nbytes
+    conn.executemany('DELETE FROM entries WHERE key = ?', victims)
+    conn.commit()
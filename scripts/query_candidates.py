@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Query transit candidates from the results catalog in one streaming pass
+
+Reads the stars of the results catalog (see results_catalog.py; one row
+per star, its strongest detection) or the results database of a single
+run, and keeps only what the answer needs: a heap of the --top strongest
+matches and counts per power threshold and period range. The filters run
+in SQLite, the scan only reads power, period and TIC ID of the matching
+rows, and the full rows of the strongest are looked up at the end, so a
+triage query over a few hundred thousand stars takes well under a second
+and memory does not grow with the catalog.
+
+Usage:
+    python query_candidates.py --top 20
+    python query_candidates.py --period 1:5 --min-power 1e4 --phase ULTRA --top 100
+    python query_candidates.py -s ../results/phase3_ultra_analysis/analysis_results.sqlite \\
+        --tic 123456789 987654321
+"""
+
+import os
+import csv
+import math
+import heapq
+import bisect
+import sqlite3
+import argparse
+
+from results_catalog import CATALOG_DB, create_star_view
+
+# Power thresholds and period ranges (days) counted by default
+POWER_THRESHOLDS = [100, 1000, 10000]
+PERIOD_BINS = [0.5, 1, 2, 5, 10, 20]
+
+# Columns of each returned row
+ROW_COLUMNS = ['target', 'tic_id', 'period', 'power', 'depth', 'duration', 'phase', 'phases',
+               'results_dir']
+
+def parse_range(text):
+    """
+    'low:high' (either side may be empty) -> (low or None, high or None)
+    """
+    low, sep, high = text.partition(':')
+    if not sep:
+        raise ValueError(f"Expected a range like 1:5, got '{text}'")
+    return (float(low) if low else None, float(high) if high else None)
+
+def scan(rows, top=20, period_range=None, min_power=None, max_power=None, tic_ids=None,
+         thresholds=POWER_THRESHOLDS, period_bins=PERIOD_BINS):
+    """
+    Select and count candidates in one pass over rows
+
+    Parameters:
+    -----------
+    rows : iterable of tuple
+        (power, period, tic_id, row) per candidate; row is what 'top'
+        returns for it (e.g. the full record, or a key to look it up)
+    top : int
+        Number of strongest matches to keep (0 = none)
+    period_range : tuple
+        (min, max) period in days; either may be None
+    min_power, max_power : float
+        Transit power limits (None = no limit)
+    tic_ids : collection of int
+        Only these stars (None = any)
+    thresholds : list of float
+        Count matches with power above each
+    period_bins : list of float
+        Count matches in each range between consecutive edges
+
+    Returns:
+        dict with 'matched', 'top' (rows, strongest first), 'above'
+        (threshold -> count) and 'period_counts' (one count per bin)
+    """
+    low, high = period_range or (None, None)
+    low = -math.inf if low is None else low
+    high = math.inf if high is None else high
+    min_power = -math.inf if min_power is None else min_power
+    max_power = math.inf if max_power is None else max_power
+    tic_ids = set(tic_ids) if tic_ids else None
+    heap = []
+    above = [0] * len(thresholds)
+    period_counts = [0] * (len(period_bins) - 1)
+    matched = 0
+
+    for power, period, tic_id, row in rows:
+        if power is None or period is None:
+            continue
+        if not (low <= period <= high and min_power <= power <= max_power):
+            continue
+        if tic_ids is not None and tic_id not in tic_ids:
+            continue
+
+        matched += 1
+        for i, threshold in enumerate(thresholds):
+            if power > threshold:
+                above[i] += 1
+        i = bisect.bisect_right(period_bins, period) - 1
+        if 0 <= i < len(period_counts):
+            period_counts[i] += 1
+
+        if top:
+            # Min-heap of the strongest so far; on equal power the earlier
+            # row wins (-matched is smaller for later rows)
+            if len(heap) < top:
+                heapq.heappush(heap, (power, -matched, row))
+            elif power > heap[0][0]:
+                heapq.heapreplace(heap, (power, -matched, row))
+
+    return {
+        'matched': matched,
+        'top': [row for _, _, row in sorted(heap, key=lambda item: item[:2], reverse=True)],
+        'above': dict(zip(thresholds, above)),
+        'period_counts': period_counts,
+    }
+
+def _has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (name,)).fetchone() is not None
+
+def resolve_phases(conn, patterns):
+    """
+    Catalog phase labels containing any of patterns (case-insensitive)
+    """
+    labels = [row[0] for row in conn.execute('SELECT DISTINCT phase FROM sources')]
+    matched = [label for label in labels
+               if any(p.lower() in label.lower() for p in patterns)]
+    if not matched:
+        raise ValueError(f"No phase matches {', '.join(patterns)} "
+                         f"(catalog has: {', '.join(sorted(labels)) or 'none'})")
+    return matched
+
+def _candidates(conn, phases=None, all_detections=False):
+    # (subquery, arguments) of the candidate rows: ROW_COLUMNS plus 'id',
+    # the rowid of the row; for stars grouped over phases only id (of the
+    # strongest detection), tic_id, period and power
+    if not _has_table(conn, 'detections'):
+        if phases:
+            raise ValueError("--phase needs a results catalog, not a single run's database")
+        return ('SELECT rowid AS id, target, tic_id, period, power, depth, duration, '
+                'NULL AS phase, NULL AS phases, NULL AS results_dir FROM results', [])
+
+    if all_detections or phases:
+        where = ''
+        if phases:
+            where = f"WHERE phase IN ({', '.join('?' * len(phases))})"
+        if all_detections:
+            return (f'SELECT rowid AS id, target, tic_id, period, power, depth, duration, '
+                    f'phase, phase AS phases, results_dir FROM detections {where}', phases or [])
+        # The other columns of a MAX() aggregate come from the row with the
+        # maximum, i.e. each star's strongest detection. Only the scanned
+        # columns, which detections_phase covers (see _fetch_rows)
+        return (f'SELECT rowid AS id, tic_id, period, MAX(power) AS power '
+                f'FROM detections {where} GROUP BY star', phases)
+
+    # Read-only connections cannot add best_detections to older catalogs
+    table = ('best_detections' if _has_table(conn, 'best_detections')
+             else create_star_view(conn))
+    return (f'SELECT rowid AS id, target, tic_id, period, power, depth, duration, phase, '
+            f'phases, results_dir FROM {table}', [])
+
+def _filter_sql(period_range=None, min_power=None, max_power=None, tic_ids=None, **_):
+    # WHERE clause with the filters of scan(), so SQLite skips most rows
+    # before they reach Python (scan still applies them)
+    clauses = ['power IS NOT NULL', 'period IS NOT NULL']
+    args = []
+    low, high = period_range or (None, None)
+    for column, op, value in (('period', '>=', low), ('period', '<=', high),
+                              ('power', '>=', min_power), ('power', '<=', max_power)):
+        if value is not None:
+            clauses.append(f'{column} {op} ?')
+            args.append(value)
+    if tic_ids:
+        clauses.append(f"tic_id IN ({', '.join('?' * len(tic_ids))})")
+        args.extend(tic_ids)
+    return 'WHERE ' + ' AND '.join(clauses), args
+
+def _fetch_rows(conn, ids, phases=None, all_detections=False):
+    # Full ROW_COLUMNS dicts of the candidates with these ids, in that order
+    if not ids:
+        return []
+    marks = ', '.join('?' * len(ids))
+    if phases and not all_detections:
+        # Detections of grouped stars, with the phases of each star
+        query = (f"SELECT d.rowid, d.target, d.tic_id, d.period, d.power, d.depth, d.duration, "
+                 f"d.phase, (SELECT GROUP_CONCAT(DISTINCT phase) FROM detections "
+                 f"WHERE star = d.star AND phase IN ({', '.join('?' * len(phases))})), "
+                 f"d.results_dir FROM detections AS d WHERE d.rowid IN ({marks})")
+        args = [*phases, *ids]
+    else:
+        subquery, args = _candidates(conn, phases, all_detections)
+        query = f"SELECT id, {', '.join(ROW_COLUMNS)} FROM ({subquery}) WHERE id IN ({marks})"
+        args = [*args, *ids]
+    rows = {row[0]: dict(zip(ROW_COLUMNS, row[1:])) for row in conn.execute(query, args)}
+    return [rows[i] for i in ids]
+
+def query_candidates(source, phase_patterns=None, all_detections=False, **filters):
+    """
+    Run one query against a catalog or results database file
+
+    Only power, period and TIC ID of the rows matching the filters are
+    read in the scan; the full rows of the --top strongest are looked up
+    afterwards.
+
+    Parameters:
+    -----------
+    source : str
+        results_catalog.sqlite or a run's analysis_results.sqlite
+    phase_patterns : list of str
+        Keep only phases whose label contains one of these (catalogs only)
+    all_detections : bool
+        Scan every detection instead of one row per star (catalogs only)
+    filters :
+        Passed to scan (top, period_range, min_power, ...)
+
+    Returns:
+        scan() result with 'top' as ROW_COLUMNS dicts and 'total' (number
+        of rows before filtering)
+    """
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"{source} not found (run analyze_results.py to build "
+                                f"the catalog)")
+    conn = sqlite3.connect(f'file:{source}?mode=ro', uri=True)
+    try:
+        phases = resolve_phases(conn, phase_patterns) if phase_patterns else None
+        subquery, args = _candidates(conn, phases, all_detections)
+        where, filter_args = _filter_sql(**filters)
+        rows = conn.execute(f'SELECT power, period, tic_id, id FROM ({subquery}) {where}',
+                            [*args, *filter_args])
+        result = scan(rows, **filters)
+        result['top'] = _fetch_rows(conn, result['top'], phases, all_detections)
+        if phases and not all_detections:
+            # (counting the groups directly would repeat the grouping)
+            subquery = (f"SELECT DISTINCT star FROM detections "
+                        f"WHERE phase IN ({', '.join('?' * len(phases))})")
+        result['total'] = conn.execute(f'SELECT COUNT(*) FROM ({subquery})', args).fetchone()[0]
+        return result
+    finally:
+        conn.close()
+
+def print_report(result, thresholds=POWER_THRESHOLDS, period_bins=PERIOD_BINS):
+    """
+    Print the counts and the top candidates of a scan() result
+    """
+    matched = result['matched']
+    print(f"{result['total']:,} rows, {matched:,} match the filters")
+    if matched:
+        for threshold in thresholds:
+            count = result['above'][threshold]
+            print(f"  Power > {threshold:,g}: {count:,} ({count / matched * 100:.1f}%)")
+        print("  By period:")
+        for i, count in enumerate(result['period_counts']):
+            print(f"    {period_bins[i]:g}-{period_bins[i + 1]:g} d: {count:,}")
+    print()
+
+    if not result['top']:
+        return
+    print(f"TOP {len(result['top'])} CANDIDATES")
+    print(f"{'Rank':<5} {'Target':<24} {'Period':<12} {'Power':<15} {'Phase':<20}")
+    print("-" * 78)
+    for rank, row in enumerate(result['top'], 1):
+        phase = row['phase'] or ''
+        if row['phases']:
+            others = len(set(row['phases'].split(','))) - 1
+            if others:
+                phase += f" (+{others})"
+        print(f"{rank:<5} {row['target']:<24} {row['period']:>8.4f} d  {row['power']:>12,.1f}  "
+              f"{phase:<20}")
+
+def write_csv(rows, csv_path):
+    """
+    Write selected candidate rows (ROW_COLUMNS) to CSV
+    """
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(ROW_COLUMNS)
+        for row in rows:
+            writer.writerow([row[c] for c in ROW_COLUMNS])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query transit candidates from the results catalog')
+    parser.add_argument('-s', '--source', type=str, default=os.path.join('../results', CATALOG_DB),
+                        help=f'Results catalog or a run\'s analysis_results.sqlite '
+                             f'(default: ../results/{CATALOG_DB})')
+    parser.add_argument('--top', type=int, default=20,
+                        help='Number of strongest matches to list (default: 20)')
+    parser.add_argument('--period', type=parse_range, default=None, metavar='MIN:MAX',
+                        help='Period range in days, e.g. 1:5, 10: or :2')
+    parser.add_argument('--min-power', type=float, default=None,
+                        help='Minimum transit power')
+    parser.add_argument('--max-power', type=float, default=None,
+                        help='Maximum transit power')
+    parser.add_argument('--phase', type=str, action='append', default=None,
+                        help='Only phases whose label contains this, e.g. ULTRA (repeatable)')
+    parser.add_argument('--tic', type=int, nargs='+', default=None,
+                        help='Only these TIC IDs')
+    parser.add_argument('--all-detections', action='store_true',
+                        help='Every detection instead of one row per star')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=POWER_THRESHOLDS,
+                        help='Power thresholds to count matches above (default: 100 1000 10000)')
+    parser.add_argument('--period-bins', type=float, nargs='+', default=PERIOD_BINS,
+                        help='Period bin edges in days to count matches in '
+                             '(default: 0.5 1 2 5 10 20)')
+    parser.add_argument('--csv', type=str, default=None,
+                        help='Also write the listed candidates to this CSV file')
+
+    args = parser.parse_args()
+    if len(args.period_bins) < 2:
+        parser.error('--period-bins needs at least two edges')
+
+    try:
+        result = query_candidates(args.source, args.phase, args.all_detections, top=args.top,
+                                  period_range=args.period, min_power=args.min_power,
+                                  max_power=args.max_power, tic_ids=args.tic,
+                                  thresholds=sorted(args.thresholds),
+                                  period_bins=sorted(args.period_bins))
+    except (FileNotFoundError, ValueError) as e:
+        parser.error(str(e))
+    print_report(result, sorted(args.thresholds), sorted(args.period_bins))
+    if args.csv:
+        write_csv(result['top'], args.csv)
+        print(f"\nWrote {len(result['top'])} candidates to {args.csv}")
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Render analysis plots for selected candidates of a finished run
+
+analyze_tess_transits.py --no-plots skips the two PNGs per star, which
+for a survey of tens of thousands of stars are most of the output and a
+large share of the run time, although only the strongest candidates are
+ever looked at. This script picks those candidates from the run's
+analysis_results.sqlite (top-N by power, a power threshold and/or a list
+of TIC IDs) and re-analyzes just them with the recorded run parameters,
+this time saving the plots. The search is deterministic, so the plots
+show exactly the recorded detection; with the run's --preprocess-cache
+the cleaned light curves are read back instead of prepared again.
+
+Usage:
+    python render_plots.py -r ../results/phase3_ultra_analysis \\
+        -d ../data/tess_random_ultra_70k --top 50 --workers 4
+"""
+
+import os
+import sqlite3
+import argparse
+
+import numpy as np
+
+from results_store import RESULTS_DB, load_run_params
+import analyze_tess_transits as att
+from lightcurve_archive import sector_stem
+
+# Parameters run_parameters() records from module constants; the rendered
+# search only matches the recorded one if they are unchanged
+CONSTANT_PARAMS = {
+    'outlier_sigma': att.OUTLIER_SIGMA,
+    'flatten_window': att.FLATTEN_WINDOW,
+    'period_min': att.PERIOD_MIN,
+    'period_max': att.PERIOD_MAX,
+    'period_step': att.PERIOD_STEP,
+}
+
+PLOT_SUFFIXES = ('_analysis.png', '_folded.png')
+
+def select_candidates(db_path, top=None, min_power=None, tic_ids=None):
+    """
+    Results rows to render, strongest first
+
+    Parameters:
+    -----------
+    db_path : str
+        Results database of the run
+    top : int
+        Keep only the N strongest of the selected targets (None = all)
+    min_power : float
+        Keep targets with at least this transit power (None = any)
+    tic_ids : list of int
+        Keep only these stars (None = any)
+
+    Returns:
+        list of dicts with 'target', 'tic_id', 'period' and 'power'
+    """
+    where = []
+    args = []
+    if min_power is not None:
+        where.append('power >= ?')
+        args.append(min_power)
+    if tic_ids:
+        where.append(f"tic_id IN ({', '.join('?' * len(tic_ids))})")
+        args.extend(tic_ids)
+    query = 'SELECT target, tic_id, period, power FROM results'
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += ' ORDER BY power DESC'
+    if top is not None:
+        query += ' LIMIT ?'
+        args.append(top)
+
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        return [dict(zip(('target', 'tic_id', 'period', 'power'), row))
+                for row in conn.execute(query, args)]
+    finally:
+        conn.close()
+
+def search_options(params, plot_backend=None):
+    """
+    analyze_lightcurve/analyze_sectors options that reproduce a recorded
+    run, with plots (drawn by plot_backend; None = the run's backend)
+    """
+    changed = [k for k, v in CONSTANT_PARAMS.items() if k in params and params[k] != v]
+    if changed:
+        raise ValueError(f"Run was analyzed with different {', '.join(changed)} than "
+                         f"analyze_tess_transits.py now uses; plots would not match its results")
+    options = {k: v for k, v in params.items() if k not in CONSTANT_PARAMS}
+    options['plots'] = True
+    if plot_backend is not None:
+        options['plot_backend'] = plot_backend
+    return options
+
+def find_inputs(data_dir, multi_sector=False):
+    """
+    Map target name -> input (a path, or a tuple of sector paths with
+    multi_sector) for the light curves in data_dir
+    """
+    inputs = att.list_inputs(data_dir)
+    if multi_sector:
+        return {sector_stem(group[0])[0]: group for group in att.group_sectors(inputs)}
+    return {os.path.basename(path).replace('.fits', ''): path for path in inputs}
+
+def render_plots(results_dir, data_dir, output_dir=None, top=None, min_power=None,
+                 tic_ids=None, workers=1, force=False, plot_backend=None):
+    """
+    Render the plots of the selected candidates of one analysis run
+
+    Parameters:
+    -----------
+    results_dir : str
+        Output directory of the run (holds analysis_results.sqlite; merge
+        sharded runs with merge_analysis_shards.py first)
+    data_dir : str
+        The run's --data-dir
+    output_dir : str
+        Where to write the PNGs (default: results_dir)
+    top, min_power, tic_ids :
+        Candidate selection (see select_candidates)
+    workers : int
+        Number of worker processes
+    force : bool
+        Render targets whose plots already exist again
+    plot_backend : str
+        analyze_tess_transits.PLOT_BACKENDS entry (None = the run's)
+
+    Returns:
+        Number of targets rendered
+    """
+    db_path = os.path.join(results_dir, RESULTS_DB)
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"No {RESULTS_DB} in {results_dir}")
+    output_dir = output_dir or results_dir
+    os.makedirs(output_dir, exist_ok=True)
+
+    options = search_options(load_run_params(db_path), plot_backend)
+    candidates = select_candidates(db_path, top, min_power, tic_ids)
+    print(f"Selected {len(candidates)} candidates from {db_path}")
+
+    inputs = find_inputs(data_dir, options.get('multi_sector', False))
+    tasks = []
+    recorded = {}
+    for candidate in candidates:
+        target = candidate['target']
+        if not force and all(os.path.exists(os.path.join(output_dir, target + suffix))
+                             for suffix in PLOT_SUFFIXES):
+            continue
+        if target not in inputs:
+            print(f"  {target}: no light curve in {data_dir}, skipping")
+            continue
+        recorded[target] = candidate
+        tasks.append((len(tasks), inputs[target], output_dir, options))
+
+    if len(tasks) < len(candidates):
+        print(f"{len(candidates) - len(tasks)} candidates already plotted or missing")
+    if not tasks:
+        return 0
+
+    workers = max(1, min(workers, len(tasks)))
+    print(f"Rendering {len(tasks)} targets with {workers} worker process(es)")
+
+    rendered = 0
+    for _, fits_file, result, error in att._iter_results(tasks, workers):
+        if error is not None:
+            print(f"Error rendering {fits_file}: {error}")
+            continue
+        rendered += 1
+        expected = recorded[result['target']]
+        if not np.isclose(result['period'], expected['period'], rtol=1e-9, atol=0):
+            print(f"  Warning: {result['target']} now peaks at {result['period']:.4f} days, "
+                  f"the run recorded {expected['period']:.4f} days")
+
+    print(f"\nRendered plots for {rendered} targets in {output_dir}")
+    return rendered
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Render analysis plots for selected candidates of a --no-plots run')
+    parser.add_argument('-r', '--results-dir', type=str, required=True,
+                        help='Output directory of the analysis run')
+    parser.add_argument('-d', '--data-dir', type=str, required=True,
+                        help='Data directory (or archive) the run analyzed')
+    parser.add_argument('-o', '--output-dir', type=str, default=None,
+                        help='Directory for the PNGs (default: --results-dir)')
+    parser.add_argument('--top', type=int, default=None,
+                        help='Render the N strongest candidates (after the other filters)')
+    parser.add_argument('--min-power', type=float, default=None,
+                        help='Render candidates with at least this transit power')
+    parser.add_argument('--tic', type=int, nargs='+', default=None,
+                        help='Render these TIC IDs')
+    parser.add_argument('-w', '--workers', type=int, default=att.default_workers(),
+                        help='Number of worker processes '
+                             '(default: $SLURM_CPUS_PER_TASK, or 1 outside SLURM)')
+    parser.add_argument('--force', action='store_true',
+                        help='Render again even if both plots of a target exist')
+    parser.add_argument('--plot-backend', choices=att.PLOT_BACKENDS, default=None,
+                        help='Plot renderer (default: the run\'s --plot-backend); fast '
+                             'pays off from a few dozen plots per worker')
+
+    args = parser.parse_args()
+    if args.top is None and args.min_power is None and args.tic is None:
+        parser.error('select candidates with --top, --min-power and/or --tic')
+
+    render_plots(args.results_dir, args.data_dir, args.output_dir, args.top, args.min_power,
+                 args.tic, args.workers, args.force, args.plot_backend)
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Incremental catalog of transit detections across analysis runs
+
+Every phase of the survey writes its own analysis_results.sqlite (or, for
+older runs, analysis_summary.txt). The catalog is one SQLite file (e.g.
+../results/results_catalog.sqlite) that collects the detections of any
+number of such outputs:
+
+    sources     One row per ingested results file: path, phase label,
+                size/mtime and SHA-256 checksum, number of detections
+    detections  Every result row of every source, with its phase and
+                results directory (provenance)
+
+    best_detections
+                One row per star over all phases (see below), kept up to
+                date by ingest for the stars of each changed source
+
+Ingesting a directory again only reads files whose checksum changed
+(size and mtime are checked first, so unchanged files are not even
+hashed). Sources a directory no longer has - e.g. shard databases after
+merge_analysis_shards.py - are dropped with their detections.
+
+Stars seen in several phases are deduplicated on export: one row per TIC
+ID (per target name where there is none), the strongest detection, plus
+the phases the star was seen in and the number of detections.
+"""
+
+import os
+import csv
+import time
+import hashlib
+import sqlite3
+from glob import glob
+
+from results_store import RESULTS_DB, RESULT_COLUMNS, find_shard_dbs, tic_from_name
+
+CATALOG_DB = 'results_catalog.sqlite'
+
+# Seconds to wait for another process's write lock
+LOCK_TIMEOUT = 120
+
+# Detections inserted per executemany call
+INSERT_BATCH = 10000
+
+RESULT_NAMES = [name for name, _ in RESULT_COLUMNS]
+
+# Columns of the star rows (best_detections and create_star_view)
+STAR_COLUMNS = ['source', 'phase', 'results_dir', 'star', *RESULT_NAMES, 'phases',
+                'n_detections']
+
+# Catalog column -> column name in the exported CSV/Parquet (the names
+# analyze_results.py has always written)
+EXPORT_COLUMNS = [
+    ('target', 'TIC_ID'),
+    ('tic_id', 'tic_id'),
+    ('sector', 'sector'),
+    ('n_points', 'data_points'),
+    ('period', 'period_days'),
+    ('power', 'transit_power'),
+    ('depth', 'depth'),
+    ('duration', 'duration_days'),
+    ('transit_time', 'transit_time'),
+    ('phase', 'phase'),
+    ('phases', 'phases'),
+    ('n_detections', 'n_detections'),
+    ('results_dir', 'results_dir'),
+]
+
+SUMMARY_FIELDS = {
+    'Data points:': ('n_points', int),
+    'Best period:': ('period', float),
+    'Transit power:': ('power', float),
+}
+
+def open_results_catalog(catalog_path):
+    """
+    Open (creating if needed) a results catalog database
+    """
+    os.makedirs(os.path.dirname(catalog_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(catalog_path, timeout=LOCK_TIMEOUT)
+    conn.execute('CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, phase TEXT, '
+                 'results_dir TEXT, size INTEGER, mtime REAL, checksum TEXT, n_rows INTEGER, '
+                 'ingested REAL)')
+    columns = ', '.join(f'{name} {sql_type.replace(" PRIMARY KEY", "")}'
+                        for name, sql_type in RESULT_COLUMNS)
+    conn.execute(f'CREATE TABLE IF NOT EXISTS detections (source TEXT, phase TEXT, '
+                 f'results_dir TEXT, star TEXT, {columns}, PRIMARY KEY (source, target))')
+    conn.execute('CREATE INDEX IF NOT EXISTS detections_star ON detections (star, power)')
+    conn.execute('CREATE INDEX IF NOT EXISTS detections_power ON detections (power)')
+    # Covers the per-phase star queries of query_candidates.py
+    conn.execute('CREATE INDEX IF NOT EXISTS detections_phase '
+                 'ON detections (phase, star, power, period, tic_id)')
+    conn.execute(f'CREATE TABLE IF NOT EXISTS best_detections (source TEXT, phase TEXT, '
+                 f'results_dir TEXT, star TEXT PRIMARY KEY, {columns}, phases TEXT, '
+                 f'n_detections INTEGER)')
+    conn.execute('CREATE INDEX IF NOT EXISTS best_detections_power ON best_detections (power)')
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS changed_stars (star TEXT PRIMARY KEY)')
+
+    # Catalogs written before best_detections existed
+    if conn.execute('SELECT EXISTS (SELECT 1 FROM detections) '
+                    'AND NOT EXISTS (SELECT 1 FROM best_detections)').fetchone()[0]:
+        with conn:
+            conn.execute('INSERT INTO temp.changed_stars SELECT DISTINCT star FROM detections')
+            _refresh_best_detections(conn)
+    return conn
+
+def file_checksum(path, chunk_size=1 << 20):
+    """
+    SHA-256 of a file's contents, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def find_sources(results_dir):
+    """
+    Results files of one analysis output directory
+
+    The merged (or unsharded) results database if there is one, otherwise
+    the shard databases, otherwise the text summaries of older runs.
+    """
+    db_path = os.path.join(results_dir, RESULTS_DB)
+    if os.path.exists(db_path):
+        return [db_path]
+    shard_dbs = find_shard_dbs(results_dir)
+    if shard_dbs:
+        return shard_dbs
+    summary = os.path.join(results_dir, 'analysis_summary.txt')
+    if os.path.exists(summary):
+        return [summary]
+    return sorted(glob(os.path.join(results_dir, 'analysis_summary.shard-*-of-*.txt')))
+
+def iter_summary(summary_file):
+    """
+    Yield one result dict (RESULT_COLUMNS keys) per target of an
+    analysis_summary.txt, reading the file line by line
+    """
+    record = None
+    with open(summary_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('Target: '):
+                if record is not None:
+                    yield record
+                record = dict.fromkeys(RESULT_NAMES)
+                record['target'] = line[len('Target: '):]
+                record['tic_id'] = tic_from_name(record['target'])
+                continue
+            if record is None:
+                continue
+            for prefix, (name, convert) in SUMMARY_FIELDS.items():
+                if line.startswith(prefix):
+                    try:
+                        record[name] = convert(line[len(prefix):].split()[0])
+                    except (ValueError, IndexError):
+                        pass
+    if record is not None:
+        yield record
+
+def iter_source(path):
+    """
+    Yield the result dicts of one results database or text summary
+    """
+    if not path.endswith('.sqlite'):
+        yield from iter_summary(path)
+        return
+
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        for row in conn.execute(f"SELECT {', '.join(RESULT_NAMES)} FROM results"):
+            record = dict(zip(RESULT_NAMES, row))
+            if record['tic_id'] is None:
+                record['tic_id'] = tic_from_name(record['target'])
+            yield record
+    finally:
+        conn.close()
+
+def _detection_rows(path, phase, results_dir):
+    for record in iter_source(path):
+        star = str(record['tic_id']) if record['tic_id'] is not None else record['target']
+        yield (path, phase, results_dir, star, *(record[name] for name in RESULT_NAMES))
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _mark_changed(conn, path):
+    conn.execute('INSERT OR IGNORE INTO temp.changed_stars '
+                 'SELECT star FROM detections WHERE source = ?', (path,))
+
+def _refresh_best_detections(conn):
+    # Recompute the star rows of the stars marked changed (in the caller's
+    # transaction, so they never disagree with the detections)
+    changed = 'WHERE star IN (SELECT star FROM temp.changed_stars)'
+    conn.execute(f'DELETE FROM best_detections {changed}')
+    conn.execute(f"INSERT INTO best_detections SELECT {', '.join(STAR_COLUMNS)} "
+                 f"FROM ({_star_select(changed)})")
+    conn.execute('DELETE FROM temp.changed_stars')
+
+def ingest(conn, results_dir, phase):
+    """
+    Add the results of one analysis output directory to the catalog
+
+    Parameters:
+    -----------
+    conn : sqlite3.Connection
+        Open catalog (open_results_catalog)
+    results_dir : str
+        Output directory of an analysis run (or of all its shards)
+    phase : str
+        Label recorded with its detections (e.g. 'Phase3_ULTRA')
+
+    Returns:
+        (number of sources read, number of detections read); both 0 when
+        nothing changed since the last ingest
+    """
+    results_dir = os.path.abspath(results_dir)
+    paths = [os.path.abspath(p) for p in find_sources(results_dir)]
+    known = {row[0]: row[1:] for row in conn.execute(
+        'SELECT path, phase, size, mtime, checksum FROM sources WHERE results_dir = ?',
+        (results_dir,))}
+
+    # Sources the directory no longer has (e.g. shards merged since)
+    for path in set(known) - set(paths):
+        _mark_changed(conn, path)
+        conn.execute('DELETE FROM detections WHERE source = ?', (path,))
+        conn.execute('DELETE FROM sources WHERE path = ?', (path,))
+    _refresh_best_detections(conn)
+    conn.commit()
+
+    n_sources = 0
+    n_rows = 0
+    for path in paths:
+        stat = os.stat(path)
+        previous = known.get(path)
+        if previous is not None:
+            old_phase, size, mtime, checksum = previous
+            unchanged = (size, mtime) == (stat.st_size, stat.st_mtime)
+            if not unchanged and file_checksum(path) == checksum:
+                # Touched but not modified
+                conn.execute('UPDATE sources SET size = ?, mtime = ? WHERE path = ?',
+                             (stat.st_size, stat.st_mtime, path))
+                unchanged = True
+            if unchanged:
+                if old_phase != phase:
+                    conn.execute('UPDATE sources SET phase = ? WHERE path = ?', (phase, path))
+                    conn.execute('UPDATE detections SET phase = ? WHERE source = ?',
+                                 (phase, path))
+                    _mark_changed(conn, path)
+                    _refresh_best_detections(conn)
+                conn.commit()
+                continue
+
+        # New or modified: replace its detections in one transaction
+        checksum = file_checksum(path)
+        placeholders = ', '.join('?' * (4 + len(RESULT_NAMES)))
+        count = 0
+        with conn:
+            _mark_changed(conn, path)
+            conn.execute('DELETE FROM detections WHERE source = ?', (path,))
+            for batch in _batches(_detection_rows(path, phase, results_dir), INSERT_BATCH):
+                conn.executemany(f'INSERT OR REPLACE INTO detections VALUES ({placeholders})',
+                                 batch)
+                count += len(batch)
+            conn.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (path, phase, results_dir, stat.st_size, stat.st_mtime, checksum,
+                          count, time.time()))
+            _mark_changed(conn, path)
+            _refresh_best_detections(conn)
+        n_sources += 1
+        n_rows += count
+    return n_sources, n_rows
+
+def _phase_filter(conn, phases, name):
+    # Views can't take ? parameters, so the phases go into a temp table
+    # the view reads
+    table = f'{name}_phases'
+    with conn:
+        conn.execute(f'CREATE TEMP TABLE IF NOT EXISTS {table} (phase TEXT PRIMARY KEY)')
+        conn.execute(f'DELETE FROM temp.{table}')
+        conn.executemany(f'INSERT OR IGNORE INTO temp.{table} VALUES (?)',
+                         [(phase,) for phase in phases])
+    return f'WHERE phase IN (SELECT phase FROM temp.{table})'
+
+def _covers_catalog(conn, phases):
+    # True if phases include every phase ingested so far
+    ingested = {row[0] for row in conn.execute('SELECT DISTINCT phase FROM sources')}
+    return ingested <= set(phases)
+
+def _star_select(where):
+    # One row per star of the detections matching where: the strongest
+    # (ties: first phase, then target name), its phases and detection count
+    return f"""
+        SELECT ranked.*, seen.phases, seen.n_detections FROM
+            (SELECT *, ROW_NUMBER() OVER (PARTITION BY star
+                                          ORDER BY power DESC, phase, target) AS rank
+             FROM detections {where}) AS ranked
+        JOIN (SELECT star, GROUP_CONCAT(DISTINCT phase) AS phases, COUNT(*) AS n_detections
+              FROM detections {where} GROUP BY star) AS seen USING (star)
+        WHERE ranked.rank = 1
+    """
+
+def create_star_view(conn, phases=None, name='stars'):
+    """
+    Create a temporary view with one row per star (strongest detection)
+
+    Columns are STAR_COLUMNS: those of the detections table plus 'phases'
+    (the phases the star was seen in, comma-separated) and 'n_detections'.
+    phases limits the view to detections of those phases (None = all).
+    When they cover the whole catalog the view reads best_detections;
+    otherwise it ranks the detections of those phases.
+    """
+    conn.execute(f'DROP VIEW IF EXISTS temp.{name}')
+    if phases is None or _covers_catalog(conn, phases):
+        conn.execute(f'CREATE TEMP VIEW {name} AS SELECT * FROM best_detections')
+    else:
+        where = _phase_filter(conn, phases, name)
+        conn.execute(f'CREATE TEMP VIEW {name} AS {_star_select(where)}')
+    return name
+
+def _export_rows(conn, view):
+    names = [name for name, _ in EXPORT_COLUMNS]
+    cursor = conn.execute(f"SELECT {', '.join(names)} FROM {view} "
+                          f"ORDER BY power DESC, target")
+    phases_index = names.index('phases')
+    for row in cursor:
+        row = list(row)
+        row[phases_index] = ','.join(sorted(row[phases_index].split(',')))
+        yield row
+
+def export_csv(conn, csv_path, phases=None):
+    """
+    Write the deduplicated stars to CSV, strongest first, in one pass
+
+    Returns:
+        Number of rows written
+    """
+    view = create_star_view(conn, phases)
+    count = 0
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([header for _, header in EXPORT_COLUMNS])
+        for row in _export_rows(conn, view):
+            writer.writerow(row)
+            count += 1
+    return count
+
+def export_parquet(conn, parquet_path, phases=None, batch_size=50000):
+    """
+    Write the deduplicated stars to Parquet (needs pyarrow), in batches
+
+    Returns:
+        Number of rows written
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    schema = pa.schema([
+        ('TIC_ID', pa.string()), ('tic_id', pa.int64()), ('sector', pa.int64()),
+        ('data_points', pa.int64()), ('period_days', pa.float64()),
+        ('transit_power', pa.float64()), ('depth', pa.float64()),
+        ('duration_days', pa.float64()), ('transit_time', pa.float64()),
+        ('phase', pa.string()), ('phases', pa.string()), ('n_detections', pa.int64()),
+        ('results_dir', pa.string()),
+    ])
+    view = create_star_view(conn, phases)
+    count = 0
+    with pq.ParquetWriter(parquet_path, schema) as writer:
+        for batch in _batches(_export_rows(conn, view), batch_size):
+            columns = list(zip(*batch))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema))
+            count += len(batch)
+    return count
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Typed results store for transit analysis runs
+
+Results are kept in a single-file SQLite database (analysis_results.sqlite)
+next to the plots, so downstream scripts can load them with one query
+instead of re-parsing analysis_summary.txt. SQLite ships with Python, so no
+extra packages are needed on Beocat.
+
+Tables:
+    results       One row per analyzed target
+    coarse_peaks  Coarse-stage periodogram peaks of coarse-to-fine runs
+    run_params    Key/value parameters of the run that produced the results
+"""
+
+import os
+import re
+import json
+import sqlite3
+from glob import glob
+
+RESULTS_DB = 'analysis_results.sqlite'
+
+# Column name -> SQLite type, in table order
+RESULT_COLUMNS = [
+    ('target', 'TEXT PRIMARY KEY'),
+    ('tic_id', 'INTEGER'),
+    ('sector', 'INTEGER'),
+    ('n_points', 'INTEGER'),
+    ('period', 'REAL'),
+    ('power', 'REAL'),
+    ('depth', 'REAL'),
+    ('duration', 'REAL'),
+    ('transit_time', 'REAL'),
+]
+
+TIC_PATTERN = re.compile(r'TIC_?(\d+)')
+
+def results_db_filename(shard_index=0, num_shards=1):
+    """
+    Name of the results database written by one run (or one shard of a run)
+    """
+    if num_shards == 1:
+        return RESULTS_DB
+    return f'analysis_results.shard-{shard_index:04d}-of-{num_shards:04d}.sqlite'
+
+def tic_from_name(name):
+    """
+    Extract the TIC ID from a target/file name such as TIC_123 or TOI_45_TIC_123
+    """
+    match = TIC_PATTERN.search(name)
+    return int(match.group(1)) if match else None
+
+def _create_tables(conn):
+    columns = ', '.join(f'{name} {sql_type}' for name, sql_type in RESULT_COLUMNS)
+    conn.execute(f'CREATE TABLE IF NOT EXISTS results ({columns})')
+    conn.execute('CREATE TABLE IF NOT EXISTS coarse_peaks (target TEXT, rank INTEGER, '
+                 'period REAL, power REAL, PRIMARY KEY (target, rank))')
+    conn.execute('CREATE TABLE IF NOT EXISTS run_params (key TEXT PRIMARY KEY, value TEXT)')
+    conn.execute('CREATE INDEX IF NOT EXISTS results_power ON results (power)')
+    conn.execute('CREATE INDEX IF NOT EXISTS results_tic ON results (tic_id)')
+
+def write_results(db_path, results, run_params=None):
+    """
+    Write a complete set of results, replacing any previous contents
+
+    The database is built under a temporary name and renamed into place, so
+    readers never see a half-written file.
+
+    Parameters:
+    -----------
+    db_path : str
+        Path of the SQLite file to write
+    results : list of dict
+        Results as returned by analyze_lightcurve
+    run_params : dict
+        Analysis parameters to record with the results
+    """
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        _create_tables(conn)
+        names = [name for name, _ in RESULT_COLUMNS]
+        placeholders = ', '.join('?' for _ in names)
+        rows = []
+        peaks = []
+        for r in results:
+            row = dict(r)
+            if row.get('tic_id') is None:
+                row['tic_id'] = tic_from_name(row['target'])
+            rows.append(tuple(row.get(name) for name in names))
+            for rank, (period, power) in enumerate(row.get('coarse_peaks') or []):
+                peaks.append((row['target'], rank, period, power))
+        conn.executemany(f'INSERT OR REPLACE INTO results ({", ".join(names)}) '
+                         f'VALUES ({placeholders})', rows)
+        conn.executemany('INSERT OR REPLACE INTO coarse_peaks VALUES (?, ?, ?, ?)', peaks)
+        if run_params:
+            conn.executemany('INSERT OR REPLACE INTO run_params VALUES (?, ?)',
+                             [(k, json.dumps(v)) for k, v in run_params.items()])
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, db_path)
+
+def merge_results(db_path, source_paths):
+    """
+    Combine several results databases (e.g. shards) into db_path
+
+    Targets already present keep their first row.
+
+    Returns:
+        Number of result rows in the merged database
+    """
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        _create_tables(conn)
+        names = ', '.join(name for name, _ in RESULT_COLUMNS)
+        for source in source_paths:
+            conn.execute('ATTACH DATABASE ? AS src', (source,))
+            conn.execute(f'INSERT OR IGNORE INTO results ({names}) SELECT {names} FROM src.results')
+            # Databases written before coarse-to-fine searches have no peaks table
+            if conn.execute("SELECT 1 FROM src.sqlite_master WHERE name = 'coarse_peaks'").fetchone():
+                conn.execute('INSERT OR IGNORE INTO coarse_peaks SELECT * FROM src.coarse_peaks')
+            conn.execute('INSERT OR IGNORE INTO run_params SELECT * FROM src.run_params')
+            conn.commit()
+            conn.execute('DETACH DATABASE src')
+        count = conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, db_path)
+    return count
+
+def find_shard_dbs(output_dir):
+    """
+    Shard results databases in output_dir, in shard order
+    """
+    return sorted(glob(os.path.join(output_dir, 'analysis_results.shard-*-of-*.sqlite')))
+
+def load_results(db_path):
+    """
+    Load a results database into a DataFrame
+
+    Returns:
+        DataFrame with one row per target (columns as RESULT_COLUMNS)
+    """
+    import pandas as pd
+
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        return pd.read_sql_query('SELECT * FROM results ORDER BY target', conn)
+    finally:
+        conn.close()
+
+def load_run_params(db_path):
+    """
+    Load the run parameters recorded with a results database
+    """
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        return {k: json.loads(v) for k, v in conn.execute('SELECT key, value FROM run_params')}
+    finally:
+        conn.close()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of per-sector BLS statistics for multi-sector searches
+
+With --multi-sector the analyzer searches all sectors of a star together
+by adding up each sector's phase-binned BLS sums (bls_engine
+.sector_statistics). Those sums depend only on the sector's light curve
+and the trial grid, so they are kept in one SQLite file (e.g.
+../cache/sector_stats.sqlite). When TESS revisits a field, re-analyzing
+the star folds only the new sector and reads the old ones from here.
+
+Entries are keyed by the input file's preprocessing cache key (SHA-256 of
+its contents plus the cleaning parameters) and the search parameters,
+including a digest of the trial periods. The grid of a star changes only
+when its planned baseline doubles (see analyze_tess_transits.py), so most
+new sectors reuse the cached ones.
+
+The binned sums are stored as little-endian float32. Searches with the
+cache enabled always combine these float32 sums, hit or miss, so a rerun
+gives exactly the same results as the run that filled the cache. An entry
+holds ~8 bytes per phase bin: ~20 MB per sector for the ofir grid of a
+one-sector baseline at the default oversampling, ~300 MB for the fixed
+grid. Least-recently-used entries are dropped above the size limit.
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+import numpy as np
+
+from preprocess_cache import cache_key, evict
+
+# Bump when the stored layout or bls_engine.sector_statistics changes meaning
+STATS_VERSION = 1
+
+DEFAULT_MAX_GB = 20.0
+
+# Seconds to wait for another process's write lock
+LOCK_TIMEOUT = 120
+
+META_KEYS = ['oversample', 'bin_duration', 'epoch', 'sum_y', 'sum_ivar', 'n_points',
+             'time_min', 'time_max']
+
+def grid_digest(periods, durations):
+    """
+    SHA-256 of a trial grid (periods and durations as float64)
+    """
+    digest = hashlib.sha256()
+    digest.update(np.asarray(periods, dtype='<f8').tobytes())
+    digest.update(np.asarray(durations, dtype='<f8').tobytes())
+    return digest.hexdigest()
+
+def stats_key(fits_file, preprocess_params, search_params):
+    """
+    Cache key of one sector's statistics
+
+    Parameters:
+    -----------
+    fits_file : str
+        Input light curve (file or archive entry)
+    preprocess_params : dict
+        Cleaning parameters (analyze_tess_transits.preprocess_parameters)
+    search_params : dict
+        Everything else the statistics depend on: grid digest, oversample,
+        epoch and whether flux errors were used as weights
+    """
+    payload = json.dumps({'version': STATS_VERSION,
+                          'input': cache_key(fits_file, preprocess_params),
+                          'search': search_params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def open_stats_cache(cache_path):
+    """
+    Open (creating if needed) a sector statistics cache database
+    """
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(cache_path, timeout=LOCK_TIMEOUT)
+    conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, '
+                 'y_ivar BLOB, ivar BLOB, meta TEXT, nbytes INTEGER, last_used REAL)')
+    conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+    return conn
+
+def compact(stats):
+    """
+    Round sector statistics through the cache's float32 layout
+
+    Returns:
+        (statistics with float32-exact binned sums, row tuple for the
+        entries table without key/last_used)
+    """
+    y_ivar = np.asarray(stats['y_ivar'], dtype='<f4')
+    ivar = np.asarray(stats['ivar'], dtype='<f4')
+    meta = {k: stats[k] for k in META_KEYS}
+    row = (y_ivar.tobytes(), ivar.tobytes(), json.dumps(meta), y_ivar.nbytes + ivar.nbytes)
+    return _expand(stats['period'], stats['durations'], y_ivar, ivar, meta), row
+
+def _expand(periods, durations, y_ivar, ivar, meta):
+    stats = {
+        'period': periods,
+        'durations': durations,
+        'y_ivar': y_ivar.astype(np.float64),
+        'ivar': ivar.astype(np.float64),
+    }
+    stats.update(meta)
+    return stats
+
+def load_stats(conn, key, periods, durations):
+    """
+    Cached statistics for key on the given grid, or None on a miss
+    """
+    row = conn.execute('SELECT y_ivar, ivar, meta FROM entries WHERE key = ?',
+                       (key,)).fetchone()
+    if row is None:
+        return None
+
+    conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+    conn.commit()
+
+    return _expand(np.asarray(periods, dtype=np.float64), np.asarray(durations, dtype=np.float64),
+                   np.frombuffer(row[0], dtype='<f4'), np.frombuffer(row[1], dtype='<f4'),
+                   json.loads(row[2]))
+
+def store_stats(conn, key, row, max_bytes):
+    """
+    Insert one entry (row from compact()) and evict LRU entries above max_bytes
+    """
+    conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                 (key, *row, time.time()))
+    conn.commit()
+    evict(conn, key, max_bytes)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Slim light-curve FITS files: only the columns the analyzer reads
+
+lc.to_fits() writes every SPOC column. Downloads kept as loose files (not
+in a lightcurve_archive.py archive) can be slimmed instead: --slim in the
+downloaders, or this script for a directory already downloaded. Only time,
+flux, flux error and quality (plus TIC ID and sector) are written, as a
+minimal FITS file gzip-compressed but still named TIC_123.fits. fits_loader and lk.read()
+both detect the compression, so the analyzer reads it like any other file.
+Flux is stored as float32 unless rounding would move a value by more than
+1% of the typical flux error, and every slim file is read back and
+compared before it replaces anything. Usage:
+
+    python slim_fits.py -d ../data/tess_phase3_ultra
+"""
+
+import io
+import os
+import gzip
+import argparse
+from glob import glob
+
+import numpy as np
+from astropy.io import fits
+
+from fits_loader import read_lightcurve
+
+# Slim files: flux is stored as float32 only if rounding changes no value
+# by more than this fraction of the median flux error
+SLIM_FLUX_TOLERANCE = 0.01
+SLIM_COMPRESSLEVEL = 6
+
+def write_fits(fits_file, raw):
+    """
+    Write light-curve arrays (fits_loader.read_lightcurve's format) as a
+    FITS file that both fits_loader and lk.read() accept
+    """
+    primary = fits.PrimaryHDU()
+    primary.header['TELESCOP'] = 'TESS'
+    primary.header['ORIGIN'] = 'Unofficial data product'
+    primary.header['CREATOR'] = 'lightcurve_archive'
+    if raw['tic_id'] is not None:
+        primary.header['TICID'] = raw['tic_id']
+        primary.header['OBJECT'] = f"TIC {raw['tic_id']}"
+    if raw['sector'] is not None:
+        primary.header['SECTOR'] = raw['sector']
+
+    flux_format = 'D' if raw['flux'].dtype == np.float64 else 'E'
+    columns = [fits.Column(name='TIME', format='D', unit='BJD - 2457000, days', array=raw['time']),
+               fits.Column(name='FLUX', format=flux_format, array=raw['flux'])]
+    if raw['flux_err'] is not None:
+        columns.append(fits.Column(name='FLUX_ERR', format=flux_format, array=raw['flux_err']))
+    columns.append(fits.Column(name='QUALITY', format='J', array=raw['quality']))
+
+    table = fits.BinTableHDU.from_columns(columns, name='LIGHTCURVE')
+    table.header['TIMESYS'] = 'TDB'
+    table.header['BJDREFI'] = 2457000
+    table.header['BJDREFF'] = 0.0
+    fits.HDUList([primary, table]).writeto(fits_file, overwrite=True)
+
+def slim_flux_dtype(flux, flux_err):
+    """
+    float32 if storing flux (and its error) as float32 loses nothing
+    measurable: no value moves by more than SLIM_FLUX_TOLERANCE of the
+    median flux error (1e-4 of the median flux without errors); otherwise
+    float64
+    """
+    flux = np.asarray(flux, dtype=np.float64)
+    finite = np.isfinite(flux)
+    if not finite.any():
+        return np.float32
+    if flux_err is not None and np.isfinite(flux_err).any():
+        scale = np.nanmedian(np.abs(flux_err))
+    else:
+        scale = 1e-4 * np.median(np.abs(flux[finite]))
+    rounding = np.abs(flux[finite].astype(np.float32) - flux[finite]).max()
+    return np.float32 if rounding <= SLIM_FLUX_TOLERANCE * scale else np.float64
+
+def write_slim_fits(fits_file, raw):
+    """
+    Write light-curve arrays as a gzip-compressed minimal FITS file
+
+    The file is written under a temporary name, read back with
+    fits_loader and compared with what was meant to be stored, and only
+    then renamed to fits_file.
+
+    Parameters:
+    -----------
+    fits_file : str
+        File to write (keeps its .fits name)
+    raw : dict
+        Arrays as returned by fits_loader.read_lightcurve with
+        quality_bitmask=0, or lightcurve_archive.lightcurve_arrays()
+
+    Returns:
+        Bytes written
+    """
+    dtype = slim_flux_dtype(raw['flux'], raw['flux_err'])
+    slim = dict(raw, time=np.asarray(raw['time'], dtype=np.float64),
+                flux=np.asarray(raw['flux'], dtype=dtype),
+                quality=np.asarray(raw['quality'], dtype=np.int32))
+    if raw['flux_err'] is not None:
+        slim['flux_err'] = np.asarray(raw['flux_err'], dtype=dtype)
+
+    buffer = io.BytesIO()
+    write_fits(buffer, slim)
+    partial = os.path.join(os.path.dirname(fits_file), f'.{os.path.basename(fits_file)}.part')
+    with gzip.open(partial, 'wb', compresslevel=SLIM_COMPRESSLEVEL) as f:
+        f.write(buffer.getvalue())
+
+    stored = read_lightcurve(partial, quality_bitmask=0)
+    for key in ('time', 'flux', 'flux_err', 'quality'):
+        expected, found = slim[key], stored[key]
+        if (expected is None) != (found is None) or (expected is not None and (
+                found.dtype != expected.dtype or
+                not np.array_equal(found, expected, equal_nan=True))):
+            os.remove(partial)
+            raise ValueError(f"{fits_file}: slim round trip changed {key}")
+    if stored['tic_id'] != slim['tic_id'] or stored['sector'] != slim['sector']:
+        os.remove(partial)
+        raise ValueError(f"{fits_file}: slim round trip changed TIC/sector")
+
+    os.replace(partial, fits_file)
+    return os.path.getsize(fits_file)
+
+def is_slim(fits_file):
+    """
+    True if a FITS file is gzip-compressed (as slim files are)
+    """
+    with open(fits_file, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+def slim_directory(data_dir):
+    """
+    Rewrite every full-size FITS file in data_dir as a slim file
+
+    Already slim files are skipped, so an interrupted run can be rerun.
+    """
+    fits_files = sorted(glob(os.path.join(data_dir, '*.fits')))
+    print(f"Slimming {len(fits_files)} FITS files in {data_dir}")
+
+    converted = skipped = failed = 0
+    before = after = 0
+    for fits_file in fits_files:
+        if is_slim(fits_file):
+            skipped += 1
+            continue
+        try:
+            size = os.path.getsize(fits_file)
+            after += write_slim_fits(fits_file, read_lightcurve(fits_file, quality_bitmask=0))
+            before += size
+            converted += 1
+        except (ValueError, KeyError, OSError) as e:
+            print(f"  ✗ {os.path.basename(fits_file)}: {e}")
+            failed += 1
+
+    print(f"Slimmed {converted}, already slim {skipped}, failed {failed}")
+    if converted:
+        print(f"{before / 1024 ** 2:.1f} MB -> {after / 1024 ** 2:.1f} MB "
+              f"({before / max(after, 1):.1f}x smaller)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Rewrite full-size FITS files as slim, '
+                                                 'compressed files in place')
+    parser.add_argument('-d', '--data-dir', type=str, required=True,
+                        help='Directory containing FITS files')
+
+    args = parser.parse_args()
+
+    slim_directory(args.data_dir)
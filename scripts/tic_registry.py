@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Cross-run registry of TIC IDs already probed or downloaded
+
+Random-star surveys with different seeds (42, 2025, 9999, 7777, ...) used
+to draw independently, so nothing stopped two runs from querying or
+downloading the same star, and stars that came back without TESS data
+were queried again by the next run. The registry keeps one bitmap per
+state over the whole TIC ID range, shared by every run:
+
+    attempted   every TIC ID sent to MAST (including failed queries)
+    no_data     the search found no TESS light curve
+    downloaded  a light curve was saved (in any output directory)
+
+One bit per TIC ID is ~62 MB per state for IDs up to 500M. Each bitmap is
+a plain file (e.g. ../data/tic_registry/no_data.bits) that grows to the
+largest ID recorded, memory-mapped so lookups only touch the pages they
+need. Updates are buffered and OR'd into the files under an exclusive
+lock, so concurrent runs can share one registry.
+
+Register stars downloaded before the registry existed, and inspect it:
+
+    python tic_registry.py import -r ../data/tic_registry ../data/tess_random_*
+    python tic_registry.py stats -r ../data/tic_registry
+"""
+
+import os
+import fcntl
+import argparse
+from glob import glob
+
+import numpy as np
+
+from results_store import tic_from_name
+from lightcurve_archive import is_archive, list_entries
+
+STATES = ('attempted', 'no_data', 'downloaded')
+
+BITMAP_SUFFIX = '.bits'
+
+# Bitmap files grow in steps of this many bytes (8M TIC IDs)
+GROWTH = 1 << 20
+
+# Buffered records written per flush
+FLUSH_EVERY = 1000
+
+class TicRegistry:
+    """
+    Bitmaps of TIC IDs per state, stored in one directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._pending = {state: [] for state in STATES}
+
+    def _bitmap_path(self, state):
+        return os.path.join(self.path, state + BITMAP_SUFFIX)
+
+    def _load(self, state):
+        """
+        Read-only view of one bitmap (empty array if nothing recorded yet)
+        """
+        path = self._bitmap_path(state)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode='r')
+
+    def contains(self, state, tic_ids):
+        """
+        Boolean mask: which of tic_ids are recorded under state
+
+        Includes records of this process that are not flushed yet.
+        """
+        tic_ids = np.asarray(tic_ids, dtype=np.int64)
+        bitmap = self._load(state)
+        byte_index = tic_ids >> 3
+        inside = byte_index < len(bitmap)
+        found = np.zeros(len(tic_ids), dtype=bool)
+        found[inside] = (bitmap[byte_index[inside]] >> (tic_ids[inside] & 7)) & 1 == 1
+        if self._pending[state]:
+            found |= np.isin(tic_ids, self._pending[state])
+        return found
+
+    def seen(self, tic_ids):
+        """
+        Boolean mask of TIC IDs not worth querying again: already
+        downloaded, or searched without finding data. Failed queries
+        (network errors) count as attempted only, so they are retried.
+        """
+        return self.contains('downloaded', tic_ids) | self.contains('no_data', tic_ids)
+
+    def record(self, state, tic_id):
+        """
+        Mark tic_id under state (and as attempted); written on flush()
+        """
+        self._pending[state].append(int(tic_id))
+        if state != 'attempted':
+            self._pending['attempted'].append(int(tic_id))
+        if sum(len(ids) for ids in self._pending.values()) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        """
+        OR buffered records into the bitmap files under an exclusive lock
+        """
+        if not any(self._pending.values()):
+            return
+        with open(os.path.join(self.path, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            for state, ids in self._pending.items():
+                if not ids:
+                    continue
+                ids = np.asarray(ids, dtype=np.int64)
+                path = self._bitmap_path(state)
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                needed = int(ids.max() >> 3) + 1
+                with open(path, 'ab') as f:
+                    if needed > size:
+                        # Sparse where the file system supports it
+                        f.truncate(-(-needed // GROWTH) * GROWTH)
+                bitmap = np.memmap(path, dtype=np.uint8, mode='r+')
+                np.bitwise_or.at(bitmap, ids >> 3, (1 << (ids & 7)).astype(np.uint8))
+                bitmap.flush()
+                del bitmap
+        self._pending = {state: [] for state in STATES}
+
+    def count(self, state):
+        """
+        Number of TIC IDs recorded under state (flushed records only)
+        """
+        bitmap = self._load(state)
+        total = 0
+        for start in range(0, len(bitmap), GROWTH * 8):
+            total += int(np.unpackbits(bitmap[start:start + GROWTH * 8]).sum())
+        return total
+
+    def close(self):
+        self.flush()
+
+def import_downloads(registry, paths):
+    """
+    Record stars already saved as TIC_*.fits files or archive entries
+
+    Returns:
+        Number of TIC IDs recorded
+    """
+    recorded = 0
+    for path in paths:
+        if is_archive(path):
+            names = [entry['name'] for entry in list_entries(path)]
+        else:
+            names = [os.path.basename(f) for f in glob(os.path.join(path, '*.fits'))]
+        for name in names:
+            tic_id = tic_from_name(name)
+            if tic_id is not None:
+                registry.record('downloaded', tic_id)
+                recorded += 1
+    registry.flush()
+    return recorded
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Inspect or seed the cross-run TIC registry')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help='Mark stars in existing download '
+                                                       'directories/archives as downloaded')
+    import_parser.add_argument('-r', '--registry', type=str, required=True)
+    import_parser.add_argument('paths', nargs='+',
+                               help='Download directories or *.lcpack archives')
+
+    stats_parser = commands.add_parser('stats', help='Count TIC IDs per state')
+    stats_parser.add_argument('-r', '--registry', type=str, required=True)
+
+    args = parser.parse_args()
+
+    registry = TicRegistry(args.registry)
+    if args.command == 'import':
+        recorded = import_downloads(registry, args.paths)
+        print(f"✓ Recorded {recorded} downloaded stars in {args.registry}")
+    else:
+        for state in STATES:
+            print(f"{state:12s} {registry.count(state):>12,d}")
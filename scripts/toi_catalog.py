@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Local TOI catalog: TOI -> TIC, period, epoch and disposition
+
+Without it, the TOI downloader resolves every TOI number by name
+(lk.search_lightcurve('TOI-700')). That costs one name-resolution round
+trip to MAST per TOI, thousands of them in a full-catalog run. The TOI
+list published by ExoFOP (or the NASA Exoplanet Archive TOI table) has
+the TIC ID of every TOI already. This module ingests that CSV once into
+an indexed SQLite cache, so all requested TOIs resolve in one local
+query and the downloader searches by TIC ID directly:
+
+    wget -O ../data/toi_catalog.csv \\
+        "https://exofop.ipac.caltech.edu/tess/download_toi.php?sort=toi&output=csv"
+    python toi_catalog.py ingest ../data/toi_catalog.csv
+    python download_tess_toi.py -n 7000 --toi-catalog ../data/toi_catalog.sqlite
+
+The cache records when and from which file it was built. Opening it with
+the source file re-ingests automatically if the file changed, and a warning
+is printed once the cache is older than MAX_AGE_DAYS. The catalog periods
+and epochs are also available to the analysis side (planets_for_tics).
+"""
+
+import os
+import re
+import time
+import sqlite3
+import argparse
+
+import pandas as pd
+
+TOI_CATALOG_CACHE = '../data/toi_catalog.sqlite'
+
+# Warn when the cached catalog is older than this (new TOIs are released
+# every few weeks)
+MAX_AGE_DAYS = 30
+
+# Column name -> SQLite type, in table order
+TOI_COLUMNS = [
+    ('toi', 'TEXT PRIMARY KEY'),      # planet candidate, e.g. '700.01'
+    ('toi_number', 'INTEGER'),        # host star TOI number, e.g. 700
+    ('tic_id', 'INTEGER'),
+    ('disposition', 'TEXT'),          # TFOPWG disposition: PC, CP, KP, FP, ...
+    ('period', 'REAL'),               # days
+    ('epoch', 'REAL'),                # BJD of a transit midpoint
+    ('duration', 'REAL'),             # hours
+    ('depth', 'REAL'),                # ppm
+]
+
+# Accepted source column names (lower case, letters and digits only) for
+# the ExoFOP and NASA Exoplanet Archive TOI tables
+COLUMN_ALIASES = {
+    'toi': ('toi',),
+    'tic_id': ('ticid', 'tid', 'tic'),
+    'disposition': ('tfopwgdisposition', 'tfopwgdisp', 'disposition'),
+    'period': ('perioddays', 'plorbper', 'period'),
+    'epoch': ('epochbjd', 'pltranmid', 'epoch'),
+    'duration': ('durationhours', 'pltrandurh', 'duration'),
+    'depth': ('depthppm', 'pltrandep', 'depth'),
+}
+
+TOI_PATTERN = re.compile(r'TOI[-_ ]?(\d+)', re.IGNORECASE)
+
+# Values per IN (...) query, below SQLite's default limit of 999 parameters
+MAX_QUERY_PARAMS = 900
+
+def toi_number(name):
+    """
+    Host TOI number of a TOI name ('TOI-700', 'TOI 700.01', 700.01, ...)
+    """
+    if isinstance(name, str):
+        match = TOI_PATTERN.search(name)
+        return int(match.group(1)) if match else int(float(name))
+    return int(name)
+
+def _normalize(name):
+    return re.sub(r'[^a-z0-9]', '', str(name).lower())
+
+def read_toi_table(source):
+    """
+    Read an ExoFOP or NASA Exoplanet Archive TOI CSV (file path or URL)
+
+    Returns:
+        DataFrame with the TOI_COLUMNS columns
+    """
+    table = pd.read_csv(source, comment='#', low_memory=False)
+    columns = {_normalize(c): c for c in table.columns}
+    catalog = pd.DataFrame()
+    for name, aliases in COLUMN_ALIASES.items():
+        found = next((columns[a] for a in aliases if a in columns), None)
+        if found is None:
+            if name in ('toi', 'tic_id'):
+                raise ValueError(f"{source}: no {name} column")
+            catalog[name] = None
+        else:
+            catalog[name] = table[found]
+    toi = pd.to_numeric(catalog['toi'], errors='coerce')
+    tic_id = pd.to_numeric(catalog['tic_id'], errors='coerce')
+    catalog = catalog[toi.notna() & tic_id.notna()].copy()
+    catalog['toi'] = toi[catalog.index].map(lambda t: f'{t:.2f}')
+    catalog['toi_number'] = toi[catalog.index].astype(int)
+    catalog['tic_id'] = tic_id[catalog.index].astype('int64')
+    for name in ('period', 'epoch', 'duration', 'depth'):
+        catalog[name] = pd.to_numeric(catalog[name], errors='coerce')
+    catalog['disposition'] = catalog['disposition'].where(catalog['disposition'].notna(), None)
+    return catalog[[name for name, _ in TOI_COLUMNS]].drop_duplicates('toi')
+
+def _source_mtime(source):
+    try:
+        return os.path.getmtime(source)
+    except OSError:
+        # A URL
+        return None
+
+def ingest_catalog(source, cache_path=TOI_CATALOG_CACHE):
+    """
+    Build the cache from a TOI CSV, replacing any previous contents
+
+    The cache is written under a temporary name and renamed into place,
+    so a downloader reading it never sees a half-written catalog.
+
+    Returns:
+        Number of TOIs (planet candidates) ingested
+    """
+    catalog = read_toi_table(source)
+    tmp_path = cache_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        columns = ', '.join(f'{name} {sql_type}' for name, sql_type in TOI_COLUMNS)
+        conn.execute(f'CREATE TABLE tois ({columns})')
+        conn.execute('CREATE INDEX tois_number ON tois (toi_number)')
+        conn.execute('CREATE INDEX tois_tic ON tois (tic_id)')
+        conn.execute('CREATE TABLE catalog_info (key TEXT PRIMARY KEY, value TEXT)')
+        placeholders = ', '.join('?' * len(TOI_COLUMNS))
+        rows = catalog.astype(object).where(catalog.notna(), None).itertuples(index=False)
+        conn.executemany(f'INSERT INTO tois VALUES ({placeholders})', rows)
+        info = {'source': os.path.abspath(source) if os.path.exists(source) else source,
+                'source_mtime': _source_mtime(source), 'ingested': time.time()}
+        conn.executemany('INSERT INTO catalog_info VALUES (?, ?)',
+                         [(key, None if value is None else str(value))
+                          for key, value in info.items()])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, cache_path)
+    return len(catalog)
+
+class ToiCatalog:
+    """
+    Read access to an ingested TOI catalog cache
+    """
+
+    def __init__(self, cache_path=TOI_CATALOG_CACHE):
+        if not os.path.exists(cache_path):
+            raise FileNotFoundError(f"No TOI catalog at {cache_path}; build it with "
+                                    f"python toi_catalog.py ingest <toi_csv>")
+        self.path = cache_path
+        self.conn = sqlite3.connect(cache_path)
+        self.info = dict(self.conn.execute('SELECT key, value FROM catalog_info'))
+
+    def age_days(self):
+        """
+        Days since the cache was ingested
+        """
+        return (time.time() - float(self.info['ingested'])) / 86400
+
+    def is_stale(self, source=None):
+        """
+        True if source (default: the file the cache was built from) changed
+        since ingestion
+        """
+        source = source or self.info.get('source')
+        mtime = _source_mtime(source) if source else None
+        if mtime is None:
+            return False
+        return self.info.get('source_mtime') != str(mtime) or \
+            os.path.abspath(source) != self.info.get('source')
+
+    def toi_numbers(self):
+        """
+        Every host TOI number in the catalog, ascending
+        """
+        return [row[0] for row in
+                self.conn.execute('SELECT DISTINCT toi_number FROM tois ORDER BY toi_number')]
+
+    def resolve(self, tois):
+        """
+        Resolve TOIs to TIC IDs through the toi_number index
+
+        Parameters:
+        -----------
+        tois : list
+            TOI names or numbers ('TOI-700', 700, 700.01, ...)
+
+        Returns:
+            dict mapping host TOI number -> TIC ID (TOIs not in the catalog
+            are missing)
+        """
+        wanted = sorted({toi_number(t) for t in tois})
+        resolved = {}
+        for start in range(0, len(wanted), MAX_QUERY_PARAMS):
+            chunk = wanted[start:start + MAX_QUERY_PARAMS]
+            resolved.update(self.conn.execute(
+                f'SELECT DISTINCT toi_number, tic_id FROM tois '
+                f'WHERE toi_number IN ({", ".join("?" * len(chunk))})', chunk))
+        return resolved
+
+    def planets_for_tics(self, tic_ids):
+        """
+        Catalog entries (period, epoch, disposition, ...) of the TOIs on
+        the given stars
+
+        Returns:
+            DataFrame with the TOI_COLUMNS columns, one row per TOI
+        """
+        tic_ids = sorted({int(t) for t in tic_ids})
+        parts = []
+        for start in range(0, len(tic_ids), MAX_QUERY_PARAMS):
+            chunk = tic_ids[start:start + MAX_QUERY_PARAMS]
+            parts.append(pd.read_sql_query(
+                f'SELECT * FROM tois WHERE tic_id IN ({", ".join("?" * len(chunk))})',
+                self.conn, params=chunk))
+        if not parts:
+            return pd.DataFrame(columns=[name for name, _ in TOI_COLUMNS])
+        return pd.concat(parts, ignore_index=True)
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM tois').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+def open_catalog(path=TOI_CATALOG_CACHE, cache_path=None):
+    """
+    Open a TOI catalog, given either its cache or a source CSV
+
+    A CSV is ingested into cache_path (default: the CSV name with a
+    .sqlite suffix) the first time, and again whenever the CSV changes.
+    A warning is printed if the cache is older than MAX_AGE_DAYS.
+
+    Returns:
+        ToiCatalog
+    """
+    if path.endswith('.sqlite'):
+        catalog = ToiCatalog(path)
+        if catalog.is_stale():
+            source = catalog.info['source']
+            catalog.close()
+            print(f"TOI catalog source {source} changed - re-ingesting")
+            ingest_catalog(source, path)
+            catalog = ToiCatalog(path)
+    else:
+        cache_path = cache_path or os.path.splitext(path)[0] + '.sqlite'
+        catalog = ToiCatalog(cache_path) if os.path.exists(cache_path) else None
+        if catalog is None or catalog.is_stale(path):
+            if catalog:
+                catalog.close()
+            count = ingest_catalog(path, cache_path)
+            print(f"✓ Ingested {count} TOIs from {path} into {cache_path}")
+            catalog = ToiCatalog(cache_path)
+    if catalog.age_days() > MAX_AGE_DAYS:
+        print(f"⚠ TOI catalog {catalog.path} is {catalog.age_days():.0f} days old - "
+              f"newer TOIs are missing; download a fresh list and re-ingest")
+    return catalog
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build and query the local TOI catalog cache')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = commands.add_parser('ingest', help='Ingest an ExoFOP / Exoplanet Archive '
+                                                       'TOI CSV (file or URL)')
+    ingest_parser.add_argument('source')
+    ingest_parser.add_argument('-c', '--cache', type=str, default=TOI_CATALOG_CACHE,
+                               help=f'Cache file to write (default: {TOI_CATALOG_CACHE})')
+
+    resolve_parser = commands.add_parser('resolve', help='Print the TIC IDs of TOIs')
+    resolve_parser.add_argument('tois', nargs='+', help='TOI names or numbers, e.g. TOI-700')
+    resolve_parser.add_argument('-c', '--cache', type=str, default=TOI_CATALOG_CACHE)
+
+    info_parser = commands.add_parser('info', help='Summarize the cache')
+    info_parser.add_argument('-c', '--cache', type=str, default=TOI_CATALOG_CACHE)
+
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        count = ingest_catalog(args.source, args.cache)
+        print(f"✓ Ingested {count} TOIs from {args.source} into {args.cache}")
+    elif args.command == 'resolve':
+        catalog = open_catalog(args.cache)
+        resolved = catalog.resolve(args.tois)
+        for toi in args.tois:
+            tic_id = resolved.get(toi_number(toi))
+            print(f"{toi:12s} {'TIC ' + str(tic_id) if tic_id else 'not in catalog'}")
+    else:
+        catalog = open_catalog(args.cache)
+        print(f"{len(catalog)} TOIs on {len(catalog.toi_numbers())} stars")
+        print(f"Source: {catalog.info.get('source')}")
+        print(f"Ingested: {catalog.age_days():.1f} days ago")